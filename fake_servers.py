@@ -0,0 +1,486 @@
+"""
+Local stand-ins for the upstream services the bot talks to, for development and
+benchmarking without network access or API keys.
+
+    python fake_servers.py ws [port]         # Fake Bybit public spot WebSocket with random-walk prices
+    python fake_servers.py rest [port]       # Fake Bybit REST API replaying fixtures/
+    python fake_servers.py okx [port]        # Fake OKX REST API serving the same market in OKX's format
+    python fake_servers.py binance [port]    # Fake Binance REST API, likewise
+    python fake_servers.py telegram [port]   # Fake Telegram Bot API that accepts everything
+
+Point the bot at them with BYBIT_WS_URL=ws://127.0.0.1:<port>, BYBIT_REST_URL, OKX_REST_URL,
+BINANCE_REST_URL and TELEGRAM_API_URL=http://127.0.0.1:<port>. Gemini has no local endpoint;
+FakeGeminiModel stands in for genai.GenerativeModel instead.
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def ws_encode_frame(payload, opcode=0x1):
+    """Unmasked server-to-client frame."""
+    if isinstance(payload, str): payload = payload.encode('utf-8')
+    header = bytes([0x80 | opcode])
+    n = len(payload)
+    if n < 126: header += bytes([n])
+    elif n < 65536: header += bytes([126]) + struct.pack("!H", n)
+    else: header += bytes([127]) + struct.pack("!Q", n)
+    return header + payload
+
+
+def ws_read_frame(sock_file):
+    """Reads one (masked) client frame. Returns (opcode, payload bytes) or (None, None) on EOF."""
+    head = sock_file.read(2)
+    if len(head) < 2: return None, None
+    opcode, length = head[0] & 0x0F, head[1] & 0x7F
+    if length == 126: length = struct.unpack("!H", sock_file.read(2))[0]
+    elif length == 127: length = struct.unpack("!Q", sock_file.read(8))[0]
+    mask = sock_file.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+    data = sock_file.read(length)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+class _WebSocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server.fake
+        request_line = self.rfile.readline()
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+            if not line: break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if not request_line or 'sec-websocket-key' not in headers: return
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WS_GUID).encode()).digest()).decode()
+        self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        client = {'sock': self.request, 'topics': set(), 'lock': threading.Lock()}
+        with server.lock: server.clients.append(client)
+        try:
+            while True:
+                opcode, payload = ws_read_frame(self.rfile)
+                if opcode is None or opcode == 0x8: break
+                if opcode == 0x9: server._send(client, payload, opcode=0xA); continue
+                if opcode != 0x1: continue
+                server._on_message(client, json.loads(payload))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with server.lock:
+                if client in server.clients: server.clients.remove(client)
+
+
+class FakeBybitWebSocketServer:
+    """
+    Minimal Bybit v5 public WebSocket: answers subscribe/unsubscribe/ping like Bybit
+    and pushes whatever `publish()` is given to clients subscribed to the topic.
+    `drop_connections()` simulates a server-side disconnect to exercise reconnects.
+    """
+    def __init__(self, host="127.0.0.1", port=0):
+        self.clients = []
+        self.lock = threading.Lock()
+        self.subscribe_log = [] # Every topic list clients subscribed to, in order
+        self.server = socketserver.ThreadingTCPServer((host, port), _WebSocketHandler, bind_and_activate=False)
+        self.server.allow_reuse_address = True
+        self.server.daemon_threads = True
+        self.server.server_bind(); self.server.server_activate()
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"ws://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.drop_connections()
+        self.server.shutdown(); self.server.server_close()
+
+    def subscribed_topics(self):
+        with self.lock: return set().union(*(c['topics'] for c in self.clients)) if self.clients else set()
+
+    def publish(self, topic, data, msg_type="snapshot"):
+        message = json.dumps({"topic": topic, "type": msg_type, "ts": int(time.time() * 1000), "data": data})
+        with self.lock: targets = [c for c in self.clients if topic in c['topics']]
+        for client in targets: self._send(client, message)
+        return len(targets)
+
+    def drop_connections(self):
+        with self.lock: clients, self.clients = self.clients, []
+        for client in clients:
+            try: client['sock'].shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+
+    def _send(self, client, payload, opcode=0x1):
+        try:
+            with client['lock']: client['sock'].sendall(ws_encode_frame(payload, opcode))
+        except OSError:
+            pass
+
+    def _on_message(self, client, msg):
+        op, args = msg.get('op'), msg.get('args') or []
+        if op == 'subscribe':
+            client['topics'].update(args)
+            with self.lock: self.subscribe_log.append(list(args))
+        elif op == 'unsubscribe':
+            client['topics'].difference_update(args)
+        reply = {"success": True, "ret_msg": "pong" if op == 'ping' else "", "op": op, "conn_id": str(id(client))}
+        self._send(client, json.dumps(reply))
+
+
+def run_random_walk_feed(ws_server, interval=1.0):
+    """Publishes random-walk tickers, top of book and open 1h candles for every subscribed symbol."""
+    prices = {}
+    while True:
+        now_ms = int(time.time() * 1000)
+        candle_start = now_ms // 3600000 * 3600000
+        for topic in ws_server.subscribed_topics():
+            symbol = topic.rsplit('.', 1)[-1]
+            price = prices[symbol] = prices.get(symbol, random.uniform(0.5, 50000)) * random.uniform(0.999, 1.001)
+            if topic.startswith('tickers.'):
+                ws_server.publish(topic, {"symbol": symbol, "lastPrice": f"{price:.6f}", "price24hPcnt": f"{random.uniform(-0.1, 0.1):.4f}",
+                                          "highPrice24h": f"{price * 1.05:.6f}", "lowPrice24h": f"{price * 0.95:.6f}",
+                                          "volume24h": f"{random.uniform(1e3, 1e7):.2f}", "turnover24h": f"{random.uniform(1e5, 1e9):.2f}"})
+            elif topic.startswith('orderbook.'):
+                ws_server.publish(topic, {"s": symbol, "b": [[f"{price * 0.9999:.6f}", "1.5"]], "a": [[f"{price * 1.0001:.6f}", "2.0"]], "u": now_ms})
+            elif topic.startswith('kline.'):
+                ws_server.publish(topic, [{"start": candle_start, "end": candle_start + 3599999, "interval": "60",
+                                           "open": f"{price:.6f}", "high": f"{price * 1.002:.6f}", "low": f"{price * 0.998:.6f}",
+                                           "close": f"{price:.6f}", "volume": "12.5", "turnover": "1000", "confirm": False,
+                                           "timestamp": now_ms}])
+        time.sleep(interval)
+
+
+def load_fixture(name, fixtures_dir=FIXTURES_DIR):
+    with open(os.path.join(fixtures_dir, name), encoding='utf-8') as f: return json.load(f)
+
+
+class _FakeHTTPServer:
+    """ThreadingHTTPServer on a background thread, with a log of every request it served."""
+    handler = None
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.lock = threading.Lock()
+        self.calls = [] # (path or method, params) in arrival order
+        self.server = ThreadingHTTPServer((host, port), self.handler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown(); self.server.server_close()
+
+    def call_count(self):
+        with self.lock: return len(self.calls)
+
+    def _record(self, name, params):
+        with self.lock: self.calls.append((name, params))
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+KLINE_INTERVAL_MS = {'60': 3600000, '120': 7200000, '240': 14400000, '720': 43200000, 'D': 86400000, 'W': 604800000}
+KLINE_OFFSET_MS = {'W': 4 * 86400000} # Bybit's weekly candles open on Monday
+OKX_BARS = {'1H': '60', '2H': '120', '4H': '240', '12Hutc': '720', '1Dutc': 'D', '1Wutc': 'W'} # -> Bybit interval
+BINANCE_INTERVALS = {'1h': '60', '2h': '120', '4h': '240', '12h': '720', '1d': 'D', '1w': 'W'}
+
+
+class _ExchangeHandler(_JSONHandler):
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        fake._record(url.path, params)
+        if fake.delay: time.sleep(fake.delay)
+        if fake.failing: self.send_json({"error": "Service Unavailable"}, 503)
+        else: self.send_json(*fake.route(url.path, params))
+
+
+class _FakeExchangeServer(_FakeHTTPServer):
+    """
+    One market (the recorded Bybit tickers, instruments and BTCUSDT 1h kline page in fixtures/)
+    that each fake exchange serves in its own API format. Kline requests for any symbol,
+    interval and time range are answered from the recorded page: candle i of the requested
+    range maps to recorded row (open time / interval) mod N, rescaled to the symbol's last
+    ticker price, so long windows get realistic-looking, deterministic series without an
+    unbounded fixture. For failover tests, `delay` holds every answer that many seconds,
+    `failing` answers HTTP 503 and `unlisted` base symbols are treated as unknown pairs.
+    """
+    handler = _ExchangeHandler
+
+    def __init__(self, host="127.0.0.1", port=0, fixtures_dir=FIXTURES_DIR):
+        super().__init__(host, port)
+        self.tickers = load_fixture("bybit_tickers_spot.json", fixtures_dir)
+        self.instruments = load_fixture("bybit_instruments_spot.json", fixtures_dir)
+        recorded = load_fixture("bybit_kline_BTCUSDT_60.json", fixtures_dir)['result']['list']
+        self.kline_rows = [[float(x) for x in row[1:]] for row in reversed(recorded)] # Oldest first, without the timestamp
+        self.kline_base_close = self.kline_rows[-1][3]
+        self.last_prices = {t['symbol']: float(t['lastPrice']) for t in self.tickers['result']['list']}
+        self.delay, self.failing, self.unlisted = 0.0, False, set()
+
+    def listed(self, symbol):
+        """Whether BASEUSDT `symbol` is traded here."""
+        return symbol in self.last_prices and symbol[:-4] not in self.unlisted
+
+    def ticker_list(self, symbol=None):
+        """Recorded Bybit tickers of the listed pairs (just `symbol`'s if given)."""
+        return [t for t in self.tickers['result']['list'] if self.listed(t['symbol']) and (symbol is None or t['symbol'] == symbol)]
+
+    def instrument_list(self):
+        return [i for i in self.instruments['result']['list'] if self.listed(i['symbol'])]
+
+    def candles(self, symbol, interval, start=None, end=None, limit=200):
+        """
+        Up to `limit` (open_ts, open, high, low, close, volume, turnover) rows for the Bybit
+        `interval` candles opening in [start, end], newest first; [] if not listed.
+        """
+        if not self.listed(symbol) or interval not in KLINE_INTERVAL_MS: return []
+        step, offset = KLINE_INTERVAL_MS[interval], KLINE_OFFSET_MS.get(interval, 0)
+        end = int(time.time() * 1000) if end is None else end
+        last_open = (end - offset) // step * step + offset
+        first_open = last_open - (min(limit, 1000) - 1) * step
+        if start is not None: first_open = max(first_open, -(-(int(start) - offset) // step) * step + offset)
+        scale = self.last_prices[symbol] / self.kline_base_close
+        rows = []
+        for open_ts in range(last_open, first_open - 1, -step):
+            o, h, l, c, v, turnover = self.kline_rows[(open_ts // step) % len(self.kline_rows)]
+            rows.append((open_ts, o * scale, h * scale, l * scale, c * scale, v / scale, turnover))
+        return rows
+
+
+class FakeBybitRestServer(_FakeExchangeServer):
+    """Bybit v5 public market REST endpoints (kline, tickers, instruments-info) replayed from fixtures/."""
+
+    def route(self, path, params):
+        if path == "/v5/market/kline": return self.kline_response(params), 200
+        if path == "/v5/market/tickers": return self.tickers_response(params), 200
+        if path == "/v5/market/instruments-info": return dict(self.instruments, result=dict(self.instruments['result'], list=self.instrument_list())), 200
+        return {"retCode": 10001, "retMsg": f"Unknown path {path}", "result": {}}, 200
+
+    def tickers_response(self, params):
+        matches = self.ticker_list(params.get('symbol'))
+        if params.get('symbol') and not matches: return {"retCode": 10001, "retMsg": "Not supported symbols", "result": {}}
+        return dict(self.tickers, result={"category": "spot", "list": matches})
+
+    def kline_response(self, params):
+        symbol, interval = params.get('symbol', ''), params.get('interval', '60')
+        if not self.listed(symbol) or interval not in KLINE_INTERVAL_MS:
+            return {"retCode": 10001, "retMsg": "Not supported symbols", "result": {}}
+        rows = self.candles(symbol, interval, params.get('start'), int(params['end']) if params.get('end') else None, int(params.get('limit', 200)))
+        return {"retCode": 0, "retMsg": "OK", "result": {"category": "spot", "symbol": symbol,
+                "list": [[str(r[0])] + [f"{x:.8g}" for x in r[1:]] for r in rows]}, # Newest first, like Bybit
+                "retExtInfo": {}, "time": int(time.time() * 1000)}
+
+
+class FakeOkxRestServer(_FakeExchangeServer):
+    """OKX v5 public market endpoints (tickers, ticker, instruments, history-candles) over the same market."""
+
+    def route(self, path, params):
+        if path == "/api/v5/market/tickers": return self.ok([self.okx_ticker(t) for t in self.ticker_list()])
+        if path == "/api/v5/market/ticker":
+            matches = self.ticker_list(params.get('instId', '').replace('-', ''))
+            return self.ok([self.okx_ticker(t) for t in matches]) if matches else self.unknown()
+        if path == "/api/v5/public/instruments":
+            return self.ok([{"instType": "SPOT", "instId": f"{i['baseCoin']}-USDT", "baseCcy": i['baseCoin'], "quoteCcy": "USDT",
+                             "tickSz": i['priceFilter']['tickSize'], "state": "live"} for i in self.instrument_list()])
+        if path == "/api/v5/market/history-candles":
+            symbol, bar = params.get('instId', '').replace('-', ''), params.get('bar', '1m')
+            if not self.listed(symbol): return self.unknown()
+            if bar not in OKX_BARS: return {"code": "51000", "msg": "Parameter bar error", "data": []}, 400
+            start = int(params['before']) + 1 if params.get('before') else None
+            end = int(params['after']) - 1 if params.get('after') else None
+            rows = self.candles(symbol, OKX_BARS[bar], start, end, min(int(params.get('limit', 100)), 100))
+            return self.ok([[str(r[0])] + [f"{x:.8g}" for x in r[1:6]] + [f"{r[6]:.8g}", f"{r[6]:.8g}", "1"] for r in rows])
+        return {"code": "50000", "msg": f"Unknown path {path}", "data": []}, 404
+
+    @staticmethod
+    def ok(data):
+        return {"code": "0", "msg": "", "data": data}, 200
+
+    @staticmethod
+    def unknown():
+        return {"code": "51001", "msg": "Instrument ID does not exist", "data": []}, 200
+
+    @staticmethod
+    def okx_ticker(t):
+        last = float(t['lastPrice'])
+        return {"instType": "SPOT", "instId": f"{t['symbol'][:-4]}-USDT", "last": t['lastPrice'], "open24h": f"{last / (1 + float(t['price24hPcnt'])):.8g}",
+                "high24h": t['highPrice24h'], "low24h": t['lowPrice24h'], "vol24h": t['volume24h'], "volCcy24h": t['turnover24h'],
+                "bidPx": t['bid1Price'], "askPx": t['ask1Price'], "ts": str(int(time.time() * 1000))}
+
+
+class FakeBinanceRestServer(_FakeExchangeServer):
+    """Binance spot public endpoints (ticker/24hr, exchangeInfo, klines) over the same market."""
+
+    def route(self, path, params):
+        if path == "/api/v3/ticker/24hr":
+            if not params.get('symbol'): return [self.binance_ticker(t) for t in self.ticker_list()], 200
+            matches = self.ticker_list(params['symbol'])
+            return (self.binance_ticker(matches[0]), 200) if matches else self.invalid_symbol()
+        if path == "/api/v3/exchangeInfo":
+            return {"timezone": "UTC", "symbols": [{"symbol": i['symbol'], "status": "TRADING", "baseAsset": i['baseCoin'], "quoteAsset": "USDT",
+                    "filters": [{"filterType": "PRICE_FILTER", "tickSize": i['priceFilter']['tickSize']}]} for i in self.instrument_list()]}, 200
+        if path == "/api/v3/klines":
+            symbol = params.get('symbol', '')
+            if not self.listed(symbol): return self.invalid_symbol()
+            if params.get('interval') not in BINANCE_INTERVALS: return {"code": -1120, "msg": "Invalid interval."}, 400
+            interval = BINANCE_INTERVALS[params['interval']]
+            rows = self.candles(symbol, interval, params.get('startTime'), int(params['endTime']) if params.get('endTime') else None, int(params.get('limit', 500)))
+            return [[r[0]] + [f"{x:.8g}" for x in r[1:6]] + [r[0] + KLINE_INTERVAL_MS[interval] - 1, f"{r[6]:.8g}", 100, "0", "0", "0"]
+                    for r in reversed(rows)], 200 # Oldest first, like Binance
+        return {"code": -1000, "msg": f"Unknown path {path}"}, 404
+
+    @staticmethod
+    def invalid_symbol():
+        return {"code": -1121, "msg": "Invalid symbol."}, 400
+
+    @staticmethod
+    def binance_ticker(t):
+        return {"symbol": t['symbol'], "lastPrice": t['lastPrice'], "priceChangePercent": f"{float(t['price24hPcnt']) * 100:.3f}",
+                "highPrice": t['highPrice24h'], "lowPrice": t['lowPrice24h'], "volume": t['volume24h'], "quoteVolume": t['turnover24h'],
+                "bidPrice": t['bid1Price'], "askPrice": t['ask1Price']}
+
+
+class _TelegramHandler(_JSONHandler):
+    def do_POST(self):
+        fake = self.server.fake
+        method = self.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Type', '').startswith('multipart/'):
+            match = re.search(rb'name="chat_id"\r\n\r\n([^\r]*)', body)
+            params = {'chat_id': match.group(1).decode()} if match else {}
+        else:
+            params = {k: v[0] for k, v in parse_qs(body.decode('utf-8', 'replace')).items()}
+        fake._record(method, params)
+        self.send_json(fake.response_for(method, params))
+
+    do_GET = do_POST
+
+
+class FakeTelegramServer(_FakeHTTPServer):
+    """
+    Telegram Bot API that accepts every call and answers with the recorded response shape
+    for the method (fixtures/telegram.json), with fresh message ids. getUpdates returns nothing.
+    """
+    handler = _TelegramHandler
+
+    def __init__(self, host="127.0.0.1", port=0, fixtures_dir=FIXTURES_DIR):
+        super().__init__(host, port)
+        self.responses = load_fixture("telegram.json", fixtures_dir)
+        self.message_ids = iter(range(1000, 10 ** 12))
+
+    def calls_for(self, chat_id, methods=None):
+        with self.lock:
+            return [name for name, params in self.calls
+                    if params.get('chat_id') == str(chat_id) and (methods is None or name in methods)]
+
+    def response_for(self, method, params):
+        response = json.loads(json.dumps(self.responses.get(method, self.responses['default'])))
+        result = response.get('result')
+        if isinstance(result, dict) and 'message_id' in result:
+            with self.lock: result['message_id'] = next(self.message_ids)
+            result['date'] = int(time.time())
+            if params.get('chat_id'): result['chat']['id'] = int(params['chat_id'])
+        return response
+
+
+class _FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+        self.prompt_feedback = None
+
+
+class FakeGeminiModel:
+    """
+    Drop-in for genai.GenerativeModel replaying recorded responses (fixtures/gemini.json).
+    The first fixture whose `match` string occurs in the prompt is used. Forecast fixtures
+    are JSON with {projected_path} (and {support}/{resistance}) placeholders filled from the
+    prompt's last candle, since recorded timestamps would be stale. A `malformed_rate` share
+    of answers (seeded, so runs repeat) is drawn from the fixture's `malformed` variants
+    instead: fenced or truncated JSON, second timestamps, unit slips, prose. With
+    replay_latency, each call sleeps for the recorded latency_ms.
+    """
+    calls = 0
+    fixtures = None
+    malformed_rate = 0.0
+    rng = random.Random(0)
+
+    def __init__(self, model_name=None, replay_latency=False, fixtures_dir=FIXTURES_DIR):
+        if FakeGeminiModel.fixtures is None: FakeGeminiModel.fixtures = load_fixture("gemini.json", fixtures_dir)['responses']
+        self.replay_latency = replay_latency
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        FakeGeminiModel.calls += 1
+        fixture = next(f for f in self.fixtures if f['match'] in prompt)
+        if self.replay_latency: time.sleep(fixture.get('latency_ms', 0) / 1000)
+        text = fixture['text']
+        if fixture.get('malformed') and self.rng.random() < self.malformed_rate: text = self.rng.choice(fixture['malformed'])['text']
+        if '{projected_path' in text: text = self._fill_forecast(text, prompt)
+        return _FakeGeminiResponse(text)
+
+    @staticmethod
+    def _fill_forecast(text, prompt):
+        rows = re.findall(r"^(\d{12,}), [^,\n]+, [^,\n]+, [^,\n]+, ([^,\n]+),", prompt, re.M)
+        last_ts, last_close = (int(rows[-1][0]), float(rows[-1][1])) if rows else (int(time.time() * 1000), 100.0)
+        points = [(last_ts + i * 4 * 3600000, last_close * (1 + 0.004 * i)) for i in range(1, 7)]
+        def path(ts_scale=1, price_scale=1):
+            return ", ".join(f'{{"timestamp": {ts // ts_scale}, "price": {price * price_scale:.6g}}}' for ts, price in points)
+        return (text.replace('{projected_path}', path()).replace('{projected_path_seconds}', path(ts_scale=1000))
+                .replace('{projected_path_thousands}', path(price_scale=1000))
+                .replace('{support}', f"{last_close * 0.97:.6g}, {last_close * 0.94:.6g}").replace('{resistance}', f"{last_close * 1.03:.6g}"))
+
+
+if __name__ == "__main__":
+    kinds = {"ws": FakeBybitWebSocketServer, "rest": FakeBybitRestServer, "okx": FakeOkxRestServer,
+             "binance": FakeBinanceRestServer, "telegram": FakeTelegramServer}
+    if len(sys.argv) < 2 or sys.argv[1] not in kinds:
+        print(__doc__); sys.exit(1)
+    fake = kinds[sys.argv[1]](port=int(sys.argv[2]) if len(sys.argv) > 2 else 0).start()
+    print(f"🧪 Fake {sys.argv[1]} server listening on {fake.url}")
+    try:
+        if sys.argv[1] == "ws": run_random_walk_feed(fake)
+        else: fake.thread.join()
+    except KeyboardInterrupt: fake.stop()
@@ -0,0 +1,231 @@
+"""
+Load generator: replays a synthetic Telegram update stream (mixed commands and callbacks,
+many chats, Zipf-distributed symbols) through process_update() against the local fake
+Telegram and Bybit servers, at a fixed open-loop arrival rate.
+
+    python loadtest.py run [--rate 20] [--duration 30] [--workers 8] [--output FILE]
+    python loadtest.py emit FILE [--count 1000]      # Write the stream as getUpdates payloads
+    python loadtest.py run --replay FILE             # Replay a stream written by emit
+
+Updates arrive on schedule whether or not earlier ones have finished, so a dispatcher that
+can't keep up shows up as growing backlog and tail latency instead of a lower offered rate.
+--workers 1 matches run()'s one-update-at-a-time loop. Reported: throughput, latency
+percentiles from arrival to completion (overall and per command kind), time spent queued,
+dispatch backlog and TelegramOutbox depth sampled over the run.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import fake_servers
+from benchmark import BenchmarkEnv, percentiles, peak_rss_mb, git_commit, log
+
+COMMAND_MIX = { # kind -> relative weight, roughly what a busy price bot sees
+    'price': 28, 'text': 14, 'price_batch': 6, 'chart': 7, 'analyze': 2, 'predict': 2,
+    'cb_price': 14, 'cb_nav': 4, 'cb_chart': 3, 'cb_prices': 3, 'popular': 4, 'alert': 2,
+    'watchlist': 3, 'market': 2, 'start': 3, 'help': 2, 'unknown': 1,
+}
+SAMPLE_INTERVAL = 0.25 # Seconds between queue-depth samples
+
+
+class UpdateStream:
+    """
+    Deterministic (seeded) Telegram updates. Symbols and chats are both Zipf-distributed:
+    a few coins and a few heavy users account for most traffic, as in production.
+    """
+    def __init__(self, symbols, chats=5000, zipf_s=1.1, seed=36):
+        self.rng = random.Random(seed)
+        self.symbols = symbols
+        self.symbol_weights = [1 / (rank + 1) ** zipf_s for rank in range(len(symbols))]
+        self.chat_ids = [100000 + i for i in range(chats)]
+        self.chat_weights = [1 / (rank + 1) ** zipf_s for rank in range(chats)]
+        self.kinds, self.kind_weights = list(COMMAND_MIX), list(COMMAND_MIX.values())
+        self.update_id, self.message_id = 500000000, 1000
+
+    def symbol(self):
+        return self.rng.choices(self.symbols, self.symbol_weights)[0]
+
+    def next(self):
+        kind = self.rng.choices(self.kinds, self.kind_weights)[0]
+        chat_id = self.rng.choices(self.chat_ids, self.chat_weights)[0]
+        sym = self.symbol()
+        text = {
+            'price': f"/price {sym}", 'text': sym if self.rng.random() < 0.7 else sym.lower(),
+            'price_batch': "/price " + " ".join({self.symbol() for _ in range(self.rng.randint(3, 6))}),
+            'chart': f"/chart {sym} {self.rng.choice(['1h', '4h', '1d'])}", 'analyze': f"/analyze {sym}",
+            'predict': f"/predict {sym} {self.rng.choice(['1d', '3d', '7d'])}", 'popular': "/popular",
+            'alert': f"/alert {sym} move {self.rng.choice([3, 5, 10])}",
+            'watchlist': self.rng.choice(["/watchlist", f"/watchlist add {sym}"]), 'market': "/market",
+            'start': "/start", 'help': "/help", 'unknown': f"{sym}X{self.rng.randint(1, 99)}",
+        }.get(kind)
+        self.update_id += 1; self.message_id += 1
+        sender = {'id': chat_id, 'is_bot': False, 'first_name': f"User{chat_id}"}
+        chat = {'id': chat_id, 'first_name': sender['first_name'], 'type': 'private'}
+        if text is not None:
+            update = {'update_id': self.update_id, 'message': {'message_id': self.message_id, 'from': sender, 'chat': chat,
+                                                               'date': int(time.time()), 'text': text}}
+        else:
+            data = {'cb_price': f"price_{sym}", 'cb_nav': f"nav_{self.rng.choice([9, 18])}",
+                    'cb_chart': f"chart_{sym}_4h_7", 'cb_prices': "prices_popular"}[kind]
+            update = {'update_id': self.update_id, 'callback_query': {
+                'id': str(self.rng.getrandbits(60)), 'from': sender, 'chat_instance': str(chat_id), 'data': data,
+                'message': {'message_id': self.message_id - 1, 'from': {'id': 1, 'is_bot': True}, 'chat': chat, 'date': int(time.time())}}}
+        return kind, update
+
+
+def update_kind(update):
+    if 'callback_query' in update:
+        data = update['callback_query']['data']
+        return 'cb_' + {'prices_popular': 'prices'}.get(data, data.split('_')[0])
+    text = update['message']['text']
+    return text.split()[0].lstrip('/') if text.startswith('/') else 'text'
+
+
+def popular_symbols():
+    """Fixture tickers by 24h turnover, most traded first (the Zipf rank order)."""
+    tickers = fake_servers.load_fixture("bybit_tickers_spot.json")['result']['list']
+    tickers.sort(key=lambda t: float(t['turnover24h']), reverse=True)
+    return [t['symbol'][:-4] for t in tickers if t['symbol'].endswith('USDT')]
+
+
+class LoadRun:
+    def __init__(self, env, workers):
+        self.env = env
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.completions = ThreadPoolExecutor(max_workers=256) # Waits for admitted jobs' replies without holding a worker
+        self.lock = threading.Lock()
+        self.submitted = self.started = self.completed = self.errors = 0
+        self.latency_ms, self.queued_ms, self.by_kind = [], [], {}
+        self.samples = [] # (seconds since start, dispatch backlog, outbox depth)
+
+    def _handle(self, kind, update, arrival):
+        begin = time.perf_counter()
+        with self.lock: self.started += 1
+        try:
+            self.env.bot.process_update(update)
+        except Exception: # process_update logs its own errors; this only catches crashes in the harness path
+            with self.lock: self.errors += 1
+        self.completions.submit(self._complete, kind, update['update_id'], arrival, begin)
+
+    def _complete(self, kind, update_id, arrival, begin):
+        """Latency runs to the reply: admitted jobs (charts, AI) are delivered after process_update returns."""
+        self.env.bot.admission.wait_for_update(update_id, timeout=300)
+        end = time.perf_counter()
+        with self.lock:
+            self.completed += 1
+            self.latency_ms.append((end - arrival) * 1000); self.queued_ms.append((begin - arrival) * 1000)
+            self.by_kind.setdefault(kind, []).append((end - arrival) * 1000)
+
+    def _sample(self, t0, stop):
+        while not stop.wait(SAMPLE_INTERVAL):
+            with self.lock: backlog = self.submitted - self.started
+            self.samples.append((round(time.perf_counter() - t0, 2), backlog, self.env.bot.telegram_outbox.queue_depth()))
+
+    def run(self, updates, rate, seed=36):
+        """Dispatches (kind, update) pairs at Poisson arrivals of `rate` per second. Returns (offered, total) seconds."""
+        rng, stop = random.Random(seed), threading.Event()
+        t0 = next_arrival = time.perf_counter()
+        sampler = threading.Thread(target=self._sample, args=(t0, stop), daemon=True); sampler.start()
+        for kind, update in updates:
+            next_arrival += rng.expovariate(rate)
+            delay = next_arrival - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            with self.lock: self.submitted += 1
+            self.pool.submit(self._handle, kind, update, next_arrival)
+        offered = time.perf_counter() - t0
+        self.pool.shutdown(wait=True)
+        self.completions.shutdown(wait=True)
+        stop.set(); sampler.join()
+        return offered, time.perf_counter() - t0
+
+
+def run(args):
+    if args.replay:
+        with open(args.replay) as f: updates = [u for line in f for u in json.loads(line)['result']]
+        stream = [(update_kind(u), u) for u in updates]
+    else:
+        gen = UpdateStream(popular_symbols(), chats=args.chats, zipf_s=args.zipf, seed=args.seed)
+        stream = [gen.next() for _ in range(int(args.rate * args.duration))]
+    env = BenchmarkEnv(replay_latency=args.replay_latency, lift_telegram_limits=not args.telegram_limits)
+    load = LoadRun(env, args.workers)
+    log(f"🚦 {len(stream)} updates at {args.rate}/s with {args.workers} worker(s)...")
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            offered, wall = load.run(stream, args.rate, args.seed)
+        telegram_calls = env.telegram.call_count()
+        bybit_calls = env.bybit.call_count()
+    finally:
+        env.close()
+
+    backlog = [s[1] for s in load.samples] or [0]
+    outbox = [s[2] for s in load.samples] or [0]
+    report = {'schema': 1, 'timestamp': int(time.time()), 'git_commit': git_commit(), 'cpu_count': os.cpu_count(),
+              'config': {'rate': args.rate, 'duration': args.duration, 'workers': args.workers, 'chats': args.chats,
+                         'zipf_s': args.zipf, 'seed': args.seed, 'replay': args.replay, 'replay_latency': args.replay_latency,
+                         'telegram_limits': args.telegram_limits},
+              'updates': len(stream), 'completed': load.completed, 'errors': load.errors,
+              'offered_rate': round(len(stream) / offered, 2), 'throughput': round(load.completed / wall, 2),
+              'wall_seconds': round(wall, 2), 'drain_seconds': round(wall - offered, 2),
+              'latency_ms': percentiles(load.latency_ms) | {'p999': round(float(np.percentile(load.latency_ms, 99.9)), 2) if load.latency_ms else None},
+              'queued_ms': percentiles(load.queued_ms),
+              'latency_ms_by_kind': {kind: percentiles(v) | {'count': len(v)} for kind, v in sorted(load.by_kind.items())},
+              'backlog': {'max': max(backlog), 'mean': round(sum(backlog) / len(backlog), 1)},
+              'outbox_depth': {'max': max(outbox), 'mean': round(sum(outbox) / len(outbox), 1)},
+              'upstream_calls': {'telegram': telegram_calls, 'bybit': bybit_calls, 'gemini': fake_servers.FakeGeminiModel.calls},
+              'peak_rss_mb': peak_rss_mb(), 'samples': load.samples}
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(text + "\n")
+        log(f"✅ Results written to {args.output}")
+    else:
+        print(text)
+    lat = report['latency_ms']
+    log(f"throughput {report['throughput']}/s (offered {report['offered_rate']}/s), drain {report['drain_seconds']}s")
+    log(f"latency p50 {lat['p50']}ms  p90 {lat['p90']}ms  p99 {lat['p99']}ms  p99.9 {lat['p999']}ms  max {lat['max']}ms")
+    log(f"backlog max {report['backlog']['max']}  outbox max {report['outbox_depth']['max']}  errors {load.errors}")
+    for kind, stats in report['latency_ms_by_kind'].items():
+        log(f"  {kind:<12} n={stats['count']:<5} p50 {stats['p50']:>9.1f}ms  p99 {stats['p99']:>9.1f}ms")
+
+
+def emit(args):
+    """Writes the stream as getUpdates responses, batches of up to 100 like Telegram's long poll."""
+    gen = UpdateStream(popular_symbols(), chats=args.chats, zipf_s=args.zipf, seed=args.seed)
+    updates = [gen.next()[1] for _ in range(args.count)]
+    with open(args.file, 'w') as f:
+        for i in range(0, len(updates), 100): f.write(json.dumps({'ok': True, 'result': updates[i:i + 100]}) + "\n")
+    log(f"✅ Wrote {len(updates)} updates to {args.file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic Telegram traffic through the bot.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("run", "emit"):
+        p = sub.add_parser(name)
+        p.add_argument("--chats", type=int, default=5000, help="Distinct chat ids (Zipf-weighted)")
+        p.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent for symbols and chats")
+        p.add_argument("--seed", type=int, default=36)
+        if name == "emit":
+            p.add_argument("file"); p.add_argument("--count", type=int, default=1000)
+            p.set_defaults(func=emit)
+            continue
+        p.add_argument("--rate", type=float, default=20, help="Updates per second (Poisson arrivals)")
+        p.add_argument("--duration", type=float, default=30, help="Seconds of traffic to generate")
+        p.add_argument("--workers", type=int, default=8, help="Concurrent process_update() calls (1 = run()'s serial loop)")
+        p.add_argument("--replay", help="getUpdates JSONL written by 'emit' instead of a generated stream")
+        p.add_argument("--replay-latency", action="store_true", help="Sleep for Gemini's recorded latency on each call")
+        p.add_argument("--telegram-limits", action="store_true", help="Keep the outbox's real Telegram rate limits")
+        p.add_argument("--output", help="Write JSON results here instead of stdout")
+        p.set_defaults(func=run)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,42 +11,2262 @@ import re
 import io
 import base64
 import uuid # For unique request IDs
+import bisect
+import heapq
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, TimeoutError as FuturesTimeoutError, wait as wait_futures, FIRST_COMPLETED
+import itertools
+import logging
+import random
+import signal
+import sys
+import cProfile
+import pstats
+import tracemalloc
+import linecache
+import importlib
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+import resource
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import cached_property, lru_cache
 
-# For chart generation
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib.patches import Rectangle
 import numpy as np
-import pandas as pd
 
 # Simple HTTP server for webhook (alternative to polling)
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
 import urllib.parse
 
-# For Gemini API
-import google.generativeai as genai
+# Optional: live market data over Bybit's public WebSocket
+try:
+    import websocket # websocket-client
+except ImportError:
+    websocket = None
+
+# Worker profile: 'full', or 'price' to serve prices, alerts and watchlists without ever
+# importing the charting, pandas and Gemini stacks (chart/AI commands get a short notice)
+WORKER_PROFILE = os.environ.get("WORKER_PROFILE", "full")
+PRICE_ONLY_UNAVAILABLE = {'chart', 'predict', 'pedict', 'analyze', 'market', 'callback_chart', 'callback_market'} # Plus /portfolio history
+
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that imports it on first attribute access, then runs
+    on_load(module) once. Modules listed in LazyModule.blocked refuse to load, which is
+    how the price-only profile guarantees they stay out of the process.
+    """
+    blocked = set()
+
+    def __init__(self, name, on_load=None):
+        self.__dict__.update(_name=name, _on_load=on_load, _module=None, _lock=threading.Lock())
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                if self._name in LazyModule.blocked:
+                    raise ImportError(f"{self._name} is not loaded in the '{WORKER_PROFILE}' worker profile")
+                start = time.perf_counter()
+                module = importlib.import_module(self._name)
+                if self._on_load: self._on_load(module)
+                METRICS.observe('bot_stage_seconds', time.perf_counter() - start, stage='import', module=self._name)
+                log.info("Loaded %s in %.2fs", self._name, time.perf_counter() - start)
+                self.__dict__['_module'] = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+
+def _configure_gemini(module):
+    module.configure(api_key=GEMINI_API_KEY)
+
+def _configure_matplotlib(module):
+    import matplotlib.style
+    matplotlib.style.use('dark_background')
+
+# Charts use Figure + FigureCanvasAgg directly, never pyplot: no global figure registry to leak into
+mfigure = LazyModule("matplotlib.figure", on_load=_configure_matplotlib)
+magg = LazyModule("matplotlib.backends.backend_agg")
+mticker = LazyModule("matplotlib.ticker")
+mdates = LazyModule("matplotlib.dates")
+mpatches = LazyModule("matplotlib.patches")
+mcollections = LazyModule("matplotlib.collections")
+pd = LazyModule("pandas")
+genai = LazyModule("google.generativeai", on_load=_configure_gemini) # Configured on first use, not at import
+flask = LazyModule("flask") # Only for the interactive chart endpoint
+if WORKER_PROFILE == 'price':
+    LazyModule.blocked.update({"matplotlib.figure", "matplotlib.backends.backend_agg", "matplotlib.ticker", "matplotlib.dates",
+                               "matplotlib.patches", "matplotlib.collections", "pandas", "google.generativeai", "flask"})
 
 # Gemini API Key (Ideally, use environment variables or a secrets manager)
 GEMINI_API_KEY = "GEMINI_API_KEY"
-if GEMINI_API_KEY and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY_HERE": # Basic check
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        print("✅ Gemini API configured.")
-    except Exception as e:
-        print(f"❌ Error configuring Gemini API: {e}")
-        GEMINI_API_KEY = None # Disable Gemini features if config fails
+if WORKER_PROFILE == 'price':
+    GEMINI_API_KEY = None
+elif GEMINI_API_KEY and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY_HERE": # Basic check
+    if multiprocessing.current_process().name == "MainProcess": print("✅ Gemini API key set; the client is loaded on first use.") # Not again per render worker
 else:
-    print("⚠️ Gemini API key not set or is a placeholder. Gemini features will be disabled.")
+    if multiprocessing.current_process().name == "MainProcess": print("⚠️ Gemini API key not set or is a placeholder. Gemini features will be disabled.")
     GEMINI_API_KEY = None
 
+# Upstream endpoints, overridable to point the bot at local fakes (see fake_servers.py)
+BYBIT_REST_URL = os.environ.get("BYBIT_REST_URL", "https://api.bybit.com")
+OKX_REST_URL = os.environ.get("OKX_REST_URL", "https://www.okx.com")
+BINANCE_REST_URL = os.environ.get("BINANCE_REST_URL", "https://api.binance.com")
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Local candle store (closed candles survive restarts; see CandleStore)
+DATA_DIR = os.environ.get("BOT_DATA_DIR", "data")
+CANDLE_STORE_DIR = os.path.join(DATA_DIR, "candles")
+BOT_DB_PATH = os.path.join(DATA_DIR, "bot.db") # SQLite file shared by alerts and other per-user state
+JOURNAL_RESUME_MAX_AGE = 900 # Seconds; updates left unfinished longer than this are dropped at startup, not resumed
+JOURNAL_RETENTION = 24 * 3600 # Seconds finished update ids are kept so redeliveries are recognised
+BYBIT_INTERVAL_MAP = {'1h': '60', '2h': '120', '4h': '240', '12h': '720', '1d': 'D', '1w': 'W'}
+INTERVAL_MS = {'1h': 3600000, '2h': 2 * 3600000, '4h': 4 * 3600000, '12h': 12 * 3600000,
+               '1d': 24 * 3600000, '1w': 7 * 24 * 3600000}
+INTERVAL_OFFSET_MS = {'1w': 4 * 24 * 3600000} # Weekly candles open on Monday; the epoch was a Thursday
+CHART_INTERVALS = ['1h', '2h', '4h', '12h', '1d', '1w']
+CHART_DEFAULT_DAYS = {'1h': 3, '2h': 5, '4h': 7, '12h': 14, '1d': 30, '1w': 180}
+RESAMPLE_BASE_INTERVAL = '1h' # Coarser timeframes are aggregated from this series
+MAX_RESAMPLE_BASE_CANDLES = 24 * 400 # Longer windows fall back to Bybit's native interval
+KLINE_PAGE_LIMIT = 1000 # Bybit's max candles per /v5/market/kline request
+KLINE_FETCH_WORKERS = 4 # Parallel page requests for long history ranges
+SYMBOL_FETCH_WORKERS = 8 # Per-symbol candle loads fanned out by one request (kept off the page pool they wait on)
+BYBIT_REQUESTS_PER_SEC = 10 # Well under Bybit's public per-IP limit
+OKX_REQUESTS_PER_SEC = 10 # OKX allows 20 per 2s per IP on market data
+BINANCE_REQUESTS_PER_SEC = 10
+
+# Market data sources (see MarketDataRouter), most preferred first; the live WebSocket feed is always Bybit's
+EXCHANGES = [e.strip().lower() for e in os.environ.get("EXCHANGES", "bybit,okx,binance").split(",") if e.strip()]
+EXCHANGE_HEDGE_DELAY = 0.4 # Seconds without an answer before the next exchange is asked too (per kline page)
+EXCHANGE_TIMEOUT = 10 # Seconds per upstream request
+EXCHANGE_BREAKER_FAILURES = 5 # Consecutive errors that open an exchange's circuit
+EXCHANGE_BREAKER_COOLDOWN = 30 # Seconds an open circuit skips the exchange before letting one trial request through
+EXCHANGE_WORKERS = 16
+CHART_MAX_CANDLES = 400 # Longer series are decimated (OHLC-aware) before drawing
+CANDLE_DTYPE = np.dtype([('ts', '<i8'), ('open', '<f8'), ('high', '<f8'),
+                         ('low', '<f8'), ('close', '<f8'), ('volume', '<f8')])
+
+# Hot-data cache (see MemoryCache / SharedCache); 'shared' lets every bot process on the host use one copy
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory") # 'memory' (per process) or 'shared' (SQLite file)
+CACHE_DB_PATH = os.environ.get("CACHE_DB_PATH", os.path.join(DATA_DIR, "cache.db"))
+CACHE_MAX_ENTRIES = 2048 # In-process LRU bound
+CACHE_LEASE_TTL = 30 # Seconds a compute lease lasts, so a crashed process can't block a key for long
+CACHE_LEASE_POLL = 0.05 # Seconds between checks while another process computes a key
+SYMBOLS_CACHE_TTL = 3600
+KLINE_TAIL_TTL = 10 # Seconds a fetched open-candle tail is reused; sets how fresh chart data is
+CHART_CACHE_TTL = 300 # Rendered charts are keyed by their candles, so this only bounds memory
+GEMINI_CACHE_TTL = 900 # Answers are keyed by the exact prompt (which embeds the candles)
+
+# Replies pre-built for the popular coins on each candle close (see run_precompute_loop)
+PRECOMPUTE_ENABLED = os.environ.get("PRECOMPUTE_ENABLED", "1") == "1"
+PRECOMPUTE_AI = os.environ.get("PRECOMPUTE_AI", "0") == "1" # Also pre-run pattern analysis and forecasts (Gemini calls every close)
+PRECOMPUTE_INTERVALS = {'1h': '1d', '4h': '3d', '1d': '7d'} # Chart interval -> the /predict period whose history it is
+PRECOMPUTE_SPREAD = 0.1 # Fraction of the shortest closed interval one close's jobs are spread over
+PRECOMPUTE_SPREAD_MAX = 600 # Seconds
+PRECOMPUTE_CLOSE_DELAY = 5 # Seconds after a close before starting, so Bybit has the closed candle
+PRECOMPUTE_MAX_AGE = int(os.environ.get("PRECOMPUTE_MAX_AGE", "180")) # Seconds a pre-built chart or forecast is served; later requests build fresh
+FORECAST_PERIODS = {'24h': ("next 24 hours", '1h', 7), '1d': ("next 1 day", '1h', 7), # /predict period -> (horizon,
+                    '3d': ("next 3 days", '4h', 21), '7d': ("next 7 days", '1d', 60)}  # history interval, history days)
+
+# Structured forecasts from Gemini (see parse_forecast)
+FORECAST_HORIZONS = {"next 24 hours": (6, 1), "next 1 day": (5, 1), "next 3 days": (3, 3), "next 7 days": (7, 7)} # -> (path points, days)
+FORECAST_TRENDS = ('bullish', 'bearish', 'sideways', 'volatile')
+FORECAST_PRICE_BAND = 0.5 # Path prices further than this fraction from the last close are rejected (usually a unit slip)
+FORECAST_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'trend': {'type': 'string', 'enum': list(FORECAST_TRENDS)},
+        'support': {'type': 'array', 'items': {'type': 'number'}},
+        'resistance': {'type': 'array', 'items': {'type': 'number'}},
+        'analysis': {'type': 'string'},
+        'path': {'type': 'array', 'items': {'type': 'object', 'properties': {'timestamp': {'type': 'integer'}, 'price': {'type': 'number'}},
+                                            'required': ['timestamp', 'price']}},
+    },
+    'required': ['trend', 'support', 'resistance', 'analysis', 'path'],
+}
+GEMINI_REPAIR_ATTEMPTS = 1 # Follow-up calls showing Gemini its rejected JSON and why
+
+# Live market data (see MarketDataFeed); falls back to REST when disabled or stale
+MARKET_FEED_ENABLED = os.environ.get("MARKET_FEED_ENABLED", "1") == "1"
+BYBIT_WS_URL = os.environ.get("BYBIT_WS_URL", "wss://stream.bybit.com/v5/public/spot")
+MARKET_FEED_MAX_SYMBOLS = 60 # Popular coins plus the most recently queried ones
+MARKET_FEED_TICKER_MAX_AGE = 30 # Seconds before a streamed ticker is considered stale
+
+# Price alerts (see AlertEngine)
+ALERT_MAX_PER_CHAT = 50
+ALERT_POLL_INTERVAL = 15 # Seconds between bulk-ticker sweeps for symbols the live feed doesn't cover
+ALERT_FLUSH_INTERVAL = 1 # Triggered alerts are batched into one message per chat at this cadence
+TICKER_SNAPSHOT_TTL = 5 # Seconds a bulk /v5/market/tickers snapshot is reused
+TICKER_SNAPSHOT_KEEP = 600 # Seconds a snapshot may still be served while refreshes fail
+WATCHLIST_MAX_SYMBOLS = 50
+MARKET_OVERVIEW_DEFAULT = 24 # Coins in the /market grid (top by 24h turnover)
+MARKET_OVERVIEW_MAX = 48
+MARKET_OVERVIEW_COLUMNS = 6
+MARKET_OVERVIEW_REFRESH = 60 # Seconds a rendered /market image is reused
+PORTFOLIO_MAX_POSITIONS = 200 # Per chat
+PORTFOLIO_SHOW_ROWS = 30 # Largest positions listed by /portfolio; the rest are summed up
+PORTFOLIO_HISTORY_DAYS = 30
+PORTFOLIO_HISTORY_INTERVAL = '4h' # Resampled from the hourly series like chart timeframes
+PORTFOLIO_HISTORY_MAX_LAG = 6 * 3600 # Seconds the stored hourly series may lag before history refreshes it; live prices end the line
+
+# Outbound Telegram scheduling (see TelegramOutbox)
+TELEGRAM_GLOBAL_RATE = 30 # Messages per second across all chats
+TELEGRAM_CHAT_RATE = 1 # Messages per second to one private chat
+TELEGRAM_GROUP_RATE = 20 / 60 # Messages per second to one group
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_SENDER_THREADS = 8
+TELEGRAM_MAX_RETRIES = 3
+TELEGRAM_GLOBAL_429_CHATS = 3 # 429s blocking this many chats at once are taken as the global limit
+# Lower goes first: callback answers, then edits/deletes, then new messages, then photos
+TELEGRAM_PRIORITY = {'answerCallbackQuery': 0, 'editMessageText': 1, 'deleteMessage': 1,
+                     'sendChatAction': 2, 'sendMessage': 2, 'sendPhoto': 3}
+TELEGRAM_CHAT_LIMITED = {'editMessageText', 'sendMessage', 'sendPhoto'} # Methods that count against per-chat limits
+RESPONSE_FAST_DEADLINE = 0.7 # Replies ready within this many seconds skip the chat action
+CHAT_ACTION_REFRESH = 4 # Telegram shows a chat action for ~5s, so resend it while still working
+RESPONSE_WORKERS = 8
+
+# Chart rendering memory bounds (see RenderGuard)
+RENDER_WORKERS = 2 # Render worker processes; each figure peaks at tens of MB
+RENDER_RECYCLE_CHARTS = int(os.environ.get("RENDER_RECYCLE_CHARTS", "500")) # Renders before the workers are replaced
+RENDER_RECYCLE_MB = int(os.environ.get("RENDER_RECYCLE_MB", "128")) # ...or a worker's RSS growth since its first render
+RENDER_MEMORY_CEILING_MB = int(os.environ.get("RENDER_MEMORY_CEILING_MB", "1024")) # Refuse renders above this RSS (bot plus workers); 0 disables
+
+# Admission control for expensive commands (see AdmissionController); costs are in /price-sized units
+ADMISSION_COSTS = {'chart': 20, 'portfolio': 40, 'analyze': 150, 'predict': 300}
+ADMISSION_WORKERS = 4 # Jobs running at once, which also bounds concurrent Gemini calls
+ADMISSION_QUEUE_MAX_COST = 3000 # Queued work beyond this is refused with a "busy" reply
+ADMISSION_QUEUE_DEADLINE = 30 # Seconds a job may wait to start before it is answered "busy" instead
+ADMISSION_SECONDS_PER_COST = 0.02 # Queue order is arrival + cost * this: cheap jobs overtake expensive ones, none starve
+ADMISSION_CHAT_QUOTA = (1200, 600) # (cost per minute, burst) per chat
+ADMISSION_USER_QUOTA = (900, 600) # (cost per minute, burst) per user, across chats
+ADMISSION_TRACKED_CALLERS = 10000 # Quota buckets kept; the least recently used are dropped
+ADMISSION_MERGED_COST = 5 # Charged for joining an identical job: no compute, but its reply is still sent to the caller
+REQUEST_ID_SLOT = "[{request_id}]" # Where a shared /analyze or /predict reply shows each caller's own request id
+
+# Repeated inline-button taps (see CallbackGate)
+CALLBACK_DEBOUNCE = 3 # Seconds after a tap's reply during which the same tap on the same message is dropped
+CALLBACK_STALE = 120 # A tap still in flight after this long is assumed lost, and repeats run again
+CALLBACK_ANSWER_DEADLINE = 10 # Taps are answered only this soon; Telegram rejects late answers
+CALLBACK_TRACKED_KEYS = 10000 # Taps remembered; the least recently used are dropped
+
+# Interactive charts on a local web endpoint (see create_chart_app), drawn in the browser from compact candle payloads
+CHART_WEB_PORT = int(os.environ.get("CHART_WEB_PORT", "0")) # 0 disables
+CHART_WEB_URL = os.environ.get("CHART_WEB_URL", "").rstrip("/") # Public base URL of that port; enables the chart button
+CHART_WEB_SECRET = os.environ.get("CHART_WEB_SECRET", "") # Signs chart links; derived from the bot token if unset
+CHART_LINK_TTL = 7 * 86400 # Seconds a chart link keeps working
+CHART_WEB_CANDLES = 1000 # Candles sent per timeframe unless ?days= asks for a window
+CHART_WEB_MAX_CANDLES = 5000
+
+# Telemetry (see Metrics); LOG_LEVEL=DEBUG for stage timings, LOG_DEBUG_SAMPLE to keep only a fraction of them
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108")) # Prometheus /metrics; 0 disables
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # Histogram bounds, seconds
+METRIC_COMMANDS = {'start', 'help', 'popular', 'price', 'chart', 'predict', 'pedict', 'analyze', 'search',
+                   'alert', 'alerts', 'watchlist', 'portfolio', 'market', 'list', 'profile'} # Anything else is labelled 'other'
+METRIC_CALLBACK_PREFIXES = {'price', 'nav', 'search', 'market', 'showall', 'prices', 'chart', 'portfolio'}
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG_SAMPLE = float(os.environ.get("LOG_DEBUG_SAMPLE", "1"))
+
+# Live profiling (see Profiler): /profile from an admin chat, or SIGUSR1 (toggle) / SIGUSR2 (memory diff)
+ADMIN_CHAT_IDS = {int(c) for c in os.environ.get("ADMIN_CHAT_IDS", "").split(",") if c.strip()}
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "sample") # 'sample' (stack sampler) or 'cprofile'
+PROFILE_DEFAULT_SECONDS = 60
+PROFILE_SAMPLE_INTERVAL = 0.005 # Seconds between stack samples
+PROFILE_TRACEMALLOC_FRAMES = 40 # Deep enough to reach main.py from inside matplotlib/pandas
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available, then takes them."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait: return
+            time.sleep(wait)
+
+    def try_acquire(self, tokens=1, consume=True):
+        """Takes `tokens` if available and returns 0, else returns the seconds until they will be."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                if consume: self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+
+class SampledDebugFilter(logging.Filter):
+    """Keeps every INFO+ record but only a `rate` fraction of DEBUG ones."""
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+log = logging.getLogger("cryptobot")
+log.setLevel(LOG_LEVEL) # Disabled levels cost one cached isEnabledFor() check; messages are %-formatted lazily
+log.addFilter(SampledDebugFilter(LOG_DEBUG_SAMPLE))
+
+
+class Metrics:
+    """
+    In-process Prometheus registry: counters, gauges and histograms keyed by metric name and
+    label set, rendered in the text exposition format for /metrics. Gauges can also be
+    functions, read at scrape time.
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {} # (name, labels) -> value
+        self.gauges = {} # (name, labels) -> value
+        self.gauge_fns = {} # name -> fn()
+        self.histograms = {} # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge_add(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def register_gauge(self, name, fn):
+        self.gauge_fns[name] = fn
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None: h = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            h[bisect.bisect_left(self.buckets, seconds)] += 1
+            h[-1] += seconds
+
+    def cache(self, cache, hit):
+        self.inc('bot_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    def drain(self):
+        """Takes and clears the counters and histograms recorded so far (a render worker's, for merge())."""
+        with self.lock:
+            drained = self.counters, self.histograms
+            self.counters, self.histograms = {}, {}
+        return drained
+
+    def merge(self, drained):
+        counters, histograms = drained
+        with self.lock:
+            for key, value in counters.items(): self.counters[key] = self.counters.get(key, 0) + value
+            for key, h in histograms.items():
+                mine = self.histograms.setdefault(key, [0] * len(h))
+                for i, v in enumerate(h): mine[i] += v
+
+    def lap(self, stage, since, **labels):
+        """Records perf_counter() - since as one `stage` span and returns the new timestamp."""
+        now = time.perf_counter()
+        self.observe('bot_stage_seconds', now - since, stage=stage, **labels)
+        log.debug("%s %s took %.1fms", stage, labels or "", (now - since) * 1000)
+        return now
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Times the block as a `stage` span; exceptions are counted and re-raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('bot_stage_errors_total', stage=stage, **labels)
+            raise
+        finally:
+            self.lap(stage, start, **labels)
+
+    def render(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+        lines, typed = [], set()
+        def declare(name, kind):
+            if name not in typed: typed.add(name); lines.append(f"# TYPE {name} {kind}")
+        with self.lock:
+            counters, gauges = sorted(self.counters.items()), sorted(self.gauges.items())
+            histograms = sorted((k, list(v)) for k, v in self.histograms.items())
+        for (name, labels), value in counters:
+            declare(name, "counter"); lines.append(f"{name}{fmt(labels)} {value}")
+        for (name, labels), value in gauges:
+            declare(name, "gauge"); lines.append(f"{name}{fmt(labels)} {value}")
+        for name, fn in sorted(self.gauge_fns.items()):
+            try: value = fn()
+            except Exception: continue
+            declare(name, "gauge"); lines.append(f"{name} {value}")
+        for (name, labels), h in histograms:
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), h[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{fmt(labels)} {h[-1]:.6f}")
+            lines.append(f"{name}_count{fmt(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics': self.send_error(404); return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serves METRICS on http://0.0.0.0:<port>/metrics from a daemon thread."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class Profiler:
+    """
+    Runtime-toggled profiling of live traffic, split by command label. 'cprofile' runs
+    cProfile on every Nth update (and on the reply work it hands to response workers) and
+    dumps merged pstats per command; 'sample' walks the stack of every thread serving an
+    update each PROFILE_SAMPLE_INTERVAL and dumps collapsed stacks (flamegraph.pl,
+    speedscope). Separately, tracemalloc snapshots report memory growth since a baseline,
+    attributed to the main.py line that led to each allocation.
+    """
+    def __init__(self, out_dir=PROFILE_DIR):
+        self.out_dir = out_dir
+        self.lock = threading.Lock()
+        self.local = threading.local() # .command (and .profile) while a thread serves a profiled update
+        self.mode = None # None (off), 'cprofile' or 'sample'
+        self.every, self.seen = 1, 0
+        self.stats = {} # command -> pstats.Stats
+        self.collapsed = {} # command -> {collapsed stack: samples}
+        self.thread_commands = {} # thread id -> command, for threads serving a profiled update
+        self.stop_event = None
+        self.on_stop = None
+        self.mem_baseline = None
+
+    def start(self, mode, seconds=PROFILE_DEFAULT_SECONDS, every=1, on_stop=None):
+        """Starts a session that stops itself after `seconds`; on_stop(summary) gets the report."""
+        with self.lock:
+            if self.mode: return False
+            self.mode, self.every, self.seen, self.stats, self.collapsed = mode, max(1, every), 0, {}, {}
+            self.on_stop, self.stop_event = on_stop, threading.Event()
+            stop = self.stop_event
+        if mode == 'sample': threading.Thread(target=self._sample_loop, args=(stop,), name="profiler-sampler", daemon=True).start()
+        threading.Thread(target=lambda: stop.wait(seconds) or self.stop(), name="profiler-timer", daemon=True).start()
+        return True
+
+    def stop(self):
+        """Ends the session and writes one file per command. Returns the summary, or None if idle."""
+        with self.lock:
+            if not self.mode: return None
+            mode, stats, collapsed, on_stop = self.mode, self.stats, self.collapsed, self.on_stop
+            self.mode, self.stats, self.collapsed = None, {}, {} # Updates still finishing write into the fresh dicts
+            self.stop_event.set()
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        lines = []
+        if mode == 'cprofile':
+            for command, st in sorted(stats.items()):
+                path = os.path.join(self.out_dir, f"{stamp}-{command}.pstats")
+                st.dump_stats(path)
+                top = sorted(st.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:5] # By self time
+                lines.append(f"{command} ({st.total_calls} calls) → {path}")
+                lines += [f"  {func} ({os.path.basename(file)}:{line}) self {tt:.3f}s cum {ct:.3f}s"
+                          for (file, line, func), (_, _, tt, ct, _) in top]
+        else:
+            for command, stacks in sorted(collapsed.items()):
+                path = os.path.join(self.out_dir, f"{stamp}-{command}.collapsed")
+                with open(path, 'w') as f: f.writelines(f"{stack} {n}\n" for stack, n in stacks.items())
+                leaves = {}
+                for stack, n in stacks.items():
+                    leaf = stack.rsplit(';', 1)[-1]; leaves[leaf] = leaves.get(leaf, 0) + n
+                total = sum(stacks.values())
+                lines.append(f"{command} ({total} samples) → {path}")
+                lines += [f"  {n * 100 // total}% {leaf}" for leaf, n in sorted(leaves.items(), key=lambda kv: -kv[1])[:5]]
+        summary = f"{mode} profile:\n" + ("\n".join(lines) or "No profiled updates.")
+        if on_stop: on_stop(summary)
+        return summary
+
+    @contextmanager
+    def track(self, command):
+        """Wraps one process_update(); profiles it if a session is on and it's the Nth update."""
+        mode = self.mode
+        if mode:
+            with self.lock:
+                self.seen += 1
+                sampled = mode == 'sample' or self.seen % self.every == 0
+        if not mode or not sampled:
+            yield; return
+        self.local.command = command
+        try:
+            with self._profiled(command, mode): yield
+        finally:
+            self.local.command = None
+
+    def wrap(self, fn):
+        """Carries the current update's profiling over to work handed to another thread."""
+        command, mode = getattr(self.local, 'command', None), self.mode
+        if command is None or not mode: return fn
+        def run():
+            self.local.command = command
+            try:
+                with self._profiled(command, mode): return fn()
+            finally:
+                self.local.command = None
+        return run
+
+    @contextmanager
+    def _profiled(self, command, mode):
+        thread_id = threading.get_ident()
+        profile = cProfile.Profile() if mode == 'cprofile' else None
+        with self.lock: self.thread_commands[thread_id] = command
+        self.local.profile = profile
+        if profile: profile.enable()
+        try:
+            yield
+        finally:
+            self.local.profile = None
+            if profile:
+                profile.disable()
+                with self.lock:
+                    if command in self.stats: self.stats[command].add(profile)
+                    else: self.stats[command] = pstats.Stats(profile)
+            with self.lock: self.thread_commands.pop(thread_id, None)
+
+    @contextmanager
+    def waiting(self):
+        """Leaves the block (a thread idling on work it handed off) out of the current update's profile."""
+        profile, thread_id = getattr(self.local, 'profile', None), threading.get_ident()
+        with self.lock: command = self.thread_commands.pop(thread_id, None)
+        if profile: profile.disable()
+        try:
+            yield
+        finally:
+            if profile: profile.enable()
+            if command is not None:
+                with self.lock: self.thread_commands[thread_id] = command
+
+    def _sample_loop(self, stop):
+        while not stop.wait(PROFILE_SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            with self.lock: busy = list(self.thread_commands.items())
+            for thread_id, command in busy:
+                frame, stack = frames.get(thread_id), []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if not stack: continue
+                key = ";".join(reversed(stack))
+                with self.lock:
+                    counts = self.collapsed.setdefault(command, {})
+                    counts[key] = counts.get(key, 0) + 1
+
+    def memory_report(self, limit=10):
+        """First call starts tracemalloc and takes a baseline; later calls report growth since then."""
+        if not tracemalloc.is_tracing() or self.mem_baseline is None:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            self.mem_baseline = tracemalloc.take_snapshot()
+            return "🧠 tracemalloc started; baseline taken. Run `/profile mem` again to see growth."
+        snapshot = tracemalloc.take_snapshot()
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.tracemalloc")
+        snapshot.dump(path)
+        this_file = os.path.abspath(__file__)
+        growth, total = {}, 0
+        for stat in snapshot.compare_to(self.mem_baseline, 'traceback'):
+            total += stat.size_diff
+            frame = next((f for f in reversed(stat.traceback) if f.filename == this_file), None) # Innermost main.py frame
+            if frame is None or not stat.size_diff: continue
+            key = (frame.lineno, linecache.getline(this_file, frame.lineno).strip()[:60])
+            growth[key] = growth.get(key, 0) + stat.size_diff
+        top = sorted(growth.items(), key=lambda kv: -kv[1])[:limit]
+        lines = [f"  {size / 1024:+,.0f} KiB main.py:{lineno} {code}" for (lineno, code), size in top]
+        return f"🧠 Memory since baseline: {total / 1024:+,.0f} KiB ({path})\n" + "\n".join(lines)
+
+    def memory_stop(self):
+        tracemalloc.stop()
+        self.mem_baseline = None
+
+
+class AdmissionController:
+    """
+    Gatekeeper for expensive commands (charts, /analyze, /predict). Callers are held to
+    per-chat and per-user cost budgets (token buckets) and the queue to max_cost of work.
+    Jobs run on `workers` threads in order of arrival + cost * ADMISSION_SECONDS_PER_COST,
+    so cheap jobs overtake expensive ones without starving them; a job not started within
+    `deadline` seconds is answered "busy" (reply None) rather than run late. A request
+    whose key matches a queued or running job joins it, and the job's one result fans out
+    to every waiter; joining still costs ADMISSION_MERGED_COST of the caller's budget.
+    run(job) -> reply, deliver(waiter, reply) and progress(job) (chat actions while
+    queued or running) are supplied by the bot.
+    """
+    def __init__(self, run, deliver, progress, workers=ADMISSION_WORKERS, max_cost=ADMISSION_QUEUE_MAX_COST,
+                 deadline=ADMISSION_QUEUE_DEADLINE):
+        self.run, self.deliver, self.progress = run, deliver, progress
+        self.max_cost, self.deadline = max_cost, deadline
+        self.cond = threading.Condition()
+        self.heap = [] # (order, seq, job)
+        self.jobs = {} # key -> queued or running job
+        self.queued_cost = 0
+        self.buckets = OrderedDict() # ('chat' | 'user', id) -> TokenBucket
+        self.updates = {} # update_id -> [Event, jobs not yet delivered]
+        self.seq = itertools.count()
+        for i in range(workers): threading.Thread(target=self._work, name=f"admission-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat, name="admission-progress", daemon=True).start()
+
+    def queue_cost(self):
+        with self.cond: return self.queued_cost
+
+    def _bucket(self, kind, caller_id):
+        rate, burst = ADMISSION_CHAT_QUOTA if kind == 'chat' else ADMISSION_USER_QUOTA
+        bucket = self.buckets.get((kind, caller_id))
+        if bucket is None:
+            bucket = self.buckets[(kind, caller_id)] = TokenBucket(rate / 60, burst)
+            while len(self.buckets) > ADMISSION_TRACKED_CALLERS: self.buckets.popitem(last=False)
+        self.buckets.move_to_end((kind, caller_id))
+        return bucket
+
+    def submit(self, key, cost, compute, waiter):
+        """
+        Admits compute() as job `key` (its first element is the command kind) for `waiter`, a
+        dict with at least chat_id, user_id and update_id. Returns ('queued' | 'merged', 0),
+        ('quota', seconds until the caller's budget allows it) or ('busy', 0).
+        """
+        with self.cond:
+            job = self.jobs.get(key)
+            buckets = [self._bucket('chat', waiter['chat_id'])]
+            if waiter.get('user_id') is not None: buckets.append(self._bucket('user', waiter['user_id']))
+            charge = ADMISSION_MERGED_COST if job else cost
+            wait = max(b.try_acquire(charge, consume=False) for b in buckets)
+            if wait: result = 'quota'
+            elif job:
+                for b in buckets: b.try_acquire(charge)
+                job['waiters'].append(waiter)
+                result = 'merged'
+            elif self.queued_cost + cost > self.max_cost: result = 'busy'
+            else:
+                for b in buckets: b.try_acquire(cost)
+                now = time.monotonic()
+                job = self.jobs[key] = {'key': key, 'cost': cost, 'compute': compute, 'waiters': [waiter], 'deadline': now + self.deadline}
+                heapq.heappush(self.heap, (now + cost * ADMISSION_SECONDS_PER_COST, next(self.seq), job))
+                self.queued_cost += cost
+                self.cond.notify()
+                result = 'queued'
+            if result in ('queued', 'merged') and waiter.get('update_id') is not None:
+                entry = self.updates.setdefault(waiter['update_id'], [threading.Event(), 0])
+                entry[1] += 1
+        METRICS.inc('bot_admission_total', command=key[0], result=result)
+        return result, wait
+
+    def wait_for_update(self, update_id, timeout=None):
+        """Blocks until every job admitted for update_id has been delivered (used by the benchmarks)."""
+        with self.cond: entry = self.updates.get(update_id)
+        return entry is None or entry[0].wait(timeout)
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while not self.heap: self.cond.wait()
+                _, _, job = heapq.heappop(self.heap)
+                self.queued_cost -= job['cost']
+                expired = time.monotonic() > job['deadline']
+                if expired: del self.jobs[job['key']]
+                else: job['started'] = time.monotonic()
+            if expired:
+                METRICS.inc('bot_admission_expired_total', command=job['key'][0])
+                self._fan_out(job, None)
+                continue
+            METRICS.observe('bot_admission_wait_seconds', job['started'] - (job['deadline'] - self.deadline), command=job['key'][0])
+            try:
+                reply = self.run(job)
+            except Exception:
+                log.exception("Admitted job %s failed", job['key'])
+                reply = None
+            with self.cond: del self.jobs[job['key']] # Later duplicates start a fresh job
+            self._fan_out(job, reply)
+
+    def _fan_out(self, job, reply):
+        for waiter in job['waiters']: # No lock needed: the job left self.jobs, so nobody else can join it
+            try:
+                self.deliver(waiter, reply)
+            except Exception as e:
+                log.error("Error delivering %s to %s: %s", job['key'], waiter['chat_id'], e)
+            with self.cond:
+                entry = self.updates.get(waiter.get('update_id'))
+                if entry:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        entry[0].set()
+                        del self.updates[waiter['update_id']]
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(CHAT_ACTION_REFRESH)
+            with self.cond: jobs = list(self.jobs.values())
+            for job in jobs:
+                try: self.progress(job)
+                except Exception as e: log.debug("Progress update failed: %s", e)
+
+
+class CallbackGate:
+    """
+    Collapses repeated taps on one inline button, keyed by (chat_id, message_id, callback_data).
+    begin(key) says 'run' (the caller handles the tap, then calls finish()), 'joined' (the
+    same tap is still being handled) or 'debounced' (it was answered under `debounce` seconds
+    ago). finish() can record a fingerprint of the delivered reply, so a later refresh that
+    would send the same content again is recognised by fingerprint(key). Only each message's
+    latest tap is remembered: after another button on it, the first one runs afresh.
+    """
+    def __init__(self, debounce=CALLBACK_DEBOUNCE, max_keys=CALLBACK_TRACKED_KEYS):
+        self.debounce, self.max_keys = debounce, max_keys
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # (chat_id, message_id) -> {'data', 'running', 'at', 'fingerprint'}
+
+    def begin(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key[:2])
+            if entry and entry['data'] == key[2]:
+                if entry['running'] and now - entry['at'] < CALLBACK_STALE: return 'joined'
+                if not entry['running'] and now - entry['at'] < self.debounce: return 'debounced'
+            else:
+                entry = self.entries[key[:2]] = {'data': key[2], 'fingerprint': None}
+                while len(self.entries) > self.max_keys: self.entries.popitem(last=False)
+            self.entries.move_to_end(key[:2])
+            entry['running'], entry['at'] = True, now
+            return 'run'
+
+    def finish(self, key, fingerprint=None):
+        with self.lock:
+            entry = self.entries.get(key[:2])
+            if not entry or entry['data'] != key[2]: return # Another button on the message took over
+            entry['running'], entry['at'] = False, time.monotonic()
+            if fingerprint: entry['fingerprint'] = fingerprint
+
+    def fingerprint(self, key):
+        with self.lock:
+            entry = self.entries.get(key[:2])
+            return entry['fingerprint'] if entry and entry['data'] == key[2] else None
+
+
+REPLY_CLOCK = re.compile(r"\*\*(?:Updated|Generated):\*\*[^\n]*")
+
+def reply_fingerprint(reply):
+    """Digest of what a reply shows, ignoring its "Updated:"/"Generated:" clock. None for replies without buttons (errors, notices), which are always sent."""
+    if not reply.get('reply_markup'): return None
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update((reply.get('photo') or '').encode())
+    digest.update(REPLY_CLOCK.sub('', reply.get('text') or reply.get('caption') or '').encode())
+    digest.update(json.dumps(reply['reply_markup'], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def stamp_request_id(reply, request_id):
+    """A shared reply with REQUEST_ID_SLOT filled in for one caller (or dropped, without a request id)."""
+    stamp = f"[{request_id}]" if request_id else ""
+    return {k: v.replace(REQUEST_ID_SLOT, stamp) if k in ('text', 'caption') and isinstance(v, str) else v for k, v in reply.items()}
+
+
+def current_rss_bytes():
+    """Resident set size now (from /proc), falling back to the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def chart_figure(**kwargs):
+    """A Figure on its own Agg canvas, outside pyplot, cleared on exit even if drawing raised."""
+    fig = mfigure.Figure(**kwargs)
+    magg.FigureCanvasAgg(fig)
+    fig.patch.set_facecolor('#0a0a0a')
+    try:
+        yield fig
+    finally:
+        fig.clear()
+
+
+def figure_png(fig, dpi):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', facecolor='#0a0a0a', dpi=dpi, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+class ForecastInvalid(ValueError):
+    """Gemini's forecast failed validation; the message is what the repair prompt tells Gemini."""
+
+
+def parse_forecast(text, last_ts, last_close, horizon_ms):
+    """
+    Validates Gemini's JSON forecast into {'trend', 'support', 'resistance', 'analysis',
+    'path': [[timestamp_ms, price], ...]}. Unambiguous slips are fixed here without another
+    call: code fences or prose around the object, trailing commas, timestamps in seconds,
+    unsorted or repeated points, and out-of-range support/resistance levels (dropped).
+    Anything else raises ForecastInvalid.
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end < start: raise ForecastInvalid("the answer contains no JSON object")
+    try:
+        data = json.loads(re.sub(r",\s*([}\]])", r"\1", text[start:end + 1]))
+    except ValueError as e:
+        raise ForecastInvalid(f"the JSON does not parse ({e})")
+    if not isinstance(data, dict): raise ForecastInvalid("the answer must be a JSON object")
+    trend = str(data.get('trend', '')).strip().lower()
+    if trend not in FORECAST_TRENDS: raise ForecastInvalid(f"\"trend\" must be one of {', '.join(FORECAST_TRENDS)}")
+    analysis = data.get('analysis')
+    if not isinstance(analysis, str) or not analysis.strip(): raise ForecastInvalid("\"analysis\" must be a non-empty string")
+    low, high = last_close * (1 - FORECAST_PRICE_BAND), last_close * (1 + FORECAST_PRICE_BAND)
+    path = {}
+    for point in data.get('path') or []:
+        try:
+            ts, price = int(point['timestamp']), float(point['price'])
+        except (KeyError, TypeError, ValueError):
+            raise ForecastInvalid(f"path point {json.dumps(point)} needs an integer \"timestamp\" and a numeric \"price\"")
+        if ts < 10 ** 11: ts *= 1000 # Seconds, not milliseconds
+        if not last_ts < ts <= last_ts + 1.5 * horizon_ms:
+            raise ForecastInvalid(f"path timestamp {ts} is outside the forecast window ({last_ts}, {last_ts + horizon_ms}]")
+        if not low <= price <= high:
+            raise ForecastInvalid(f"path price {price:g} is implausible next to the last close {last_close:g}")
+        path[ts] = price
+    if len(path) < 2: raise ForecastInvalid("\"path\" needs at least 2 points after the last candle")
+    levels = {k: sorted(float(v) for v in data.get(k) or [] if isinstance(v, (int, float)) and low <= v <= high)
+              for k in ('support', 'resistance')}
+    return {'trend': trend, 'analysis': analysis.strip(), 'path': [[ts, path[ts]] for ts in sorted(path)], **levels}
+
+
+class RenderBusy(Exception):
+    """Raised instead of rendering while the process is over RENDER_MEMORY_CEILING_MB."""
+
+
+def render_task(draw, args):
+    """Runs in a render worker: draw(*args), plus the metrics it recorded and the worker's pid and RSS."""
+    result = draw(*args)
+    return result, METRICS.drain(), os.getpid(), current_rss_bytes()
+
+
+class RenderGuard:
+    """
+    Runs chart renders in a small pool of worker processes and keeps their memory bounded.
+    Matplotlib's caches and heap fragmentation build up in the workers, not the bot: after
+    `recycle_charts` renders, or once a worker has grown `recycle_mb` past its first render,
+    the pool is swapped for a fresh one (in-flight renders finish on the old pool, whose
+    processes then exit; until they have, their memory still counts). Above `ceiling_mb` of
+    RSS, bot and workers together, a recycle is tried first and waited for; if that is not
+    enough, render() raises RenderBusy. draw and its args
+    are pickled to the worker, so draw must be a module-level function or a staticmethod.
+    """
+    def __init__(self, workers=RENDER_WORKERS, recycle_charts=RENDER_RECYCLE_CHARTS,
+                 recycle_mb=RENDER_RECYCLE_MB, ceiling_mb=RENDER_MEMORY_CEILING_MB):
+        self.workers, self.recycle_charts = workers, recycle_charts
+        self.recycle_bytes, self.ceiling_bytes = recycle_mb * 1024 * 1024, ceiling_mb * 1024 * 1024
+        self.context = multiprocessing.get_context("spawn") # Forking a process full of threads can deadlock the child
+        self.lock = threading.Lock()
+        self.executor = self._new_pool() # Workers start on the first render
+        self.renders, self.recycles = 0, 0
+        self.worker_rss = {} # pid -> (RSS after its first render, latest RSS) for the current pool's workers
+        self.retired = {} # Swapped-out pool -> its workers' RSS, until they have exited
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context)
+
+    def rss(self):
+        """Bytes resident in the bot plus its render workers, current and retiring (as of their last render)."""
+        with self.lock: workers = sum(latest for _, latest in self.worker_rss.values()) + sum(self.retired.values())
+        return current_rss_bytes() + workers
+
+    def render(self, draw, *args):
+        """Runs draw(*args) in a render worker and returns its result."""
+        if self.ceiling_bytes and self.rss() > self.ceiling_bytes:
+            self.recycle('ceiling', wait=True)
+            if self.rss() > self.ceiling_bytes:
+                METRICS.inc('bot_render_rejected_total')
+                log.warning("RSS %.0fMB above the %.0fMB render ceiling; refusing chart", self.rss() / 2**20, self.ceiling_bytes / 2**20)
+                raise RenderBusy()
+        with self.lock: executor = self.executor
+        growth, crashed = 0, False
+        try:
+            result, metrics, pid, rss = executor.submit(render_task, draw, args).result()
+            METRICS.merge(metrics)
+            with self.lock:
+                if executor is self.executor: # Reports from a retired pool's workers are dropped
+                    first = self.worker_rss.get(pid, (rss,))[0]
+                    self.worker_rss[pid] = (first, rss)
+                    growth = rss - first
+            return result
+        except BrokenProcessPool: # A worker died mid-render (OOM kill, segfault): later renders get fresh ones
+            crashed = True
+            if executor is self.executor: self.recycle('crash')
+            raise
+        finally:
+            if not crashed: # The pool is already swapped; don't count this render against the new one
+                with self.lock:
+                    self.renders += 1
+                    due = self.renders >= self.recycle_charts and 'charts'
+                    due = due or (growth > self.recycle_bytes and 'memory')
+                if due: self.recycle(due)
+
+    def recycle(self, reason, wait=False):
+        """
+        Swaps in a fresh pool. The old one's workers exit once their in-flight renders finish,
+        waited for here with wait=True and on a background thread otherwise.
+        """
+        with self.lock:
+            old, self.executor = self.executor, self._new_pool()
+            released = sum(latest for _, latest in self.worker_rss.values())
+            self.retired[old] = released
+            self.worker_rss, self.renders = {}, 0
+            self.recycles += 1
+        if wait: self._retire(old)
+        else: threading.Thread(target=self._retire, args=(old,), name="render-retire", daemon=True).start()
+        METRICS.inc('bot_render_recycles_total', reason=reason)
+        log.info("Recycled render workers (%s), releasing %.0fMB", reason, released / 2**20)
+
+    def _retire(self, executor):
+        executor.shutdown(wait=True)
+        with self.lock: self.retired.pop(executor, None)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def format_usd(price):
+    """Fallback for symbols without a known tick size (see PricePrecision)."""
+    return f"${price:,.4f}" if price >= 1 else f"${price:.8f}"
+
+
+def format_compact(amount):
+    """Volumes and turnover: 950 -> 950, 12345 -> 12.3K, 4.5e6 -> 4.5M (small amounts keep their digits, not "0K")."""
+    for scale, suffix in ((1e9, 'B'), (1e6, 'M'), (1e3, 'K')):
+        if round(abs(amount) / scale, 1) >= 1: return f"{amount / scale:.1f}".removesuffix('.0') + suffix
+    return f"{amount:.4g}"
+
+
+def tick_decimals(tick_size):
+    """Decimal places of an instruments-info tickSize string ("0.01" -> 2, "1" -> 0)."""
+    _, _, fraction = str(tick_size).partition('.')
+    return len(fraction.rstrip('0'))
+
+
+class PriceFormat:
+    """
+    One symbol's prices at its exchange tick size (at least cents), or by magnitude like
+    format_usd when the tick size is unknown. Call it on a price; `axis` is the matching
+    matplotlib tick formatter, built on first use and shared by every chart drawn with it.
+    """
+    def __init__(self, decimals=None):
+        self.decimals = decimals
+        self.spec = None if decimals is None else f",.{max(decimals, 2)}f"
+
+    def __call__(self, price):
+        return f"${price:{self.spec}}" if self.spec else format_usd(price)
+
+    @cached_property
+    def axis(self):
+        return mticker.FuncFormatter(lambda x, _: self(x))
+
+
+@lru_cache(maxsize=None)
+def price_format(decimals=None):
+    """
+    The shared PriceFormat for a tick precision. There are only a handful of precisions, so
+    every symbol with the same one, and every chart a render worker draws, reuses one formatter.
+    """
+    return PriceFormat(decimals)
+
+
+class PricePrecision:
+    """PriceFormat per symbol from instruments-info tick sizes (see price_format), until the next update()."""
+    def __init__(self):
+        self.decimals = {} # symbol -> tick decimals
+
+    def update(self, tick_sizes):
+        self.decimals = {symbol: tick_decimals(tick) for symbol, tick in tick_sizes.items() if tick}
+
+    def __call__(self, symbol):
+        return price_format(self.decimals.get(symbol))
+
+
+def klines_to_candles(kline_data):
+    """Bybit-style newest-first kline rows -> CANDLE_DTYPE array, oldest first."""
+    return np.array([tuple(float(v) for v in row[:6]) for row in reversed(kline_data)], dtype=CANDLE_DTYPE)
+
+
+def candle_payload(candles):
+    """Binary candles for the chart page: uint32 open times (seconds), then float32 open, high, low, close and volume columns."""
+    return (candles['ts'] // 1000).astype('<u4').tobytes() + b"".join(candles[f].astype('<f4').tobytes() for f in ('open', 'high', 'low', 'close', 'volume'))
+
+
+def candle_open_ts(ts_ms, user_interval):
+    """Open time of the `user_interval` candle containing ts_ms (works on numpy arrays too)."""
+    width = INTERVAL_MS[user_interval]
+    offset = INTERVAL_OFFSET_MS.get(user_interval, 0)
+    return (ts_ms - offset) // width * width + offset
+
+
+def aggregate_candle_runs(candles, starts):
+    """
+    Collapses each run candles[starts[i]:starts[i+1]] into one candle: first open,
+    highest high, lowest low, last close and summed volume.
+    """
+    ends = np.append(starts[1:], len(candles)) - 1
+    out = np.empty(len(starts), dtype=CANDLE_DTYPE)
+    out['ts'] = candles['ts'][starts]
+    out['open'] = candles['open'][starts]
+    out['high'] = np.maximum.reduceat(candles['high'], starts)
+    out['low'] = np.minimum.reduceat(candles['low'], starts)
+    out['close'] = candles['close'][ends]
+    out['volume'] = np.add.reduceat(candles['volume'], starts)
+    return out
+
+
+def decimate_candles(candles, max_points):
+    """
+    Merges runs of consecutive candles so at most `max_points` remain. Each bucket
+    keeps its extremes, so wicks survive the downsampling.
+    """
+    n = len(candles)
+    if n <= max_points: return candles
+    return aggregate_candle_runs(candles, np.arange(0, n, -(-n // max_points)))
+
+
+def resample_candles(candles, user_interval):
+    """Aggregates finer candles (oldest first) into `user_interval` candles aligned like Bybit's."""
+    if not len(candles): return candles
+    bucket_ts = candle_open_ts(candles['ts'], user_interval)
+    starts = np.flatnonzero(np.r_[True, bucket_ts[1:] != bucket_ts[:-1]])
+    out = aggregate_candle_runs(candles, starts)
+    out['ts'] = bucket_ts[starts]
+    return out
+
+
+def align_closes(series, start_ms, step_ms, count):
+    """
+    Closes of several CANDLE_DTYPE arrays on one time grid (`count` steps of step_ms from
+    start_ms) as a (len(series), count) matrix, placed with a single scatter. Gaps carry the
+    last close forward, a series' leading gap takes its first close, and an empty series is 0.
+    """
+    closes = np.full((len(series), count), np.nan)
+    lengths = [len(c) for c in series]
+    if sum(lengths):
+        merged = np.concatenate(series)
+        rows = np.repeat(np.arange(len(series)), lengths)
+        cols = (merged['ts'] - start_ms) // step_ms
+        keep = (cols >= 0) & (cols < count)
+        closes[rows[keep], cols[keep]] = merged['close'][keep]
+    filled = np.where(np.isnan(closes), 0, np.arange(count))
+    np.maximum.accumulate(filled, axis=1, out=filled)
+    closes = np.take_along_axis(closes, filled, axis=1)
+    first = closes[np.arange(len(series)), (~np.isnan(closes)).argmax(axis=1)]
+    return np.nan_to_num(np.where(np.isnan(closes), first[:, None], closes))
+
+
+def lookup_tickers(table, symbols):
+    """Last prices and 24h change fractions of `symbols` from a ticker table (see get_ticker_table); NaN where unlisted."""
+    names, prices, changes = table
+    if not len(names): return np.full(len(symbols), np.nan), np.full(len(symbols), np.nan)
+    wanted = np.array(symbols, dtype=names.dtype if len(symbols) else str)
+    pos = np.minimum(np.searchsorted(names, wanted), len(names) - 1)
+    found = names[pos] == wanted
+    return np.where(found, prices[pos], np.nan), np.where(found, changes[pos], np.nan)
+
+
+def encode_cache_value(value):
+    """(kind, bytes) for SharedCache: numpy arrays as .npy (dtype kept, no pickle), bytes as-is (PNGs), the rest as JSON."""
+    if isinstance(value, np.ndarray):
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return 'npy', buffer.getvalue()
+    if isinstance(value, (bytes, bytearray)): return 'bytes', bytes(value)
+    return 'json', json.dumps(value, separators=(',', ':')).encode()
+
+
+def decode_cache_value(kind, blob):
+    if kind == 'npy': return np.load(io.BytesIO(blob), allow_pickle=False)
+    if kind == 'bytes': return bytes(blob)
+    return json.loads(blob)
+
+
+class KeyedLocks:
+    """A threading.Lock per key, dropped once nobody holds or waits on it."""
+    def __init__(self):
+        self.guard = threading.Lock()
+        self.locks = {} # key -> [lock, holders + waiters]
+
+    @contextmanager
+    def hold(self, key, timeout=-1):
+        with self.guard:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        acquired = entry[0].acquire(timeout=timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired: entry[0].release()
+            with self.guard:
+                entry[1] -= 1
+                if not entry[1]: del self.locks[key]
+
+
+class CacheBackend:
+    """
+    Interface shared by MemoryCache and SharedCache: get(key) -> value or None,
+    set(key, value, ttl), delete(key), clear(), and lock(key), a context manager that
+    lets one caller at a time compute a key (yielding False if it gave up waiting).
+    Keys are "kind:..." strings; the kind labels the hit/miss metrics.
+    """
+    def get_or_compute(self, key, ttl, compute):
+        """The cached value, or compute()'s result computed once for all concurrent callers. None is not cached."""
+        value = self.get(key)
+        METRICS.cache(key.split(':', 1)[0], value is not None)
+        if value is not None: return value
+        with self.lock(key):
+            value = self.get(key) # Whoever held the lock may have just filled it
+            if value is None:
+                value = compute()
+                if value is not None: self.set(key, value, ttl)
+        return value
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU with per-entry TTL. Values are stored as-is, so callers treat them as read-only."""
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> (expires_at, value)
+        self.guard = threading.Lock()
+        self.key_locks = KeyedLocks()
+
+    def get(self, key):
+        with self.guard:
+            entry = self.entries.get(key)
+            if entry is None: return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self.guard:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries: self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.guard: self.entries.pop(key, None)
+
+    def clear(self):
+        with self.guard: self.entries.clear()
+
+    def lock(self, key, timeout=CACHE_LEASE_TTL):
+        return self.key_locks.hold(key, timeout)
+
+
+class SharedCache(CacheBackend):
+    """
+    Cache in a SQLite file that every bot process on the host opens, so N workers keep one
+    copy of hot data and make one upstream call per key. Values are serialised by type
+    (see encode_cache_value). lock(key) takes a lease row in the same file: one process
+    computes a missing key while the others poll for its result; threads within a process
+    queue on a local lock first. Decoded values are memoised per entry version, so repeated
+    hits on an unchanged entry cost one indexed read.
+    """
+    def __init__(self, path=CACHE_DB_PATH, max_decoded=CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=OFF") # A cache: losing the last writes in a power cut is fine
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cache_entries (
+            key TEXT PRIMARY KEY, kind TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL)""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS cache_leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self.db.commit()
+        self.guard = threading.Lock()
+        self.key_locks = KeyedLocks()
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.decoded = OrderedDict() # key -> (expires_at, value)
+        self.max_decoded = max_decoded
+        self.writes = 0
+
+    def get(self, key):
+        now = time.time()
+        with self.guard:
+            row = self.db.execute("SELECT expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] < now: return None
+            memo = self.decoded.get(key)
+            if memo and memo[0] == row[0]: return memo[1]
+            row = self.db.execute("SELECT kind, value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None: return None
+        value = decode_cache_value(row[0], row[1])
+        with self.guard:
+            self.decoded[key] = (row[2], value)
+            while len(self.decoded) > self.max_decoded: self.decoded.popitem(last=False)
+        return value
+
+    def set(self, key, value, ttl):
+        kind, blob = encode_cache_value(value)
+        with self.guard:
+            self.db.execute("INSERT OR REPLACE INTO cache_entries (key, kind, value, expires_at) VALUES (?, ?, ?, ?)",
+                            (key, kind, blob, time.time() + ttl))
+            self.writes += 1
+            if self.writes % 256 == 0: self.db.execute("DELETE FROM cache_entries WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+
+    def delete(self, key):
+        with self.guard:
+            self.db.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            self.db.commit()
+            self.decoded.pop(key, None)
+
+    def clear(self):
+        with self.guard:
+            self.db.execute("DELETE FROM cache_entries")
+            self.db.commit()
+            self.decoded.clear()
+
+    def _take_lease(self, key):
+        now = time.time()
+        with self.guard:
+            cursor = self.db.execute("""INSERT INTO cache_leases (key, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE cache_leases.expires_at < ?""", (key, self.owner, now + CACHE_LEASE_TTL, now))
+            self.db.commit()
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def lock(self, key, timeout=CACHE_LEASE_TTL):
+        deadline = time.monotonic() + timeout
+        with self.key_locks.hold(key, timeout) as local:
+            leased = local and self._take_lease(key)
+            while local and not leased and time.monotonic() < deadline:
+                time.sleep(CACHE_LEASE_POLL)
+                if self.get(key) is not None: break # The other process finished; no need to own the lease
+                leased = self._take_lease(key)
+            try:
+                yield leased
+            finally:
+                if leased:
+                    with self.guard:
+                        self.db.execute("DELETE FROM cache_leases WHERE key = ? AND owner = ?", (key, self.owner))
+                        self.db.commit()
+
+
+def open_cache(backend=CACHE_BACKEND):
+    return SharedCache(CACHE_DB_PATH) if backend == 'shared' else MemoryCache()
+
+
+class CandleStore:
+    """
+    Append-only on-disk candle files: one `<SYMBOL>_<interval>.bin` of fixed-size
+    CANDLE_DTYPE records (sorted by open time) per pair, plus `index.json` holding
+    the first/last timestamp and record count of every file.
+    Reads are numpy.memmap views, so serving a window never copies the file.
+    Files are not split by exchange: each append comes from whichever exchange served it.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(root, "index.json")
+        self.lock = threading.Lock()
+        self.index = {}
+        try:
+            with open(self.index_path) as f: self.index = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def key(symbol, interval):
+        return f"{re.sub(r'[^A-Z0-9]', '', symbol.upper())}_{interval}"
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.bin")
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f: json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _entry(self, key):
+        """Index entry for `key`, rebuilt from the data file if a crash left them out of sync."""
+        path = self._path(key)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        n_records = size // CANDLE_DTYPE.itemsize
+        entry = self.index.get(key)
+        if entry and entry['count'] == n_records:
+            return entry
+        if size != n_records * CANDLE_DTYPE.itemsize:
+            with open(path, "r+b") as f: f.truncate(n_records * CANDLE_DTYPE.itemsize) # Drop a torn trailing record
+        if not n_records:
+            self.index.pop(key, None)
+            return None
+        data = np.memmap(path, dtype=CANDLE_DTYPE, mode='r')
+        entry = {'first_ts': int(data['ts'][0]), 'last_ts': int(data['ts'][-1]), 'count': n_records,
+                 'head': (entry or {}).get('head', False)}
+        self.index[key] = entry
+        self._save_index()
+        return entry
+
+    def coverage(self, symbol, interval):
+        """Returns the stored index entry ({first_ts, last_ts, count, head}) or None."""
+        with self.lock:
+            entry = self._entry(self.key(symbol, interval))
+            return dict(entry) if entry else None
+
+    def mark_head(self, symbol, interval):
+        """Records that the exchange has no candles older than the first stored one."""
+        with self.lock:
+            entry = self._entry(self.key(symbol, interval))
+            if entry and not entry.get('head'):
+                entry['head'] = True
+                self._save_index()
+
+    def read(self, symbol, interval, start_ts=None, end_ts=None):
+        """Zero-copy memmap view of the stored candles with start_ts <= ts <= end_ts."""
+        with self.lock:
+            key = self.key(symbol, interval)
+            if not self._entry(key):
+                return np.empty(0, dtype=CANDLE_DTYPE)
+            data = np.memmap(self._path(key), dtype=CANDLE_DTYPE, mode='r')
+        lo = 0 if start_ts is None else int(np.searchsorted(data['ts'], start_ts, side='left'))
+        hi = len(data) if end_ts is None else int(np.searchsorted(data['ts'], end_ts, side='right'))
+        return data[lo:hi]
+
+    def write(self, symbol, interval, candles):
+        """
+        Stores closed candles (a CANDLE_DTYPE array in any order). Candles newer than the
+        stored tail are appended in place; anything older is merged and the file rewritten.
+        """
+        if not len(candles): return
+        candles = np.sort(np.asarray(candles, dtype=CANDLE_DTYPE), order='ts')
+        with self.lock:
+            key = self.key(symbol, interval)
+            path = self._path(key)
+            entry = self._entry(key)
+            if entry:
+                candles = candles[candles['ts'] > entry['last_ts']] if candles['ts'][0] > entry['first_ts'] else candles
+                if not len(candles): return
+            if not entry or candles['ts'][0] > entry['last_ts']:
+                _, unique_idx = np.unique(candles['ts'], return_index=True)
+                candles = candles[unique_idx]
+                with open(path, "ab") as f: f.write(candles.tobytes())
+            else:
+                existing = np.fromfile(path, dtype=CANDLE_DTYPE)
+                merged = np.concatenate([candles, existing]) # New rows first so np.unique keeps them
+                _, unique_idx = np.unique(merged['ts'], return_index=True)
+                candles = merged[unique_idx]
+                tmp_path = path + ".tmp"
+                candles.tofile(tmp_path)
+                os.replace(tmp_path, path)
+            self.index[key] = {'first_ts': int(candles['ts'][0]) if not entry else min(entry['first_ts'], int(candles['ts'][0])),
+                               'last_ts': int(candles['ts'][-1]) if not entry else max(entry['last_ts'], int(candles['ts'][-1])),
+                               'count': os.path.getsize(path) // CANDLE_DTYPE.itemsize,
+                               'head': (entry or {}).get('head', False)}
+            self._save_index()
+
+
+class ExchangeError(Exception):
+    """An exchange request failed (transport, HTTP or API error); counts against its circuit breaker."""
+
+
+class CircuitBreaker:
+    """
+    Closed until `failures` consecutive errors, then open for `cooldown` seconds (allow() is
+    False). After that a single trial request is let through, and its outcome closes the
+    circuit or opens it for another cooldown.
+    """
+    def __init__(self, failures=EXCHANGE_BREAKER_FAILURES, cooldown=EXCHANGE_BREAKER_COOLDOWN):
+        self.failures, self.cooldown = failures, cooldown
+        self.lock = threading.Lock()
+        self.errors, self.opened_at, self.trial = 0, None, False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None: return True
+            if self.trial or time.monotonic() - self.opened_at < self.cooldown: return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock: self.errors, self.opened_at, self.trial = 0, None, False
+
+    def failure(self):
+        """Records an error; returns True if this opened (or re-opened) the circuit."""
+        with self.lock:
+            self.errors += 1
+            if not (self.trial or (self.opened_at is None and self.errors >= self.failures)): return False
+            self.opened_at, self.trial = time.monotonic(), False
+            return True
+
+
+class ExchangeAdapter:
+    """
+    One exchange's public spot market data in the bot's own types: tickers are dicts with the
+    fields the bot reads (Bybit v5 names: symbol as BASEUSDT, lastPrice, price24hPcnt as a
+    fraction, highPrice24h, lowPrice24h, volume24h in the base coin, turnover24h in USDT,
+    bid1Price, ask1Price), candles are CANDLE_DTYPE arrays and instruments map base symbols to
+    tick sizes. Methods raise ExchangeError when a request fails and return None when the
+    exchange doesn't list the pair, so the router can tell an outage from a gap in coverage.
+    """
+    name = None
+    label = None # Shown to users as the data source
+    page_limit = KLINE_PAGE_LIMIT # Candles per kline request
+    intervals = {} # Bot interval -> the exchange's
+
+    def __init__(self, base_url, requests_per_sec):
+        self.base_url = base_url
+        self.limiter = TokenBucket(requests_per_sec)
+        self.breaker = CircuitBreaker()
+
+    def get(self, path, params=None):
+        """GET under this exchange's rate limit; returns (HTTP status, decoded JSON)."""
+        with METRICS.span('rate_limit', exchange=self.name): self.limiter.acquire()
+        try:
+            response = requests.get(f"{self.base_url}{path}", params=params, timeout=EXCHANGE_TIMEOUT)
+            return response.status_code, response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise ExchangeError(f"{self.name} {path}: {e}") from e
+
+    def klines(self, symbol, user_interval, start_ms, end_ms, executor):
+        """
+        [start_ms, end_ms] as one page_limit-sized request per page, fetched in parallel on
+        `executor`, merged and de-duplicated by timestamp into a CANDLE_DTYPE array sorted
+        oldest-first. None if the exchange lists neither the pair nor the interval.
+        """
+        if user_interval not in self.intervals: return None
+        page_span = self.page_limit * INTERVAL_MS[user_interval]
+        chunks = [(max(chunk_start, start_ms), min(chunk_start + page_span - 1, end_ms))
+                  for chunk_start in range(candle_open_ts(start_ms, user_interval), end_ms + 1, page_span)]
+        if len(chunks) == 1: pages = [self.kline_page(symbol, user_interval, *chunks[0])]
+        else: pages = list(executor.map(lambda c: self.kline_page(symbol, user_interval, *c), chunks))
+        if any(page is None for page in pages): return None
+        candles = np.concatenate(pages) if pages else np.empty(0, dtype=CANDLE_DTYPE)
+        _, unique_idx = np.unique(candles['ts'], return_index=True)
+        return candles[unique_idx]
+
+
+class BybitAdapter(ExchangeAdapter):
+    name = 'bybit'
+    label = 'Bybit'
+    intervals = BYBIT_INTERVAL_MAP
+
+    def __init__(self, base_url=BYBIT_REST_URL, requests_per_sec=BYBIT_REQUESTS_PER_SEC):
+        super().__init__(base_url, requests_per_sec)
+
+    def call(self, path, params):
+        status, data = self.get(path, params)
+        if status == 200 and data.get('retCode') == 0: return data.get('result') or {}
+        if status == 200 and data.get('retCode') == 10001: return None # "Not supported symbols"
+        raise ExchangeError(f"bybit {path}: HTTP {status} {data.get('retCode')} {data.get('retMsg')}")
+
+    def tickers(self):
+        result = self.call("/v5/market/tickers", {"category": "spot"}) or {}
+        return {t['symbol'][:-4]: t for t in result.get('list', []) if t.get('symbol', '').endswith('USDT')}
+
+    def ticker(self, symbol):
+        result = self.call("/v5/market/tickers", {"category": "spot", "symbol": f"{symbol}USDT"})
+        return result['list'][0] if result and result.get('list') else None
+
+    def instruments(self):
+        result = self.call("/v5/market/instruments-info", {"category": "spot"}) or {}
+        return {i['symbol'][:-4]: i.get('priceFilter', {}).get('tickSize') for i in result.get('list', []) if i.get('symbol', '').endswith('USDT')}
+
+    def kline_page(self, symbol, user_interval, start_ms, end_ms):
+        params = {"category": "spot", "symbol": f"{symbol}USDT", "interval": self.intervals[user_interval],
+                  "limit": self.page_limit, "start": start_ms, "end": end_ms}
+        result = self.call("/v5/market/kline", params)
+        return None if result is None else klines_to_candles(result.get('list', []))
+
+
+class OkxAdapter(ExchangeAdapter):
+    name = 'okx'
+    label = 'OKX'
+    page_limit = 100 # history-candles maximum
+    intervals = {'1h': '1H', '2h': '2H', '4h': '4H', '12h': '12Hutc', '1d': '1Dutc', '1w': '1Wutc'} # UTC-aligned like Bybit's
+
+    def __init__(self, base_url=OKX_REST_URL, requests_per_sec=OKX_REQUESTS_PER_SEC):
+        super().__init__(base_url, requests_per_sec)
+
+    def call(self, path, params):
+        status, data = self.get(path, params)
+        code = str(data.get('code')) if isinstance(data, dict) else None
+        if status == 200 and code == '0': return data.get('data') or []
+        if code == '51001': return None # "Instrument ID does not exist"
+        raise ExchangeError(f"okx {path}: HTTP {status} {code} {data.get('msg') if isinstance(data, dict) else ''}")
+
+    @staticmethod
+    def normalize(t):
+        last, open24h = float(t.get('last') or 0), float(t.get('open24h') or 0)
+        return {'symbol': t['instId'].replace('-', ''), 'lastPrice': t.get('last'), 'price24hPcnt': last / open24h - 1 if open24h else 0,
+                'highPrice24h': t.get('high24h'), 'lowPrice24h': t.get('low24h'), 'volume24h': t.get('vol24h'),
+                'turnover24h': t.get('volCcy24h'), 'bid1Price': t.get('bidPx'), 'ask1Price': t.get('askPx')}
+
+    def tickers(self):
+        return {t['instId'][:-5]: self.normalize(t) for t in self.call("/api/v5/market/tickers", {"instType": "SPOT"}) or []
+                if t.get('instId', '').endswith('-USDT')}
+
+    def ticker(self, symbol):
+        data = self.call("/api/v5/market/ticker", {"instId": f"{symbol}-USDT"})
+        return self.normalize(data[0]) if data else None
+
+    def instruments(self):
+        return {i['baseCcy']: i.get('tickSz') for i in self.call("/api/v5/public/instruments", {"instType": "SPOT"}) or []
+                if i.get('quoteCcy') == 'USDT' and i.get('state') == 'live'}
+
+    def kline_page(self, symbol, user_interval, start_ms, end_ms):
+        params = {"instId": f"{symbol}-USDT", "bar": self.intervals[user_interval], "limit": self.page_limit,
+                  "after": end_ms + 1, "before": start_ms - 1} # Both bounds exclusive
+        rows = self.call("/api/v5/market/history-candles", params)
+        return None if rows is None else klines_to_candles(rows)
+
+
+class BinanceAdapter(ExchangeAdapter):
+    name = 'binance'
+    label = 'Binance'
+    intervals = {'1h': '1h', '2h': '2h', '4h': '4h', '12h': '12h', '1d': '1d', '1w': '1w'}
+
+    def __init__(self, base_url=BINANCE_REST_URL, requests_per_sec=BINANCE_REQUESTS_PER_SEC):
+        super().__init__(base_url, requests_per_sec)
+
+    def call(self, path, params=None):
+        status, data = self.get(path, params)
+        if status == 200: return data
+        if isinstance(data, dict) and data.get('code') == -1121: return None # "Invalid symbol."
+        raise ExchangeError(f"binance {path}: HTTP {status} {data.get('msg') if isinstance(data, dict) else ''}")
+
+    @staticmethod
+    def normalize(t):
+        return {'symbol': t['symbol'], 'lastPrice': t.get('lastPrice'), 'price24hPcnt': float(t.get('priceChangePercent') or 0) / 100,
+                'highPrice24h': t.get('highPrice'), 'lowPrice24h': t.get('lowPrice'), 'volume24h': t.get('volume'),
+                'turnover24h': t.get('quoteVolume'), 'bid1Price': t.get('bidPrice'), 'ask1Price': t.get('askPrice')}
+
+    def tickers(self):
+        return {t['symbol'][:-4]: self.normalize(t) for t in self.call("/api/v3/ticker/24hr") or [] if t.get('symbol', '').endswith('USDT')}
+
+    def ticker(self, symbol):
+        data = self.call("/api/v3/ticker/24hr", {"symbol": f"{symbol}USDT"})
+        return self.normalize(data) if data else None
+
+    def instruments(self):
+        symbols = (self.call("/api/v3/exchangeInfo") or {}).get('symbols', [])
+        return {s['baseAsset']: next((f.get('tickSize') for f in s.get('filters', []) if f.get('filterType') == 'PRICE_FILTER'), None)
+                for s in symbols if s.get('quoteAsset') == 'USDT' and s.get('status') == 'TRADING'}
+
+    def kline_page(self, symbol, user_interval, start_ms, end_ms):
+        params = {"symbol": f"{symbol}USDT", "interval": self.intervals[user_interval], "limit": self.page_limit,
+                  "startTime": start_ms, "endTime": end_ms}
+        rows = self.call("/api/v3/klines", params)
+        return None if rows is None else klines_to_candles(rows) # Oldest first here; klines() sorts anyway
+
+
+EXCHANGE_ADAPTERS = {'bybit': BybitAdapter, 'okx': OkxAdapter, 'binance': BinanceAdapter}
+
+
+class MarketDataRouter:
+    """
+    Asks exchange adapters for market data in preference order, hedged: the next exchange is
+    asked as soon as the previous one failed or doesn't list the pair, or once it has been
+    silent for `hedge_delay` seconds. The first usable answer wins and later ones are
+    dropped. Time queued behind an exchange's own rate limit counts as silence, so bursts
+    beyond one exchange's budget spill over to the next. Each exchange has a circuit breaker,
+    so one that keeps failing is skipped for a cooldown instead of costing every request a
+    hedge delay.
+    """
+    def __init__(self, adapters, hedge_delay=EXCHANGE_HEDGE_DELAY):
+        self.adapters = adapters
+        self.hedge_delay = hedge_delay
+        self.executor = ThreadPoolExecutor(max_workers=EXCHANGE_WORKERS, thread_name_prefix="exchange")
+
+    def first(self, op, call, hedge_delay=None):
+        """(adapter, result) for the first exchange where call(adapter) returned something other than None, else (None, None)."""
+        waiting, pending = list(self.adapters), {}
+        def launch():
+            while waiting:
+                adapter = waiting.pop(0)
+                if adapter.breaker.allow():
+                    pending[self.executor.submit(self.attempt, adapter, op, call)] = adapter
+                    return True
+                METRICS.inc('bot_exchange_requests_total', exchange=adapter.name, op=op, result='circuit_open')
+            return False
+        launch()
+        while pending:
+            done, _ = wait_futures(pending, timeout=(hedge_delay or self.hedge_delay) if waiting else None, return_when=FIRST_COMPLETED)
+            if not done: # Slow: ask the next exchange as well
+                if launch(): METRICS.inc('bot_exchange_hedges_total', op=op)
+                continue
+            for future in done:
+                adapter, result = pending.pop(future), future.result()
+                if result is not None:
+                    METRICS.inc('bot_exchange_answers_total', exchange=adapter.name, op=op)
+                    return adapter, result
+                launch()
+        return None, None
+
+    def attempt(self, adapter, op, call):
+        """call(adapter) with breaker bookkeeping; None if the exchange failed or doesn't list the pair."""
+        try:
+            with METRICS.span(f"{op}_fetch", exchange=adapter.name): result = call(adapter)
+        except Exception as e:
+            METRICS.inc('bot_exchange_requests_total', exchange=adapter.name, op=op, result='error')
+            log.warning("%s %s request failed: %s", adapter.name, op, e)
+            if adapter.breaker.failure():
+                METRICS.inc('bot_exchange_circuit_opens_total', exchange=adapter.name)
+                log.warning("Circuit open for %s: skipping it for %ss", adapter.name, adapter.breaker.cooldown)
+            return None
+        adapter.breaker.success()
+        METRICS.inc('bot_exchange_requests_total', exchange=adapter.name, op=op, result='unlisted' if result is None else 'ok')
+        return result
+
+
+class MarketDataFeed:
+    """
+    Keeps tickers, best bid/ask and the open 1h candle of tracked symbols current from
+    Bybit's public spot WebSocket (`tickers.*`, `orderbook.1.*` and `kline.60.*` topics).
+    Runs in a daemon thread and reconnects with backoff, resubscribing every tracked
+    topic. Confirmed (closed) candles are handed to `on_closed_candle(symbol, candles)`
+    and every ticker price to `on_ticker(symbol, price)`.
+    """
+    PING_INTERVAL = 20
+    SUBSCRIBE_BATCH = 10 # Bybit spot accepts at most 10 args per subscribe request
+
+    def __init__(self, url, max_symbols=MARKET_FEED_MAX_SYMBOLS, on_closed_candle=None, on_ticker=None):
+        self.url = url
+        self.max_symbols = max_symbols
+        self.on_closed_candle = on_closed_candle
+        self.on_ticker = on_ticker # Called as on_ticker(symbol, last_price) for every streamed ticker
+        self.tracked = OrderedDict() # symbol -> None, least recently queried first
+        self.tickers = {} # symbol -> (REST-shaped ticker dict, monotonic receive time)
+        self.open_candles = {} # symbol -> 1-row CANDLE_DTYPE array
+        self.lock = threading.Lock()
+        self.ws = None
+        self.connected = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def topics_for(symbol):
+        return [f"tickers.{symbol}USDT", f"orderbook.1.{symbol}USDT", f"kline.{BYBIT_INTERVAL_MAP['1h']}.{symbol}USDT"]
+
+    def start(self):
+        if self.thread and self.thread.is_alive(): return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="market-feed", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        ws = self.ws
+        if ws:
+            try: ws.close()
+            except Exception: pass
+        if self.thread: self.thread.join(timeout=5)
+
+    def track(self, symbols):
+        """Marks symbols as recently queried, subscribing new ones and evicting the stalest."""
+        added, evicted = [], []
+        with self.lock:
+            for symbol in symbols:
+                if symbol in self.tracked: self.tracked.move_to_end(symbol)
+                else:
+                    self.tracked[symbol] = None
+                    added.append(symbol)
+            while len(self.tracked) > self.max_symbols:
+                old_symbol, _ = self.tracked.popitem(last=False)
+                self.tickers.pop(old_symbol, None); self.open_candles.pop(old_symbol, None)
+                evicted.append(old_symbol)
+        if self.connected.is_set():
+            self._send_topics("unsubscribe", [t for s in evicted for t in self.topics_for(s)])
+            self._send_topics("subscribe", [t for s in added for t in self.topics_for(s)])
+
+    def get_ticker(self, symbol, max_age=MARKET_FEED_TICKER_MAX_AGE):
+        """REST-shaped ticker dict if a fresh one was streamed, else None."""
+        if not self.connected.is_set(): return None
+        entry = self.tickers.get(symbol)
+        if entry and 'lastPrice' in entry[0] and time.monotonic() - entry[1] <= max_age:
+            return dict(entry[0])
+        return None
+
+    def get_open_candle(self, symbol, open_ts):
+        """The streamed 1h candle that opened at open_ts, or None."""
+        if not self.connected.is_set(): return None
+        candle = self.open_candles.get(symbol)
+        return candle if candle is not None and candle['ts'][0] == open_ts else None
+
+    def _send_topics(self, op, topics):
+        for i in range(0, len(topics), self.SUBSCRIBE_BATCH):
+            try: self.ws.send(json.dumps({"op": op, "args": topics[i:i + self.SUBSCRIBE_BATCH]}))
+            except Exception as e: log.error("Error sending %s to market feed: %s", op, e)
+
+    def _run(self):
+        backoff = 1
+        while not self.stopped.is_set():
+            try:
+                self.ws = websocket.create_connection(self.url, timeout=10)
+                self.ws.settimeout(self.PING_INTERVAL)
+                self.connected.set()
+                backoff = 1
+                log.info("✅ Market feed connected (%s symbols)", len(self.tracked))
+                with self.lock: symbols = list(self.tracked)
+                self._send_topics("subscribe", [t for s in symbols for t in self.topics_for(s)])
+                last_ping = time.monotonic()
+                while not self.stopped.is_set():
+                    if time.monotonic() - last_ping >= self.PING_INTERVAL:
+                        self.ws.send(json.dumps({"op": "ping"}))
+                        last_ping = time.monotonic()
+                    try:
+                        raw = self.ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if not raw: raise ConnectionError("market feed closed by server")
+                    self._handle_message(json.loads(raw))
+            except Exception as e:
+                if not self.stopped.is_set(): log.warning("Market feed disconnected: %s. Reconnecting in %ss", e, backoff)
+            finally:
+                self.connected.clear()
+                if self.ws:
+                    try: self.ws.close()
+                    except Exception: pass
+            self.stopped.wait(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _handle_message(self, msg):
+        topic = msg.get('topic', '')
+        data = msg.get('data')
+        if not topic or data is None: return
+        symbol = topic.rsplit('.', 1)[-1].removesuffix('USDT')
+        now = time.monotonic()
+        if topic.startswith('tickers.'):
+            with self.lock:
+                ticker = dict(self.tickers.get(symbol, ({}, 0))[0]); ticker.update(data)
+                self.tickers[symbol] = (ticker, now)
+            if self.on_ticker and 'lastPrice' in data:
+                try: self.on_ticker(symbol, float(data['lastPrice']))
+                except Exception: log.exception("Ticker consumer failed for %s", symbol) # Never drop the feed for a consumer's bug
+        elif topic.startswith('orderbook.'):
+            bids, asks = data.get('b') or [], data.get('a') or []
+            with self.lock:
+                ticker = dict(self.tickers.get(symbol, ({}, 0))[0])
+                if bids: ticker['bid1Price'], ticker['bid1Size'] = bids[0]
+                if asks: ticker['ask1Price'], ticker['ask1Size'] = asks[0]
+                self.tickers[symbol] = (ticker, self.tickers.get(symbol, (None, now))[1])
+        elif topic.startswith('kline.'):
+            for k in data:
+                candle = np.array([(int(k['start']), float(k['open']), float(k['high']), float(k['low']),
+                                    float(k['close']), float(k['volume']))], dtype=CANDLE_DTYPE)
+                if k.get('confirm'):
+                    if self.on_closed_candle:
+                        try: self.on_closed_candle(symbol, candle)
+                        except Exception: log.exception("Closed-candle consumer failed for %s", symbol)
+                else:
+                    self.open_candles[symbol] = candle
+
+
+class AlertEngine:
+    """
+    Price alerts persisted in SQLite and indexed in memory per symbol as two sorted
+    lists of (threshold, alert_id): `above` alerts fire once price >= threshold (a
+    prefix of the list), `below` alerts once price <= threshold (a suffix). Each price
+    update therefore costs two bisects plus the alerts it actually crosses.
+    Percent-move alerts are an above/below pair sharing a group_id; whichever fires
+    first removes its sibling.
+    """
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, symbol TEXT NOT NULL,
+            direction TEXT NOT NULL, price REAL NOT NULL, group_id INTEGER, note TEXT, created_at INTEGER)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS alerts_chat ON alerts (chat_id)")
+        self.db.execute(UPDATE_WRITES_SCHEMA)
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.alerts = {} # id -> row dict
+        self.index = {} # symbol -> {'above': [(price, id), ...], 'below': [...]}
+        self.by_chat = {} # chat_id -> set of alert ids
+        self.groups = {} # group_id -> set of alert ids
+        for row in self.db.execute("SELECT id, chat_id, symbol, direction, price, group_id, note FROM alerts"):
+            self._index_row(dict(zip(('id', 'chat_id', 'symbol', 'direction', 'price', 'group_id', 'note'), row)), sort=False)
+        for lists in self.index.values():
+            lists['above'].sort(); lists['below'].sort()
+
+    def _index_row(self, alert, sort=True):
+        self.alerts[alert['id']] = alert
+        self.by_chat.setdefault(alert['chat_id'], set()).add(alert['id'])
+        if alert['group_id']: self.groups.setdefault(alert['group_id'], set()).add(alert['id'])
+        lists = self.index.setdefault(alert['symbol'], {'above': [], 'below': []})
+        entry = (alert['price'], alert['id'])
+        if sort: bisect.insort(lists[alert['direction']], entry)
+        else: lists[alert['direction']].append(entry)
+
+    def _unindex(self, alert_id, from_lists=True):
+        alert = self.alerts.pop(alert_id, None)
+        if not alert: return None
+        chat_ids = self.by_chat[alert['chat_id']]; chat_ids.discard(alert_id)
+        if not chat_ids: del self.by_chat[alert['chat_id']]
+        if alert['group_id']:
+            group = self.groups[alert['group_id']]; group.discard(alert_id)
+            if not group: del self.groups[alert['group_id']]
+        lists = self.index.get(alert['symbol'])
+        if lists is None: return alert # The symbol's lists were emptied and dropped earlier in the same evaluate()
+        if from_lists:
+            entries = lists[alert['direction']]
+            pos = bisect.bisect_left(entries, (alert['price'], alert_id))
+            if pos < len(entries) and entries[pos][1] == alert_id: del entries[pos]
+        if not lists['above'] and not lists['below']: del self.index[alert['symbol']]
+        return alert
+
+    def symbols(self):
+        with self.lock: return list(self.index)
+
+    def count_for_chat(self, chat_id):
+        with self.lock: return len(self.by_chat.get(chat_id, ()))
+
+    def list_for_chat(self, chat_id):
+        with self.lock: return [dict(self.alerts[i]) for i in sorted(self.by_chat.get(chat_id, ()))]
+
+    def add(self, chat_id, symbol, direction, price, note=None, update_id=None):
+        """Adds one above/below alert and returns its id (an earlier run's, if update_id already added it)."""
+        return self._add_rows(chat_id, symbol, [(direction, price)], note, update_id=update_id)[0]
+
+    def add_move(self, chat_id, symbol, pct, ref_price, update_id=None):
+        """Adds a +/-pct move alert around ref_price as a linked above/below pair. Returns the ids."""
+        note = f"move {pct:g}% from {ref_price:g}"
+        return self._add_rows(chat_id, symbol, [('above', ref_price * (1 + pct / 100)), ('below', ref_price * (1 - pct / 100))], note,
+                              grouped=True, update_id=update_id)
+
+    def _add_rows(self, chat_id, symbol, legs, note, grouped=False, update_id=None):
+        with self.lock:
+            ids = replayed_write(self.db, update_id)
+            if ids is not None: return ids
+            ids = []
+            for direction, price in legs:
+                cur = self.db.execute("INSERT INTO alerts (chat_id, symbol, direction, price, note, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                      (chat_id, symbol, direction, float(price), note, int(time.time())))
+                ids.append(cur.lastrowid)
+            group_id = ids[0] if grouped else None
+            if grouped: self.db.execute(f"UPDATE alerts SET group_id = ? WHERE id IN ({','.join('?' * len(ids))})", [group_id] + ids)
+            record_write(self.db, update_id, ids)
+            self.db.commit()
+            for alert_id, (direction, price) in zip(ids, legs):
+                self._index_row({'id': alert_id, 'chat_id': chat_id, 'symbol': symbol, 'direction': direction,
+                                 'price': float(price), 'group_id': group_id, 'note': note})
+            return ids
+
+    def remove(self, chat_id, alert_id):
+        """Removes an alert (and its move-alert sibling) if it belongs to chat_id."""
+        with self.lock:
+            alert = self.alerts.get(alert_id)
+            if not alert or alert['chat_id'] != chat_id: return False
+            ids = list(self.groups.get(alert['group_id'], ())) or [alert_id]
+            for i in ids: self._unindex(i)
+            self._delete_rows(ids)
+            return True
+
+    def clear_chat(self, chat_id):
+        with self.lock:
+            ids = list(self.by_chat.get(chat_id, ()))
+            for i in ids: self._unindex(i)
+            self._delete_rows(ids)
+            return len(ids)
+
+    def _delete_rows(self, ids):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            self.db.execute(f"DELETE FROM alerts WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        self.db.commit()
+
+    def evaluate(self, symbol, price):
+        """Removes and returns every alert on `symbol` crossed by `price`."""
+        if symbol not in self.index: return [] # Most ticks: no alerts on this symbol at all
+        with self.lock:
+            lists = self.index.get(symbol)
+            if not lists: return []
+            above, below = lists['above'], lists['below']
+            if (not above or above[0][0] > price) and (not below or below[-1][0] < price): return [] # Nothing crossed
+            # Crossed alerts are a contiguous slice of each list: cut them out in one go
+            above_end = bisect.bisect_right(above, (price, float('inf')))
+            below_start = bisect.bisect_left(below, (price, -1))
+            crossed = above[:above_end] + below[below_start:]
+            del above[:above_end], below[below_start:]
+            fired, removed = [], []
+            for _, alert_id in crossed:
+                alert = self._unindex(alert_id, from_lists=False)
+                if not alert: continue # Already removed as the sibling of a move alert
+                fired.append(dict(alert, triggered_price=price))
+                removed.append(alert_id)
+                for sibling_id in list(self.groups.get(alert['group_id'], ())):
+                    self._unindex(sibling_id); removed.append(sibling_id)
+            self._delete_rows(removed)
+            return fired
+
+
+class Watchlists:
+    """Per-chat symbol lists in SQLite, shown together by /watchlist from one bulk ticker read."""
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS watchlists (
+            chat_id INTEGER NOT NULL, symbol TEXT NOT NULL, added_at INTEGER, PRIMARY KEY (chat_id, symbol))""")
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def get(self, chat_id):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT symbol FROM watchlists WHERE chat_id = ? ORDER BY added_at, symbol", (chat_id,))]
+
+    def add(self, chat_id, symbols):
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO watchlists (chat_id, symbol, added_at) VALUES (?, ?, ?)",
+                                [(chat_id, s, int(time.time())) for s in symbols])
+            self.db.commit()
+
+    def remove(self, chat_id, symbols):
+        with self.lock:
+            self.db.executemany("DELETE FROM watchlists WHERE chat_id = ? AND symbol = ?", [(chat_id, s) for s in symbols])
+            self.db.commit()
+
+
+class Portfolios:
+    """
+    Per-chat holdings in SQLite, one (amount, cost) row per symbol where cost is the total
+    USDT paid. get() returns a chat's positions as columns, so /portfolio values all of them
+    in one vectorized pass over the bulk ticker table.
+    """
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS portfolio_positions (
+            chat_id INTEGER NOT NULL, symbol TEXT NOT NULL, amount REAL NOT NULL, cost REAL NOT NULL,
+            updated_at INTEGER, PRIMARY KEY (chat_id, symbol))""")
+        self.db.execute(UPDATE_WRITES_SCHEMA)
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def get(self, chat_id):
+        """(symbols, amounts, costs) for chat_id, the last two as float arrays."""
+        with self.lock:
+            rows = self.db.execute("SELECT symbol, amount, cost FROM portfolio_positions WHERE chat_id = ? ORDER BY symbol", (chat_id,)).fetchall()
+        return [r[0] for r in rows], np.array([r[1] for r in rows], dtype=float), np.array([r[2] for r in rows], dtype=float)
+
+    def holds(self, chat_id, symbol):
+        with self.lock: return bool(self.db.execute("SELECT 1 FROM portfolio_positions WHERE chat_id = ? AND symbol = ?", (chat_id, symbol)).fetchone())
+
+    def count(self, chat_id):
+        with self.lock: return self.db.execute("SELECT COUNT(*) FROM portfolio_positions WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+
+    def add(self, chat_id, symbol, amount, price, update_id=None):
+        """
+        Buys `amount` at `price` into the position (costs add up, so PnL is against the average
+        price). Returns the price bought at: an earlier run's if update_id already added it.
+        """
+        with self.lock:
+            replayed = replayed_write(self.db, update_id)
+            if replayed is not None: return replayed
+            self.db.execute("""INSERT INTO portfolio_positions (chat_id, symbol, amount, cost, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (chat_id, symbol) DO UPDATE SET amount = amount + excluded.amount, cost = cost + excluded.cost,
+                updated_at = excluded.updated_at""", (chat_id, symbol, float(amount), float(amount * price), int(time.time())))
+            record_write(self.db, update_id, float(price))
+            self.db.commit()
+            return float(price)
+
+    def remove(self, chat_id, symbol, amount=None, update_id=None):
+        """
+        Sells `amount` (everything if None) out of a position, shrinking its cost in proportion.
+        Returns the amount left, or None if not held; an earlier run's result if update_id already sold.
+        """
+        with self.lock:
+            replayed = replayed_write(self.db, update_id)
+            if replayed is not None: return replayed['left']
+            row = self.db.execute("SELECT amount, cost FROM portfolio_positions WHERE chat_id = ? AND symbol = ?", (chat_id, symbol)).fetchone()
+            if not row: return None
+            held, cost = row
+            left = 0.0 if amount is None or amount >= held * (1 - 1e-9) else held - amount
+            if left: self.db.execute("UPDATE portfolio_positions SET amount = ?, cost = ?, updated_at = ? WHERE chat_id = ? AND symbol = ?",
+                                     (left, cost * left / held, int(time.time()), chat_id, symbol))
+            else: self.db.execute("DELETE FROM portfolio_positions WHERE chat_id = ? AND symbol = ?", (chat_id, symbol))
+            record_write(self.db, update_id, {'left': left})
+            self.db.commit()
+            return left
+
+
+class UpdateJournal:
+    """
+    Crash-safe record of Telegram updates in SQLite. accept() stores a polled batch as
+    pending and advances the committed getUpdates offset in the same transaction, so
+    Telegram never redelivers it; each update is marked done once handled. Replies that
+    were slow to build are stored (and flagged once delivered) under (update_id, seq), so
+    an update resumed after a crash re-sends or skips them instead of recomputing.
+    """
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL") # WAL keeps commits atomic; this just skips the fsync per commit
+        self.db.execute("""CREATE TABLE IF NOT EXISTS update_journal (
+            update_id INTEGER PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL, accepted_at INTEGER NOT NULL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS update_replies (
+            update_id INTEGER NOT NULL, seq INTEGER NOT NULL, reply TEXT NOT NULL, delivered INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (update_id, seq))""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute(UPDATE_WRITES_SCHEMA)
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.local = threading.local() # Current update id and reply counter on the handling thread
+
+    def offset(self):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM bot_state WHERE key = 'update_offset'").fetchone()
+        return int(row[0]) if row else 0
+
+    def accept(self, updates):
+        """Journals a polled batch and commits the offset past it. Returns the updates not seen before."""
+        if not updates: return []
+        fresh, now = [], int(time.time())
+        with self.lock:
+            for update in updates:
+                cursor = self.db.execute("INSERT OR IGNORE INTO update_journal (update_id, payload, status, accepted_at) VALUES (?, ?, 'pending', ?)",
+                                         (update['update_id'], json.dumps(update), now))
+                if cursor.rowcount: fresh.append(update)
+            self.db.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES ('update_offset', ?)",
+                            (str(max(u['update_id'] for u in updates) + 1),))
+            self.db.commit()
+        if len(fresh) < len(updates): METRICS.inc('bot_journal_duplicates_total', len(updates) - len(fresh))
+        return fresh
+
+    def pending(self, max_age=JOURNAL_RESUME_MAX_AGE):
+        """Unfinished updates to resume, oldest first. Older ones are expired; old finished ids are pruned."""
+        now = int(time.time())
+        with self.lock:
+            self.db.execute("UPDATE update_journal SET status = 'expired' WHERE status = 'pending' AND accepted_at < ?", (now - max_age,))
+            self.db.execute("DELETE FROM update_journal WHERE status != 'pending' AND accepted_at < ?", (now - JOURNAL_RETENTION,))
+            self.db.execute("DELETE FROM update_replies WHERE update_id NOT IN (SELECT update_id FROM update_journal WHERE status = 'pending')")
+            self.db.execute("DELETE FROM update_writes WHERE made_at < ?", (now - JOURNAL_RETENTION,))
+            self.db.commit()
+            rows = self.db.execute("SELECT payload FROM update_journal WHERE status = 'pending' ORDER BY update_id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    @contextmanager
+    def handling(self, update_id):
+        """Tags replies made inside the block with update_id; marks it done if the block completes (unless deferred)."""
+        self.local.update_id, self.local.seq, self.local.deferred = update_id, 0, False
+        try:
+            yield
+        finally:
+            self.local.update_id = None
+        if not self.local.deferred: self.finish(update_id)
+
+    def defer(self):
+        """Leaves the current update pending past handling(); whoever completes its work calls finish()."""
+        self.local.deferred = True
+
+    def finish(self, update_id):
+        with self.lock:
+            self.db.execute("UPDATE update_journal SET status = 'done' WHERE update_id = ?", (update_id,))
+            self.db.execute("DELETE FROM update_replies WHERE update_id = ?", (update_id,))
+            self.db.commit()
+
+    def current(self):
+        """The update being handled on this thread, or None outside a journaled update."""
+        return getattr(self.local, 'update_id', None)
+
+    def reply_key(self):
+        """(update_id, seq) for the next reply on this thread, or None outside a journaled update."""
+        update_id = getattr(self.local, 'update_id', None)
+        if update_id is None: return None
+        self.local.seq += 1
+        return (update_id, self.local.seq)
+
+    def stored_reply(self, key):
+        """(reply, delivered) saved by an earlier run of this update, or None."""
+        with self.lock:
+            row = self.db.execute("SELECT reply, delivered FROM update_replies WHERE update_id = ? AND seq = ?", key).fetchone()
+        return (json.loads(row[0]), bool(row[1])) if row else None
+
+    def store_reply(self, key, reply):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO update_replies (update_id, seq, reply) VALUES (?, ?, ?)", (*key, json.dumps(reply)))
+            self.db.commit()
+
+    def mark_delivered(self, key):
+        with self.lock:
+            self.db.execute("UPDATE update_replies SET delivered = 1 WHERE update_id = ? AND seq = ?", key)
+            self.db.commit()
+
+
+UPDATE_WRITES_SCHEMA = """CREATE TABLE IF NOT EXISTS update_writes (
+    update_id INTEGER PRIMARY KEY, result TEXT NOT NULL, made_at INTEGER NOT NULL)""" # In bot.db, next to the stores that write it
+
+
+def replayed_write(db, update_id):
+    """
+    What the state change of update_id returned when an earlier run made it (see record_write),
+    or None if none did. Stores check this under their lock so a resumed update doesn't write twice.
+    """
+    if update_id is None: return None
+    row = db.execute("SELECT result FROM update_writes WHERE update_id = ?", (update_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def record_write(db, update_id, result):
+    """Records update_id's state change and its result in db's open transaction, so both commit together."""
+    if update_id is not None:
+        db.execute("INSERT INTO update_writes (update_id, result, made_at) VALUES (?, ?, ?)", (update_id, json.dumps(result), int(time.time())))
+
+
+class TelegramOutbox:
+    """
+    Rate-limited Telegram Bot API sender. Calls are queued by priority lane
+    (TELEGRAM_PRIORITY) and sent by a small thread pool once both the global token
+    bucket and the target chat's bucket allow it; a throttled chat never holds up
+    other chats. A 429 pauses the call's chat for `retry_after` (a call without a chat,
+    such as answerCallbackQuery, just waits itself) and requeues it; only when several
+    chats are paused at once is the limit taken as global and every call held back.
+    Queued edits of the same message are coalesced so only the latest text is sent.
+    """
+    def __init__(self, api_base, threads=TELEGRAM_SENDER_THREADS):
+        self.api_base = api_base
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
+        self.chat_buckets = {}
+        self.blocked_until = {} # chat_id (None = global) -> monotonic time; expired entries are pruned on each 429
+        self.pending = [] # (priority, seq, job), kept sorted
+        self.queued_edits = {} # (chat_id, message_id) -> queued editMessageText job
+        self.cond = threading.Condition()
+        self.seq = itertools.count()
+        for i in range(threads):
+            threading.Thread(target=self._worker, name=f"telegram-sender-{i}", daemon=True).start()
+
+    def call(self, method, data, files=None, wait=True, timeout=60):
+        """Queues a Bot API call. With wait=True, returns its JSON response (or None on failure)."""
+        future = Future()
+        edit_key = (str(data.get('chat_id')), data.get('message_id')) if method == 'editMessageText' else None
+        with self.cond:
+            queued = self.queued_edits.get(edit_key) if edit_key else None
+            if queued:
+                queued['data'] = data # Newer text replaces the unsent one; both callers get its result
+                queued['waiters'].append(future)
+            else:
+                job = {'method': method, 'data': data, 'files': files, 'waiters': [future], 'attempts': 0,
+                       'chat_id': data.get('chat_id') if method in TELEGRAM_CHAT_LIMITED else None,
+                       'edit_key': edit_key, 'seq': next(self.seq)}
+                bisect.insort(self.pending, (TELEGRAM_PRIORITY.get(method, 2), job['seq'], job))
+                if edit_key: self.queued_edits[edit_key] = job
+            self.cond.notify()
+        if not wait: return None
+        try:
+            return future.result(timeout)
+        except Exception:
+            log.error("Error waiting for Telegram %s: timed out", method)
+            return None
+
+    def queue_depth(self):
+        with self.cond: return len(self.pending)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000: # Forget idle chats; a fresh bucket is full anyway
+                self.chat_buckets = {c: b for c, b in self.chat_buckets.items() if b.try_acquire(b.capacity, consume=False)}
+            is_group = str(chat_id).startswith('-')
+            bucket = self.chat_buckets[chat_id] = TokenBucket(TELEGRAM_GROUP_RATE if is_group else TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        return bucket
+
+    def _take_next(self):
+        """Pops the first sendable job (cond held). Returns (job, 0) or (None, seconds to wait)."""
+        now = time.monotonic()
+        global_block = self.blocked_until.get(None, 0) - now
+        if global_block > 0: return None, global_block
+        wait = 1.0
+        for i, (_, _, job) in enumerate(self.pending):
+            chat_id, scope = job['chat_id'], job['data'].get('chat_id')
+            chat_wait = max(self.blocked_until.get(scope, 0) if scope is not None else 0, job.get('not_before', 0)) - now
+            if chat_wait <= 0 and chat_id is not None:
+                chat_wait = self._chat_bucket(chat_id).try_acquire(consume=False)
+            if chat_wait > 0:
+                wait = min(wait, chat_wait); continue
+            global_wait = self.global_bucket.try_acquire()
+            if global_wait: return None, global_wait
+            if chat_id is not None: self._chat_bucket(chat_id).try_acquire()
+            del self.pending[i]
+            if job['edit_key'] and self.queued_edits.get(job['edit_key']) is job: del self.queued_edits[job['edit_key']]
+            return job, 0
+        return None, wait
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                job, wait = self._take_next()
+                while job is None:
+                    self.cond.wait(wait if self.pending else None)
+                    job, wait = self._take_next()
+            response = self._post(job)
+            if response and response.get('error_code') == 429 and job['attempts'] < TELEGRAM_MAX_RETRIES:
+                retry_after = (response.get('parameters') or {}).get('retry_after', 1)
+                log.warning("⚠️ Telegram rate limit on %s (chat %s), retrying in %ss", job['method'], job['data'].get('chat_id'), retry_after)
+                METRICS.inc('bot_telegram_retries_total', method=job['method'])
+                job['attempts'] += 1
+                with self.cond:
+                    now = time.monotonic()
+                    self.blocked_until = {k: t for k, t in self.blocked_until.items() if t > now}
+                    scope = job['data'].get('chat_id')
+                    if scope is None: job['not_before'] = now + retry_after
+                    else:
+                        self.blocked_until[scope] = now + retry_after
+                        if sum(k is not None for k in self.blocked_until) >= TELEGRAM_GLOBAL_429_CHATS:
+                            self.blocked_until[None] = now + retry_after
+                    bisect.insort(self.pending, (TELEGRAM_PRIORITY.get(job['method'], 2), job['seq'], job))
+                    self.cond.notify()
+                continue
+            for future in job['waiters']: future.set_result(response)
+
+    def _post(self, job):
+        try:
+            with METRICS.span('telegram', method=job['method']):
+                response = requests.post(f"{self.api_base}/{job['method']}", data=job['data'], files=job['files'],
+                                         timeout=30 if job['files'] else 10)
+            return response.json()
+        except Exception as e:
+            log.error("Error calling Telegram %s: %s", job['method'], e)
+        return None
+
 
 class BybitCryptoBotEnhanced:
     def __init__(self, telegram_token, api_key, api_secret):
         self.telegram_token = telegram_token
         self.api_key = api_key
         self.api_secret = api_secret
-        self.base_url = "https://api.bybit.com"
-        self.telegram_api = f"https://api.telegram.org/bot{telegram_token}"
+        self.base_url = BYBIT_REST_URL
+        self.telegram_api = f"{TELEGRAM_API_URL}/bot{telegram_token}"
+        self.telegram_outbox = TelegramOutbox(self.telegram_api)
+        self.response_executor = ThreadPoolExecutor(max_workers=RESPONSE_WORKERS)
+        self.render_guard = RenderGuard()
+        self.update_context = threading.local() # update_id, user_id and (for button taps) callback of the update being handled on this thread
+        self.callback_gate = CallbackGate()
+        self.admission = AdmissionController(run=lambda job: self.compute_reply(job['compute']), deliver=self.deliver_admitted,
+                                             progress=lambda job: [self.send_chat_action(w['chat_id'], w['action']) for w in job['waiters']])
         
         self.popular_coins = [
             "BTC", "ETH", "BNB", "XRP", "ADA", "DOT", "LINK", "LTC", "BCH", "UNI",
@@ -62,10 +2282,37 @@ class BybitCryptoBotEnhanced:
             'ALGORAND': 'ALGO', 'DOGECOIN': 'DOGE', 'SHIBA INU': 'SHIB', 'TRON': 'TRX'
         }
         
-        self.offset = 0
+        self.journal = UpdateJournal(BOT_DB_PATH)
+        self.cache = open_cache() # Tickers, symbols, kline tails, charts and Gemini answers
+        self.offset = self.journal.offset()
         self.supported_symbols_cache = set()
-        self.cache_updated = False
-        plt.style.use('dark_background')
+        self.price_precision = PricePrecision() # Per-symbol price formats from the instruments' tick sizes
+        self.chart_link_secret = (CHART_WEB_SECRET or hashlib.sha256(f"chart-links:{telegram_token}".encode()).hexdigest()).encode()
+        self.instruments = None # Last instruments snapshot applied to the symbol set and price precision
+        self.candle_store = CandleStore(CANDLE_STORE_DIR)
+        unknown = [name for name in EXCHANGES if name not in EXCHANGE_ADAPTERS]
+        if unknown: log.warning("⚠️ Unknown exchanges in EXCHANGES ignored: %s", ", ".join(unknown))
+        self.exchanges = MarketDataRouter([EXCHANGE_ADAPTERS[name]() for name in EXCHANGES if name in EXCHANGE_ADAPTERS] or [BybitAdapter()])
+        self.kline_executor = ThreadPoolExecutor(max_workers=KLINE_FETCH_WORKERS) # Page requests only: its tasks never wait on it
+        self.symbol_executor = ThreadPoolExecutor(max_workers=SYMBOL_FETCH_WORKERS)
+        self.market_feed = None
+        if MARKET_FEED_ENABLED and websocket:
+            self.market_feed = MarketDataFeed(BYBIT_WS_URL, on_closed_candle=self.on_feed_closed_candle,
+                                              on_ticker=self.on_price_update)
+        elif MARKET_FEED_ENABLED:
+            log.warning("⚠️ websocket-client not installed. Live market feed disabled; using REST only.")
+        self.alert_engine = AlertEngine(BOT_DB_PATH)
+        self.watchlists = Watchlists(BOT_DB_PATH)
+        self.portfolios = Portfolios(BOT_DB_PATH)
+        self.ticker_table = (None, None) # (tickers dict, get_ticker_table() columns built from it)
+        self.alert_outbox = [] # Triggered alerts waiting for the next batched flush
+        self.alert_outbox_lock = threading.Lock()
+        METRICS.register_gauge('bot_telegram_outbox_depth', self.telegram_outbox.queue_depth)
+        METRICS.register_gauge('bot_market_feed_symbols', lambda: len(self.market_feed.tracked) if self.market_feed else 0)
+        METRICS.register_gauge('bot_rss_bytes', current_rss_bytes)
+        METRICS.register_gauge('bot_admission_queue_cost', self.admission.queue_cost)
+        METRICS.register_gauge('bot_exchange_circuits_open', lambda: sum(a.breaker.is_open for a in self.exchanges.adapters))
+        self.profiler = Profiler()
     
     def generate_signature(self, timestamp, params_str):
         param_str = str(timestamp) + self.api_key + params_str
@@ -93,30 +2340,19 @@ class BybitCryptoBotEnhanced:
         except Exception as e:
             return {"error": str(e)}
     
-    def get_all_symbols(self):
-        url = f"{self.base_url}/v5/market/instruments-info"
-        params = {"category": "spot"}
-        try:
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('retCode') == 0:
-                    symbols = set()
-                    for item in data.get('result', {}).get('list', []):
-                        symbol = item.get('symbol', '')
-                        if symbol.endswith('USDT'):
-                            symbols.add(symbol.replace('USDT', ''))
-                    return symbols
-        except Exception as e:
-            print(f"Error getting symbols: {e}")
-        return set()
+    def get_spot_instruments(self):
+        """{base symbol: tickSize} for every USDT spot pair on the first exchange that answers, or {} on error."""
+        _, instruments = self.exchanges.first('instruments', lambda a: a.instruments() or None)
+        return instruments or {}
     
     def update_symbols_cache(self):
-        if not self.cache_updated:
-            print("📊 Updating supported symbols cache...")
-            self.supported_symbols_cache = self.get_all_symbols()
-            self.cache_updated = True
-            print(f"✅ Cached {len(self.supported_symbols_cache)} symbols")
+        """Applies the cached instruments (refetched every SYMBOLS_CACHE_TTL) whenever they differ from the last ones applied."""
+        instruments = self.cache.get_or_compute('instruments:spot', SYMBOLS_CACHE_TTL, lambda: self.get_spot_instruments() or None)
+        if not instruments or instruments == self.instruments: return
+        self.instruments = instruments
+        self.supported_symbols_cache = set(instruments)
+        self.price_precision.update(instruments)
+        log.info("✅ Cached %s symbols", len(self.supported_symbols_cache))
     
     def normalize_symbol(self, symbol):
         symbol = symbol.strip().upper()
@@ -129,29 +2365,120 @@ class BybitCryptoBotEnhanced:
         if query in self.supported_symbols_cache: return [query]
         return [s for s in self.supported_symbols_cache if query in s][:5]
 
+    def fetch_kline_range(self, symbol, user_interval, start_ms, end_ms):
+        """
+        [start_ms, end_ms] as a CANDLE_DTYPE array sorted oldest-first from the first exchange
+        that lists the pair (see MarketDataRouter), or None if none could serve it. Long ranges
+        are paged in parallel within that one exchange, so a single fetched range never mixes sources.
+        The CandleStore keeps one file per pair, though: ranges fetched at different times may come
+        from different exchanges when the first one was slow or down, so stored history can mix them.
+        """
+        pages = -(-(end_ms - start_ms + 1) // (KLINE_PAGE_LIMIT * INTERVAL_MS[user_interval]))
+        _, candles = self.exchanges.first('kline', lambda a: a.klines(symbol, user_interval, start_ms, end_ms, self.kline_executor),
+                                          hedge_delay=EXCHANGE_HEDGE_DELAY * max(1, pages))
+        return candles
+
+    def get_candles(self, symbol, user_interval, start_ms):
+        """
+        Candles from the one containing start_ms up to the still-open one, as a
+        CANDLE_DTYPE array oldest-first. Closed candles come from the on-disk store;
+        only missing ranges (older history, or the tail after the last stored candle)
+        are fetched. When the store is current, the open candle comes from the market
+        feed; while the feed is connected but has not streamed it yet (just after a
+        restart, or a newly tracked symbol) the closed candles are served on their own
+        rather than waiting on REST. Without a feed the open candle costs one request.
+        """
+        interval_ms = INTERVAL_MS[user_interval]
+        now_ms = int(time.time() * 1000)
+        open_candle_ts = candle_open_ts(now_ms, user_interval)
+        last_closed_ts = open_candle_ts - interval_ms
+        start_ms = candle_open_ts(start_ms, user_interval)
+
+        store = self.candle_store
+        coverage = store.coverage(symbol, user_interval)
+        fetched = None
+        open_candle = None
+        METRICS.cache('candle_store', bool(coverage) and start_ms >= coverage['first_ts'])
+        if not coverage:
+            fetched = self.fetch_kline_range(symbol, user_interval, start_ms, now_ms)
+        else:
+            if start_ms < coverage['first_ts'] and not coverage.get('head'):
+                older = self.fetch_kline_range(symbol, user_interval, start_ms, coverage['first_ts'] - 1)
+                if older is not None:
+                    store.write(symbol, user_interval, older)
+                    if not len(older) or older['ts'][0] > start_ms: store.mark_head(symbol, user_interval)
+            streamed = self.market_feed and user_interval == '1h' and coverage['last_ts'] >= last_closed_ts
+            if streamed:
+                self.market_feed.track([symbol])
+                open_candle = self.market_feed.get_open_candle(symbol, open_candle_ts)
+            if open_candle is None and not (streamed and self.market_feed.connected.is_set()):
+                # Usually just the open candle (one tiny request); more if the bot was down for a while.
+                # Always resume right after the stored tail so the file never has interior gaps.
+                # Shared for KLINE_TAIL_TTL, so concurrent charts (and other workers) make one request.
+                tail_ts = coverage['last_ts'] + interval_ms
+                fetched = self.cache.get_or_compute(f"kline_tail:{symbol}:{user_interval}:{tail_ts}", KLINE_TAIL_TTL,
+                                                    lambda: self.fetch_kline_range(symbol, user_interval, tail_ts, now_ms))
+
+        if fetched is not None and len(fetched):
+            store.write(symbol, user_interval, fetched[fetched['ts'] <= last_closed_ts])
+            if not coverage and fetched['ts'][0] > start_ms: store.mark_head(symbol, user_interval)
+            if fetched['ts'][-1] > last_closed_ts: open_candle = fetched[-1:]
+        elif fetched is None and not coverage:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+
+        closed = store.read(symbol, user_interval, start_ms, last_closed_ts)
+        return closed if open_candle is None else np.concatenate([closed, open_candle])
+
+    def on_feed_closed_candle(self, symbol, candle):
+        """Appends a streamed closed 1h candle, but only when it extends the stored series without a gap."""
+        coverage = self.candle_store.coverage(symbol, '1h')
+        if coverage and coverage['last_ts'] + INTERVAL_MS['1h'] == candle['ts'][0]:
+            self.candle_store.write(symbol, '1h', candle)
+
     def get_kline_data(self, symbol, user_interval='1h', limit=168):
-        bybit_interval_map = {'1h': '60', '4h': '240', '1d': 'D'}
-        api_interval = bybit_interval_map.get(user_interval, '60')
-        url = f"{self.base_url}/v5/market/kline"
-        params = {"category": "spot", "symbol": f"{symbol}USDT", "interval": api_interval, "limit": limit}
-        try:
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('retCode') == 0:
-                    return data.get('result', {}).get('list', [])
-                else:
-                    print(f"DEBUG: Bybit kline API error for {symbol}USDT (interval: {api_interval}): {data.get('retCode')} - {data.get('retMsg')}")
-        except Exception as e:
-            print(f"Error in get_kline_data for {symbol} (interval: {api_interval}): {e}")
-        return []
+        """
+        Latest `limit` candles (including the still-open one), newest first, as
+        [timestamp_ms, open, high, low, close, volume] rows like Bybit's kline list.
+        """
+        return [[int(c[0])] + list(c[1:]) for c in self.get_candle_array(symbol, user_interval, limit)[::-1].tolist()]
+
+    def get_candle_array(self, symbol, user_interval='1h', limit=168):
+        """
+        Latest `limit` candles (including the still-open one) as a CANDLE_DTYPE array, oldest
+        first. Coarser intervals are resampled from the RESAMPLE_BASE_INTERVAL series, so every
+        timeframe of a symbol shares one download and one store file.
+        """
+        user_interval = user_interval if user_interval in INTERVAL_MS else '1h'
+        interval_ms = INTERVAL_MS[user_interval]
+        base_ms = INTERVAL_MS[RESAMPLE_BASE_INTERVAL]
+        start_ms = candle_open_ts(int(time.time() * 1000), user_interval) - (max(limit, 1) - 1) * interval_ms
+        if (user_interval != RESAMPLE_BASE_INTERVAL and interval_ms % base_ms == 0
+                and limit * (interval_ms // base_ms) <= MAX_RESAMPLE_BASE_CANDLES):
+            candles = resample_candles(self.get_candles(symbol, RESAMPLE_BASE_INTERVAL, start_ms), user_interval)
+        else:
+            candles = self.get_candles(symbol, user_interval, start_ms)
+        return candles[-limit:]
+
+    def get_closed_candles(self, symbol, user_interval, start_ms, max_lag=PORTFOLIO_HISTORY_MAX_LAG):
+        """
+        Closed candles from start_ms on, resampled from the RESAMPLE_BASE_INTERVAL store. The
+        store is read as is when it covers the range and lags by at most `max_lag` seconds, so
+        no open-candle request is made; otherwise get_candles() fills it in first.
+        """
+        base = RESAMPLE_BASE_INTERVAL
+        coverage = self.candle_store.coverage(symbol, base)
+        if not (coverage and coverage['last_ts'] >= time.time() * 1000 - max_lag * 1000
+                and (coverage['first_ts'] <= start_ms or coverage.get('head'))):
+            self.get_candles(symbol, base, start_ms)
+        closed = np.array(self.candle_store.read(symbol, base, candle_open_ts(start_ms, base)))
+        return closed if user_interval == base else resample_candles(closed, user_interval)
 
     def create_price_chart(self, symbol, requested_interval='1h', requested_days=7):
         intervals_to_try_config = [('1h', 3), ('4h', 7), ('1d', 30)]
         unique_intervals_to_try = []
         seen_intervals = set()
 
-        if requested_interval in ['1h', '4h', '1d']:
+        if requested_interval in CHART_INTERVALS:
             unique_intervals_to_try.append((requested_interval, requested_days))
             seen_intervals.add(requested_interval)
         for user_i, default_d in intervals_to_try_config:
@@ -162,41 +2489,69 @@ class BybitCryptoBotEnhanced:
         kline_data = None
         final_interval_used = requested_interval
         final_days_used = requested_days
-        print(f"DEBUG: Chart generation for {symbol}. Initial request: interval {requested_interval}, days {requested_days}.")
+        log.debug("Chart generation for %s. Initial request: interval %s, days %s.", symbol, requested_interval, requested_days)
 
         for current_user_interval, current_days in unique_intervals_to_try:
-            print(f"DEBUG: Trying chart for {symbol} with user_interval: {current_user_interval}, days: {current_days}")
-            limit = {'1h': current_days * 24, '4h': current_days * 6, '1d': current_days}.get(current_user_interval, 200)
-            if limit == 200 and current_user_interval not in ['1h', '4h', '1d']: 
-                 print(f"Warning: Unexpected interval '{current_user_interval}' in fallback logic.")
+            log.debug("Trying chart for %s with user_interval: %s, days: %s", symbol, current_user_interval, current_days)
+            limit = max(1, -(-current_days * INTERVAL_MS['1d'] // INTERVAL_MS.get(current_user_interval, INTERVAL_MS['1h'])))
 
             kline_data = self.get_kline_data(symbol, current_user_interval, limit)
             if kline_data:
-                print(f"DEBUG: Success! Fetched kline data for {symbol} with user_interval {current_user_interval}, limit {limit}.")
+                log.debug("Success! Fetched kline data for %s with user_interval %s, limit %s.", symbol, current_user_interval, limit)
                 final_interval_used = current_user_interval
                 final_days_used = current_days
                 break
             else:
-                print(f"DEBUG: Failed for {symbol} with user_interval {current_user_interval}. Trying next.")
+                log.debug("Failed for %s with user_interval %s. Trying next.", symbol, current_user_interval)
         
         if not kline_data:
-            print(f"DEBUG: All fallbacks failed for {symbol}. No kline data. Returning None.")
+            log.debug("All fallbacks failed for %s. No kline data. Returning None.", symbol)
             return None
             
         try:
-            df_data = [{'timestamp': int(c[0]), 'open': float(c[1]), 'high': float(c[2]), 
-                        'low': float(c[3]), 'close': float(c[4]), 'volume': float(c[5])}
-                       for c in reversed(kline_data)]
-            df = pd.DataFrame(df_data)
-            df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
+            candles = decimate_candles(klines_to_candles(kline_data), CHART_MAX_CANDLES)
+            def render():
+                stage_start = time.perf_counter()
+                df = pd.DataFrame(candles).rename(columns={'ts': 'timestamp'})
+                df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
+                METRICS.lap('dataframe', stage_start, chart='price')
+                return self.render_guard.render(self.draw_price_chart, df, symbol, final_interval_used, final_days_used,
+                                                self.price_precision(symbol).decimals)
+            digest = hashlib.blake2b(candles.tobytes(), digest_size=12).hexdigest() # Same candles, same image
+            png = self.cache.get_or_compute(f"chart:{symbol}:{final_interval_used}:{final_days_used}:{digest}", CHART_CACHE_TTL, render)
+            image_base64 = base64.b64encode(png).decode()
             
-            fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8), height_ratios=[3, 1])
-            fig.patch.set_facecolor('#0a0a0a')
+            pattern_analysis_text = "Pattern analysis not available." 
+            if GEMINI_API_KEY and kline_data: 
+                try:
+                    pattern_analysis_text = self.get_chart_pattern_analysis(symbol, kline_data, final_interval_used, final_days_used)
+                except Exception as e:
+                    log.error("Error invoking pattern analysis from create_price_chart: %s", e)
+                    pattern_analysis_text = "Error during pattern analysis."
+            
+            return {
+                'image': image_base64, 
+                'interval_used': final_interval_used, 
+                'days_used': final_days_used,
+                'pattern_analysis': pattern_analysis_text
+            }
+        except RenderBusy:
+            raise
+        except Exception as e:
+            log.error("Error during chart matplotlib processing: %s", e)
+            return None
+
+    @staticmethod
+    def draw_price_chart(df, symbol, interval_used, days_used, decimals=None):
+        """Candles, close line and volume bars as PNG bytes; runs in a render worker (decimals: the symbol's tick decimals)."""
+        stage_start = time.perf_counter()
+        with chart_figure(figsize=(12, 8)) as fig:
+            ax1, ax2 = fig.subplots(2, 1, height_ratios=[3, 1])
             
             for i, row in df.iterrows():
                 color = '#00ff88' if row['close'] >= row['open'] else '#ff4757'
                 ax1.plot([row['datetime'], row['datetime']], [row['low'], row['high']], color=color, linewidth=1, alpha=0.8)
-                rect = Rectangle((mdates.date2num(row['datetime']) - 0.0003, min(row['open'], row['close'])),
+                rect = mpatches.Rectangle((mdates.date2num(row['datetime']) - 0.0003, min(row['open'], row['close'])),
                                  0.0006, abs(row['close'] - row['open']),
                                  facecolor=color, alpha=0.8, edgecolor=color)
                 ax1.add_patch(rect)
@@ -204,16 +2559,14 @@ class BybitCryptoBotEnhanced:
             
             ax1.set_facecolor('#0a0a0a')
             ax1.grid(True, alpha=0.3, color='#333333')
-            ax1.set_title(f'{symbol}/USDT Price Chart ({final_interval_used}, {final_days_used} days)', 
+            ax1.set_title(f'{symbol}/USDT Price Chart ({interval_used}, {days_used} days)', 
                           color='#ffffff', fontsize=16, fontweight='bold', pad=20)
             ax1.set_ylabel('Price (USDT)', color='#ffffff', fontsize=12)
             ax1.tick_params(axis='y', colors='#ffffff') 
             ax1.tick_params(axis='x', colors='#ffffff') 
 
-            price_range = df['high'].max() - df['low'].min()
-            if price_range < 1: ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x:.6f}'))
-            elif price_range < 100: ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x:.4f}'))
-            else: ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x:,.2f}'))
+            fmt = price_format(decimals)
+            ax1.yaxis.set_major_formatter(fmt.axis)
             
             volume_bar_colors = ['#00ff88' if df['close'].iloc[i] >= df['open'].iloc[i] else '#ff4757' for i in range(len(df))]
             ax2.bar(df['datetime'], df['volume'], color=volume_bar_colors, alpha=0.6, width=0.0008)
@@ -222,22 +2575,19 @@ class BybitCryptoBotEnhanced:
             ax2.set_ylabel('Volume', color='#ffffff', fontsize=12)
             ax2.tick_params(axis='y', colors='#ffffff') 
             ax2.tick_params(axis='x', colors='#ffffff') 
-            ax2.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{x/1000:.0f}K' if x < 1000000 else f'{x/1000000:.1f}M'))
+            ax2.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, _: format_compact(x)))
             
-            if final_interval_used == '1h' and final_days_used <= 3:
+            if interval_used in ('1h', '2h') and days_used <= 3:
                 date_format = '%m/%d %H:%M'
-                locator_interval = max(1, final_days_used * 24 // 6) 
+                locator_interval = max(1, days_used * 24 // 6) 
                 major_locator = mdates.HourLocator(interval=max(1, 24 // (24//locator_interval if locator_interval > 0 else 1)))
-            elif final_interval_used == '1h':
-                date_format = '%m/%d'
-                major_locator = mdates.DayLocator(interval=max(1, final_days_used // 7))
-            elif final_interval_used == '4h':
+            elif interval_used in ('1h', '2h', '4h', '12h'):
                 date_format = '%m/%d'
-                major_locator = mdates.DayLocator(interval=max(1, final_days_used // 7))
-            elif final_interval_used == '1d':
+                major_locator = mdates.DayLocator(interval=max(1, days_used // 7))
+            elif interval_used in ('1d', '1w'):
                 date_format = '%Y-%m-%d'
-                if final_days_used <= 14: major_locator = mdates.DayLocator(interval=1)
-                elif final_days_used <= 90: major_locator = mdates.WeekdayLocator(interval=1)
+                if days_used <= 14: major_locator = mdates.DayLocator(interval=1)
+                elif days_used <= 90: major_locator = mdates.WeekdayLocator(interval=1)
                 else: major_locator = mdates.MonthLocator(interval=1)
             else:
                 date_format = '%m/%d'
@@ -246,39 +2596,76 @@ class BybitCryptoBotEnhanced:
             for ax in [ax1, ax2]:
                 ax.xaxis.set_major_formatter(mdates.DateFormatter(date_format))
                 ax.xaxis.set_major_locator(major_locator)
-                plt.setp(ax.xaxis.get_majorticklabels(), rotation=45, ha="right")
+                for label in ax.xaxis.get_majorticklabels(): label.set(rotation=45, ha="right")
 
             current_price = df['close'].iloc[-1]
             price_change_pct = (current_price - df['close'].iloc[0]) / df['close'].iloc[0] * 100 if df['close'].iloc[0] != 0 else 0
-            stats_text = f'Current: ${current_price:.6f} | Change: {price_change_pct:+.2f}% | High: ${df["high"].max():.6f} | Low: ${df["low"].min():.6f}'
+            stats_text = f'Current: {fmt(current_price)} | Change: {price_change_pct:+.2f}% | High: {fmt(df["high"].max())} | Low: {fmt(df["low"].min())}'
             fig.suptitle(stats_text, color='#ffffff', fontsize=10, y=0.025) 
             
-            plt.tight_layout(rect=[0, 0.03, 1, 0.95]) 
-            plt.subplots_adjust(top=0.93, bottom=0.15) 
-
-            buffer = io.BytesIO()
-            plt.savefig(buffer, format='png', facecolor='#0a0a0a', dpi=150, bbox_inches='tight')
-            buffer.seek(0)
-            image_base64 = base64.b64encode(buffer.getvalue()).decode()
-            plt.close(fig)
-            
-            pattern_analysis_text = "Pattern analysis not available." 
-            if GEMINI_API_KEY and kline_data: 
+            fig.tight_layout(rect=[0, 0.03, 1, 0.95]) 
+            fig.subplots_adjust(top=0.93, bottom=0.15) 
+            stage_start = METRICS.lap('render', stage_start, chart='price')
+
+            png = figure_png(fig, dpi=150)
+        METRICS.lap('savefig', stage_start, chart='price')
+        return png
+
+    def generate_gemini_text(self, call, prompt, timeout=60):
+        """
+        Gemini's answer to `prompt` as (text, block_reason). Answers are cached by prompt hash
+        for GEMINI_CACHE_TTL, so identical requests (from any worker, with a shared cache) make
+        one call. Blocked or empty answers are not cached.
+        """
+        block_reason = []
+        def generate():
+            text, reason = self.call_gemini(call, prompt, timeout)
+            if not text: block_reason.append(reason)
+            return text or None
+        text = self.cache.get_or_compute(f"gemini:{call}:{hashlib.sha256(prompt.encode()).hexdigest()}", GEMINI_CACHE_TTL, generate)
+        return text or '', (block_reason[0] if block_reason else None)
+
+    def generate_gemini_json(self, call, prompt, schema, parse, timeout=60):
+        """
+        Gemini's answer to `prompt` in JSON mode (constrained to `schema`), run through
+        parse(text), which raises ValueError for unusable answers. A rejected answer gets up to
+        GEMINI_REPAIR_ATTEMPTS follow-ups that show Gemini its answer and the error. Returns
+        (result, block_reason); result is None if nothing valid came back. Only valid results
+        are cached (by prompt hash, like generate_gemini_text).
+        """
+        block_reason = []
+        config = {'response_mime_type': 'application/json', 'response_schema': schema}
+        def generate():
+            attempt_prompt = prompt
+            for attempt in range(GEMINI_REPAIR_ATTEMPTS + 1):
+                text, reason = self.call_gemini(call, attempt_prompt, timeout, config)
+                if not text:
+                    block_reason.append(reason)
+                    METRICS.inc('bot_gemini_structured_total', call=call, result='empty')
+                    return None
                 try:
-                    pattern_analysis_text = self.get_chart_pattern_analysis(symbol, kline_data, final_interval_used, final_days_used)
-                except Exception as e:
-                    print(f"Error invoking pattern analysis from create_price_chart: {e}")
-                    pattern_analysis_text = "Error during pattern analysis."
-            
-            return {
-                'image': image_base64, 
-                'interval_used': final_interval_used, 
-                'days_used': final_days_used,
-                'pattern_analysis': pattern_analysis_text
-            }
-        except Exception as e:
-            print(f"Error during chart matplotlib processing: {e}")
+                    result = parse(text)
+                except ValueError as e:
+                    METRICS.inc('bot_gemini_wasted_calls_total', call=call)
+                    log.info("Gemini %s answer rejected (attempt %d): %s", call, attempt + 1, e)
+                    attempt_prompt = (f"{prompt}\n\nYour previous answer was:\n{text[:4000]}\n\nIt was rejected because {e}. "
+                                      "Reply again with only the corrected JSON object.")
+                    continue
+                METRICS.inc('bot_gemini_structured_total', call=call, result='repaired' if attempt else 'valid')
+                return result
+            METRICS.inc('bot_gemini_structured_total', call=call, result='invalid')
             return None
+        result = self.cache.get_or_compute(f"gemini:{call}:{hashlib.sha256(prompt.encode()).hexdigest()}", GEMINI_CACHE_TTL, generate)
+        return result, (block_reason[0] if block_reason else None)
+
+    def call_gemini(self, call, prompt, timeout, generation_config=None):
+        """One uncached Gemini request. Returns (text, block_reason)."""
+        model = genai.GenerativeModel('gemini-2.0-flash')
+        with METRICS.span('gemini', call=call):
+            response = model.generate_content(prompt, generation_config=generation_config, request_options={'timeout': timeout})
+        text = response.text.strip() if response.text else ''
+        if text: return text, None
+        return '', (response.prompt_feedback.block_reason if getattr(response, 'prompt_feedback', None) else None)
 
     def get_chart_pattern_analysis(self, symbol, kline_data_list, interval_used, days_used):
         """Get chart pattern analysis for /chart command caption using Gemini API."""
@@ -288,7 +2675,7 @@ class BybitCryptoBotEnhanced:
         if not kline_data_list:
             return "No kline data provided for pattern analysis."
 
-        print(f"DEBUG: Getting chart pattern analysis for {symbol} using {len(kline_data_list)} kline entries. Interval: {interval_used}, Days: {days_used}")
+        log.debug("Getting chart pattern analysis for %s using %s kline entries. Interval: %s, Days: %s", symbol, len(kline_data_list), interval_used, days_used)
 
         num_points_to_analyze = 100 
         recent_data_newest_first = kline_data_list[:num_points_to_analyze]
@@ -329,17 +2716,12 @@ Avoid giving financial advice or specific price predictions beyond typical patte
 When referencing specific timestamps in your analysis, please format them as YYYY-MM-DD HH:MM:SS UTC.
 """
         try:
-            model = genai.GenerativeModel('gemini-2.0-flash') 
-            response = model.generate_content(prompt, request_options={'timeout': 45}) # Added timeout
-            
-            if response.text:
-                return response.text.strip()
-            else:
-                if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-                    return f"Gemini analysis blocked: {response.prompt_feedback.block_reason}"
-                return "Gemini returned no specific pattern analysis."
+            text, block_reason = self.generate_gemini_text('chart_pattern', prompt, timeout=45)
+            if text: return text
+            if block_reason: return f"Gemini analysis blocked: {block_reason}"
+            return "Gemini returned no specific pattern analysis."
         except Exception as e:
-            print(f"Error calling Gemini API for pattern analysis: {e}")
+            log.error("Error calling Gemini API for pattern analysis: %s", e)
             return f"❌ Error during pattern analysis for {symbol}. Details: {str(e)}"
 
     def get_gemini_analysis(self, coin_symbol, user_query="Provide a general analysis."):
@@ -347,7 +2729,7 @@ When referencing specific timestamps in your analysis, please format them as YYY
         if not GEMINI_API_KEY:
             return "⚠️ Gemini API not configured. This feature is unavailable."
 
-        print(f"DEBUG: Getting OLD Gemini general coin overview for {coin_symbol}, query: {user_query}")
+        log.debug("Getting OLD Gemini general coin overview for %s, query: %s", coin_symbol, user_query)
         
         price_data = self.get_coin_price(coin_symbol)
         context_data_str = "No current market data available."
@@ -377,11 +2759,10 @@ Based on the above, provide:
 Keep the response concise and informative, suitable for a Telegram bot.
 """
         try:
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            response = model.generate_content(prompt_text, request_options={'timeout': 60}) # Added timeout
-            return response.text.strip() if response.text else "Gemini returned no general analysis."
+            text, _ = self.generate_gemini_text('overview', prompt_text)
+            return text or "Gemini returned no general analysis."
         except Exception as e:
-            print(f"Error calling Gemini API for general coin overview: {e}")
+            log.error("Error calling Gemini API for general coin overview: %s", e)
             return f"❌ Error getting general coin overview from Gemini for {coin_symbol}. Details: {str(e)}"
 
     def get_dedicated_chart_pattern_analysis_for_analyze_command(self, symbol, interval='4h', days=7):
@@ -391,7 +2772,7 @@ Keep the response concise and informative, suitable for a Telegram bot.
 
         kline_fetch_limit = 50 
         
-        print(f"DEBUG: /analyze command fetching kline for {symbol}, interval {interval}, days {days} (context), kline_fetch_limit {kline_fetch_limit}")
+        log.debug("/analyze command fetching kline for %s, interval %s, days %s (context), kline_fetch_limit %s", symbol, interval, days, kline_fetch_limit)
         kline_data_newest_first = self.get_kline_data(symbol, interval, limit=kline_fetch_limit) 
         
         if not kline_data_newest_first or len(kline_data_newest_first) < 5:
@@ -421,26 +2802,21 @@ IMPORTANT: Start your response with a brief disclaimer: "Disclaimer: This is an
 Then proceed with the analysis.
 """
         
-        print(f"DEBUG: /analyze prompt for {symbol} ({interval}, {days}d, {num_analyzed_candles} candles): {prompt_text[:400]}...")
+        if log.isEnabledFor(logging.DEBUG): log.debug("/analyze prompt for %s (%s, %sd, %s candles): %s...", symbol, interval, days, num_analyzed_candles, prompt_text[:400])
 
         try:
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            response = model.generate_content(prompt_text, request_options={'timeout': 60}) # Added timeout
-            
-            if response.text:
-                return response.text.strip()
-            else:
-                if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-                    return f"Gemini analysis for /analyze command blocked: {response.prompt_feedback.block_reason}"
-                return "Gemini returned no specific pattern analysis for the /analyze command."
+            text, block_reason = self.generate_gemini_text('analyze', prompt_text)
+            if text: return text
+            if block_reason: return f"Gemini analysis for /analyze command blocked: {block_reason}"
+            return "Gemini returned no specific pattern analysis for the /analyze command."
         except Exception as e:
-            print(f"Error calling Gemini API for /analyze command: {e}")
+            log.error("Error calling Gemini API for /analyze command: %s", e)
             return f"❌ Error during pattern analysis for /analyze {symbol}. Details: {str(e)}"
 
     def get_gemini_forecast_analysis(self, symbol, kline_data_list, interval_used, days_of_historical_data, forecast_horizon_str):
         """
         Get price forecast, textual analysis, and a structured predicted path from Gemini API.
-        Returns a tuple: (textual_analysis, predicted_path_string)
+        Returns a tuple: (textual_analysis, predicted_path), the path as [[timestamp_ms, price], ...]
         """
         if not GEMINI_API_KEY:
             return "⚠️ Gemini forecast analysis disabled (API key missing).", None
@@ -448,7 +2824,7 @@ Then proceed with the analysis.
         if not kline_data_list:
             return "No kline data provided for forecast analysis.", None
 
-        print(f"DEBUG: Getting Gemini forecast for {symbol} using {len(kline_data_list)} kline entries. Historical: {interval_used} intervals, {days_of_historical_data} days. Forecast: {forecast_horizon_str}")
+        log.debug("Getting Gemini forecast for %s using %s kline entries. Historical: %s intervals, %s days. Forecast: %s", symbol, len(kline_data_list), interval_used, days_of_historical_data, forecast_horizon_str)
         
         date_context_info = ""
         latest_year_for_prompt = "the current year" 
@@ -460,7 +2836,7 @@ Then proceed with the analysis.
                 latest_year_for_prompt = str(latest_datetime_utc.year)
                 date_context_info = f"Context: The most recent historical data point provided is from {current_date_for_gemini_prompt} UTC. Please ensure all dates in your textual analysis are consistent with this year ({latest_year_for_prompt})."
             except Exception as e:
-                print(f"Error creating date context for Gemini: {e}")
+                log.error("Error creating date context for Gemini: %s", e)
                 date_context_info = "Context: Please be mindful of the current year when referencing dates."
         else: 
             date_context_info = "Context: Please be mindful of the current year when referencing dates."
@@ -469,17 +2845,12 @@ Then proceed with the analysis.
         recent_data_newest_first = kline_data_list[:num_points_to_analyze]
         data_to_analyze_chronological = list(reversed(recent_data_newest_first))
 
-        formatted_kline_data = "Timestamp (ms), Open, High, Low, Close, Volume\n"
-        for k_entry in data_to_analyze_chronological:
-            formatted_kline_data += f"{k_entry[0]}, {k_entry[1]}, {k_entry[2]}, {k_entry[3]}, {k_entry[4]}, {k_entry[5]}\n"
-        
-        if len(formatted_kline_data) > 3000:
-            formatted_kline_data = formatted_kline_data[:3000] + "\n... (data truncated to fit prompt)"
+        rows = [f"{k[0]}, {k[1]}, {k[2]}, {k[3]}, {k[4]}, {k[5]}\n" for k in data_to_analyze_chronological]
+        while len(rows) > 1 and sum(map(len, rows)) > 3000: rows.pop(0) # Trim the oldest: the path starts after the newest
+        formatted_kline_data = "Timestamp (ms), Open, High, Low, Close, Volume\n" + "".join(rows)
         
-        num_prediction_points = 5 
-        if forecast_horizon_str == "next 24 hours": num_prediction_points = 6 
-        elif forecast_horizon_str == "next 3 days": num_prediction_points = 3 
-        elif forecast_horizon_str == "next 7 days": num_prediction_points = 7
+        num_prediction_points, horizon_days = FORECAST_HORIZONS.get(forecast_horizon_str, (5, 1))
+        last_ts, last_close = int(kline_data_list[0][0]), float(kline_data_list[0][4])
 
         prompt = f"""You are a cryptocurrency technical analyst.
 {date_context_info}
@@ -489,135 +2860,62 @@ The data represents {interval_used} intervals over approximately the last {days_
 Candlestick Data (Timestamp ms, Open, High, Low, Close, Volume) - Oldest to Newest from recent set:
 {formatted_kline_data}
 
-Task:
-1.  Provide a textual technical analysis and price forecast for {symbol}/USDT for the {forecast_horizon_str}. Include:
-    *   Overall expected price trend (e.g., bullish, bearish, sideways, volatile).
-    *   Potential key support and resistance levels to watch.
-    *   Significant chart patterns or technical indicators in the historical data supporting your forecast.
-    *   A brief outlook.
-    *   Start this textual analysis with: "🔮 AI Price Forecast for {symbol} ({forecast_horizon_str}):"
-    *   Important: Your entire textual analysis, starting with '🔮 AI Price Forecast...' and ending precisely with 'TEXTUAL_ANALYSIS_END_MARKER', must be a single, continuous block of text. Do not generate any other analytical text or headers outside of this specifically marked block before you provide the PROJECTED_PATH_START block.
-    *   Conclude your textual analysis with the exact marker: TEXTUAL_ANALYSIS_END_MARKER
-
-2.  Provide a projected price path for the {forecast_horizon_str}.
-    *   This path should consist of approximately {num_prediction_points} data points.
-    *   Format this path strictly as follows, enclosed in markers:
-        PROJECTED_PATH_START
-        [timestamp_in_milliseconds, projected_price]
-        [timestamp_in_milliseconds, projected_price]
-        ... (repeat for {num_prediction_points} points)
-        PROJECTED_PATH_END
-    *   The timestamps should be in milliseconds UTC and cover the {forecast_horizon_str}, starting after the last historical data point.
-    *   The projected_price should be a numerical value.
-
-Example of PROJECTED_PATH block for a 24-hour forecast with 3 points:
-PROJECTED_PATH_START
-[1678886400000, 23000.50]
-[1678893600000, 23150.00]
-[1678900800000, 23100.75]
-PROJECTED_PATH_END
-
-Ensure the textual analysis is separate from the PROJECTED_PATH block and ends with TEXTUAL_ANALYSIS_END_MARKER.
+Forecast {symbol}/USDT for the {forecast_horizon_str} and answer with one JSON object:
+-   "trend": the expected overall trend, one of {", ".join(f'"{t}"' for t in FORECAST_TRENDS)}.
+-   "support" and "resistance": up to 3 key price levels each to watch.
+-   "analysis": a concise technical analysis without a heading: the significant chart patterns or technical indicators in the historical data supporting your forecast, and a brief outlook.
+-   "path": the projected price path, about {num_prediction_points} points of {{"timestamp": milliseconds UTC, "price": number}}, evenly covering the {forecast_horizon_str} after the last historical candle ({last_ts}).
+
 Avoid giving specific financial advice. Focus on technicals.
 When referencing specific timestamps in your analysis, please format them as YYYY-MM-DD HH:MM:SS UTC, being mindful of the current year ({latest_year_for_prompt}) based on the data provided.
 """
         try:
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            response = model.generate_content(prompt, request_options={'timeout': 60}) # Added timeout
-            
-            full_response_text = ""
-            if response.text:
-                full_response_text = response.text.strip()
-            else:
-                if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-                    return f"Gemini forecast analysis blocked: {response.prompt_feedback.block_reason}", None
-                return "Gemini returned no response.", None
-
-            predicted_path_str = None
-            textual_analysis_part = ""
-            
-            path_match = re.search(r"PROJECTED_PATH_START\s*([\s\S]*?)\s*PROJECTED_PATH_END", full_response_text)
-            if path_match:
-                predicted_path_str = path_match.group(0)
-
-            text_end_marker = "TEXTUAL_ANALYSIS_END_MARKER"
-            marker_pos = full_response_text.find(text_end_marker)
-
-            if marker_pos != -1:
-                textual_analysis_part = full_response_text[:marker_pos].strip()
-            else: 
-                if predicted_path_str:
-                    textual_analysis_part = full_response_text.replace(predicted_path_str, "").strip()
-                else:
-                    textual_analysis_part = full_response_text
-            
-            expected_intro_template = f"🔮 AI Price Forecast for {symbol} ({forecast_horizon_str}):"
-            # Remove any existing intro before potentially adding the correct one with request_id (done in handler)
-            if textual_analysis_part.startswith(expected_intro_template):
-                 textual_analysis_part = textual_analysis_part[len(expected_intro_template):].strip()
-            # Fallback if textual_analysis_part is empty or only whitespace after processing
-            if not textual_analysis_part.strip():
-                if predicted_path_str:
-                    textual_analysis_part = "_AI provided a projected path but minimal textual analysis._"
-                else:
-                    textual_analysis_part = "_AI could not provide a detailed forecast or path at this time._"
-            
-            return textual_analysis_part, predicted_path_str
+            forecast, block_reason = self.generate_gemini_json(
+                'forecast', prompt, FORECAST_SCHEMA, lambda text: parse_forecast(text, last_ts, last_close, horizon_days * INTERVAL_MS['1d']))
+            if not forecast:
+                if block_reason: return f"Gemini forecast analysis blocked: {block_reason}", None
+                return "Gemini returned no specific forecast analysis or path.", None
+            fmt = self.price_precision(symbol)
+            lines = [f"**Trend:** {forecast['trend'].title()}"]
+            for name in ('support', 'resistance'):
+                if forecast[name]: lines.append(f"**{name.title()}:** {', '.join(fmt(level) for level in forecast[name])}")
+            return "\n".join(lines) + "\n\n" + forecast['analysis'], forecast['path']
 
         except Exception as e:
-            print(f"Error calling Gemini API for forecast analysis: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error("Error calling Gemini API for forecast analysis: %s", e)
             return f"❌ Error during forecast analysis for {symbol}. Details: {str(e)}", None
 
-    def create_prediction_chart(self, symbol, historical_kline_data, predicted_data_str, hist_interval, hist_days, forecast_horizon_str):
+    def create_prediction_chart(self, symbol, historical_kline_data, predicted_path, hist_interval, hist_days, forecast_horizon_str):
         if not historical_kline_data:
-            print(f"DEBUG: No historical kline data for {symbol} in create_prediction_chart.")
-            return None
+            log.debug("No historical kline data for %s in create_prediction_chart.", symbol)
+            return None, False
         try:
+            stage_start = time.perf_counter()
             df_hist_data = [{'timestamp': int(c[0]), 'open': float(c[1]), 'high': float(c[2]), 
                              'low': float(c[3]), 'close': float(c[4]), 'volume': float(c[5])}
                             for c in reversed(historical_kline_data)]
             df_hist = pd.DataFrame(df_hist_data)
             df_hist['datetime'] = pd.to_datetime(df_hist['timestamp'], unit='ms')
-            if df_hist.empty: return None
-
-            df_pred = pd.DataFrame()
-            if predicted_data_str:
-                match = re.search(r"PROJECTED_PATH_START\s*([\s\S]*?)\s*PROJECTED_PATH_END", predicted_data_str)
-                if match:
-                    path_block = match.group(1)
-                    raw_prices = re.findall(r"\[\s*\d+\s*,\s*([\d\.]+)\s*\]", path_block)
-                    parsed_prices = [float(p) for p in raw_prices]
-
-                    if parsed_prices:
-                        num_expected_points = 0
-                        time_delta_per_point = pd.Timedelta(days=1) 
-
-                        if forecast_horizon_str == "next 7 days":
-                            num_expected_points = 7
-                            time_delta_per_point = pd.Timedelta(days=1)
-                        elif forecast_horizon_str == "next 3 days":
-                            num_expected_points = 3
-                            time_delta_per_point = pd.Timedelta(days=1)
-                        elif forecast_horizon_str == "next 24 hours" or forecast_horizon_str == "next 1 day": 
-                            num_expected_points = 6 
-                            time_delta_per_point = pd.Timedelta(hours=4)
-                        
-                        prices_to_plot = parsed_prices[:num_expected_points]
-                        
-                        if prices_to_plot:
-                            last_hist_dt = df_hist['datetime'].iloc[-1]
-                            future_timestamps = [last_hist_dt + time_delta_per_point * (i+1) for i in range(len(prices_to_plot))]
-                            
-                            df_pred = pd.DataFrame({
-                                'datetime': future_timestamps,
-                                'price': prices_to_plot
-                            })
-                            print(f"DEBUG: Created df_pred with {len(df_pred)} corrected future points for {symbol}.")
+            if df_hist.empty: return None, False
+
+            df_pred = pd.DataFrame(predicted_path or [], columns=['timestamp', 'price'])
+            df_pred['datetime'] = pd.to_datetime(df_pred['timestamp'], unit='ms')
+            stage_start = METRICS.lap('dataframe', stage_start, chart='prediction')
             
-            fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8), height_ratios=[3, 1])
-            fig.patch.set_facecolor('#0a0a0a')
+            png, path_plotted = self.render_guard.render(self.draw_prediction_chart, df_hist, df_pred, symbol, hist_interval, hist_days,
+                                                         forecast_horizon_str, self.price_precision(symbol).decimals)
+            return base64.b64encode(png).decode(), path_plotted
+        except RenderBusy:
+            raise
+        except Exception as e:
+            log.exception("Error in create_prediction_chart for %s: %s", symbol, e); return None, False
+
+    @staticmethod
+    def draw_prediction_chart(df_hist, df_pred, symbol, hist_interval, hist_days, forecast_horizon_str, decimals=None):
+        """History plus the projected path as PNG bytes; runs in a render worker. Returns (png, path_plotted)."""
+        stage_start = time.perf_counter()
+        with chart_figure(figsize=(12, 8)) as fig:
+            ax1, ax2 = fig.subplots(2, 1, height_ratios=[3, 1])
 
             w_factor = {'1h': 1, '4h': 4, '1d': 24}.get(hist_interval, 1)
             candle_w = 0.0003 * w_factor
@@ -626,7 +2924,7 @@ When referencing specific timestamps in your analysis, please format them as YYY
             for _, row in df_hist.iterrows():
                 color = '#00ff88' if row['close'] >= row['open'] else '#ff4757'
                 ax1.plot([row['datetime'], row['datetime']], [row['low'], row['high']], color=color, lw=1, alpha=0.8)
-                ax1.add_patch(Rectangle((mdates.date2num(row['datetime']) - candle_w, min(row['open'], row['close'])), candle_w * 2, abs(row['close'] - row['open']), fc=color, alpha=0.8, ec=color))
+                ax1.add_patch(mpatches.Rectangle((mdates.date2num(row['datetime']) - candle_w, min(row['open'], row['close'])), candle_w * 2, abs(row['close'] - row['open']), fc=color, alpha=0.8, ec=color))
             ax1.plot(df_hist['datetime'], df_hist['close'], color='#ffa502', lw=1.5, alpha=0.7, label='Historical Close')
 
             if not df_pred.empty and not df_hist.empty:
@@ -640,20 +2938,14 @@ When referencing specific timestamps in your analysis, please format them as YYY
             ax1.set_ylabel('Price (USDT)', color='#ffffff', fontsize=12)
             ax1.tick_params(axis='both', colors='#ffffff'); ax1.legend(facecolor='#1c1c1c', edgecolor='#333333', labelcolor='#ffffff', fontsize='small')
 
-            all_prices = pd.concat([df_hist['high'], df_hist['low'], df_pred['price'] if not df_pred.empty else pd.Series(dtype=float)])
-            p_min, p_max = all_prices.min(), all_prices.max()
-            p_range = (p_max - p_min) if pd.notna(p_min) and pd.notna(p_max) else (p_min * 0.1 if pd.notna(p_min) else 0.1)
-            if p_range == 0 : p_range = p_min * 0.1 if pd.notna(p_min) and p_min > 0 else 0.1
-
-            if p_range < 1 and p_range !=0: ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: f'${x:.6f}'))
-            elif p_range < 100 and p_range !=0: ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: f'${x:.4f}'))
-            else: ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: f'${x:,.2f}'))
+            fmt = price_format(decimals)
+            ax1.yaxis.set_major_formatter(fmt.axis)
 
             ax2.bar(df_hist['datetime'], df_hist['volume'], color=['#00ff88' if c >= o else '#ff4757' for o, c in zip(df_hist['open'], df_hist['close'])], alpha=0.6, width=vol_w)
             ax2.set_facecolor('#0a0a0a'); ax2.grid(True, alpha=0.3, color='#333333')
             ax2.set_ylabel('Volume', color='#ffffff', fontsize=12)
             ax2.tick_params(axis='both', colors='#ffffff')
-            ax2.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: f'{x/1e3:.0f}K' if x < 1e6 else f'{x/1e6:.1f}M'))
+            ax2.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, _: format_compact(x)))
 
             all_dt = pd.concat([df_hist['datetime'], df_pred['datetime'] if not df_pred.empty else pd.Series(dtype='datetime64[ns]')]).dropna()
             min_dt, max_dt = all_dt.min(), all_dt.max()
@@ -665,21 +2957,20 @@ When referencing specific timestamps in your analysis, please format them as YYY
             for ax in [ax1, ax2]:
                 ax.xaxis.set_major_formatter(mdates.DateFormatter(fmt_str))
                 ax.xaxis.set_major_locator(mdates.AutoDateLocator(minticks=5, maxticks=10))
-                plt.setp(ax.xaxis.get_majorticklabels(), rotation=45, ha="right")
+                for label in ax.xaxis.get_majorticklabels(): label.set(rotation=45, ha="right")
                 if pd.notna(min_dt) and pd.notna(max_dt):
                     pad = pd.Timedelta(hours=1*w_factor)
                     ax.set_xlim([min_dt - pad, max_dt + pad])
             
             last_h_close = df_hist['close'].iloc[-1]
             h_change = (last_h_close - df_hist['close'].iloc[0]) / df_hist['close'].iloc[0] * 100 if len(df_hist['close']) > 1 and df_hist['close'].iloc[0] != 0 else 0
-            fig.suptitle(f'Last Hist: ${last_h_close:.6f} | Hist Change: {h_change:+.2f}% ({hist_days}d)', color='#ffffff', fontsize=10, y=0.025)
+            fig.suptitle(f'Last Hist: {fmt(last_h_close)} | Hist Change: {h_change:+.2f}% ({hist_days}d)', color='#ffffff', fontsize=10, y=0.025)
             
-            plt.tight_layout(rect=[0, 0.03, 1, 0.95]); plt.subplots_adjust(top=0.93, bottom=0.15)
-            buf = io.BytesIO(); plt.savefig(buf, format='png', facecolor='#0a0a0a', dpi=150, bbox_inches='tight'); plt.close(fig)
-            prediction_plotted_successfully = True if 'df_pred_plot' in locals() and not df_pred_plot.empty else False
-            return base64.b64encode(buf.getvalue()).decode(), prediction_plotted_successfully
-        except Exception as e:
-            print(f"Error in create_prediction_chart for {symbol}: {e}"); import traceback; traceback.print_exc(); return None, False
+            fig.tight_layout(rect=[0, 0.03, 1, 0.95]); fig.subplots_adjust(top=0.93, bottom=0.15)
+            stage_start = METRICS.lap('render', stage_start, chart='prediction')
+            png = figure_png(fig, dpi=150)
+        METRICS.lap('savefig', stage_start, chart='prediction')
+        return png, not df_pred.empty
 
     def handle_predict_command(self, chat_id, text):
         request_id = str(uuid.uuid4())[:8] 
@@ -695,35 +2986,28 @@ When referencing specific timestamps in your analysis, please format them as YYY
             return
 
         symbol = self.normalize_symbol(parts[1])
-        forecast_period_arg = parts[2].lower() if len(parts) > 2 else "1d"
-        valid_periods = {"24h": "next 24 hours", "1d": "next 1 day", "3d": "next 3 days", "7d": "next 7 days"}
-        if forecast_period_arg not in valid_periods:
-            self.send_message(chat_id, f"[{request_id}] ❌ Invalid period. Use: {', '.join(valid_periods.keys())}"); return
-        
-        forecast_horizon_str = valid_periods[forecast_period_arg]
-        hist_config = {
-            "24h": {'interval': '1h', 'days': 7}, "1d": {'interval': '1h', 'days': 7},
-            "3d": {'interval': '4h', 'days': 21}, "7d": {'interval': '1d', 'days': 60}
-        }
-        hist_interval = hist_config[forecast_period_arg]['interval']
-        hist_days = hist_config[forecast_period_arg]['days']
-        hist_limit = min({'1h': hist_days*24, '4h': hist_days*6, '1d': hist_days}.get(hist_interval,150), 200)
-
-        loading_msg_response = self.send_message(chat_id, f"🔮 [{request_id}] Generating AI forecast for {symbol} ({forecast_horizon_str})...\nFetching historical data...")
-        message_id_to_edit = loading_msg_response['result']['message_id'] if loading_msg_response and loading_msg_response.get('ok') else None
-
+        period = parts[2].lower() if len(parts) > 2 else "1d"
+        if period not in FORECAST_PERIODS:
+            self.send_message(chat_id, f"[{request_id}] ❌ Invalid period. Use: {', '.join(FORECAST_PERIODS)}"); return
+        key = ('predict', symbol, period)
+        self.respond_admitted(chat_id, key, lambda: self.build_forecast_reply(symbol, period),
+                              action='upload_photo', precomputed=lambda: self.precomputed(key), request_id=request_id)
+
+    def build_forecast_reply(self, symbol, period):
+        """
+        Fetches history, asks Gemini for a forecast and renders it. Returns a reply dict for
+        respond(), flagged 'partial' when the forecast could not be produced or plotted. The
+        reply is shared by every caller, so it carries REQUEST_ID_SLOT rather than an id.
+        """
+        forecast_horizon_str, hist_interval, hist_days = FORECAST_PERIODS[period]
+        hist_limit = min({'1h': hist_days * 24, '4h': hist_days * 6, '1d': hist_days}[hist_interval], 200)
         historical_kline = self.get_kline_data(symbol, hist_interval, hist_limit)
         if not historical_kline or len(historical_kline) < 10:
-            err_msg = f"[{request_id}] ❌ Insufficient historical data for {symbol} ({len(historical_kline or [])} candles)."
-            if message_id_to_edit: self.edit_message(chat_id, message_id_to_edit, err_msg)
-            else: self.send_message(chat_id, err_msg)
-            return
+            return {'text': f"{REQUEST_ID_SLOT} ❌ Insufficient historical data for {symbol} ({len(historical_kline or [])} candles)."}
 
-        if message_id_to_edit: self.edit_message(chat_id, message_id_to_edit, f"🔮 [{request_id}] Analyzing data for {symbol} with Gemini AI...")
-        
-        textual_analysis, predicted_path_str = self.get_gemini_forecast_analysis(symbol, historical_kline, hist_interval, hist_days, forecast_horizon_str)
+        textual_analysis, predicted_path = self.get_gemini_forecast_analysis(symbol, historical_kline, hist_interval, hist_days, forecast_horizon_str)
 
-        default_intro = f"🔮 [{request_id}] AI Price Forecast for {symbol} ({forecast_horizon_str}):"
+        default_intro = f"🔮 {REQUEST_ID_SLOT} AI Price Forecast for {symbol} ({forecast_horizon_str}):"
         
         known_status_messages = [
             "⚠️ Gemini forecast analysis disabled (API key missing).",
@@ -741,20 +3025,20 @@ When referencing specific timestamps in your analysis, please format them as YYY
             else: # If textual_analysis became empty (e.g. only path was provided or error in parsing)
                 textual_analysis = default_intro + "\n_(No detailed textual analysis provided by AI.)_"
         else:
-            if not textual_analysis.startswith(f"[{request_id}]"):
-                 textual_analysis = f"[{request_id}] {textual_analysis}"
+            if not textual_analysis.startswith(REQUEST_ID_SLOT):
+                 textual_analysis = f"{REQUEST_ID_SLOT} {textual_analysis}"
 
 
-        img_b64, prediction_plotted = self.create_prediction_chart(symbol, historical_kline, predicted_path_str, hist_interval, hist_days, forecast_horizon_str)
+        img_b64, prediction_plotted = self.create_prediction_chart(symbol, historical_kline, predicted_path, hist_interval, hist_days, forecast_horizon_str)
         
         base_caption = textual_analysis
         status_note = ""
         ellipsis = "\n_(...text truncated)_"
         note_max_len = 1024 
 
-        if img_b64 and predicted_path_str and not prediction_plotted:
+        if img_b64 and predicted_path and not prediction_plotted:
              status_note = "\n\n_(Note: AI provided path data, but it could not be visualized. Showing historical data.)_"
-        elif img_b64 and not predicted_path_str:
+        elif img_b64 and not predicted_path:
              status_note = "\n\n_(Note: AI did not provide path data for plotting. Showing historical data.)_"
         elif not img_b64:
              status_note = "\n\n⚠️ Chart generation failed."
@@ -773,49 +3057,220 @@ When referencing specific timestamps in your analysis, please format them as YYY
         else:
             caption = base_caption + status_note
         
-        if img_b64:
-            self.send_photo(chat_id, img_b64, caption)
-            if message_id_to_edit:
+        partial = is_status_message or not prediction_plotted
+        return {'photo': img_b64, 'caption': caption, 'partial': partial} if img_b64 else {'text': caption, 'partial': True}
+
+    def precompute_key(self, key):
+        """
+        Cache key of command `key`'s pre-built result for the current candle, and its TTL. The
+        image freezes the open candle and the AI insights read candles as they were, so it is
+        served for PRECOMPUTE_MAX_AGE, not until the next close: it absorbs the burst of requests
+        right after a close, then on-demand builds (from the already fetched candles) take over.
+        """
+        interval = key[2] if key[0] == 'chart' else FORECAST_PERIODS[key[2]][1]
+        open_ts = candle_open_ts(int(time.time() * 1000), interval)
+        return f"precomputed:{':'.join(map(str, key))}:{open_ts}", min(INTERVAL_MS[interval] / 1000, PRECOMPUTE_MAX_AGE)
+
+    def precomputed(self, key):
+        """The result pre-built for command `key` at the last candle close, or None."""
+        if not PRECOMPUTE_ENABLED: return None
+        if key[0] == 'chart' and (key[2] not in PRECOMPUTE_INTERVALS or key[3] != CHART_DEFAULT_DAYS[key[2]]): return None
+        if key[0] == 'predict' and key[2] not in PRECOMPUTE_INTERVALS.values(): return None
+        value = self.cache.get(self.precompute_key(key)[0])
+        METRICS.cache('precomputed', value is not None)
+        return value
+
+    def run_precompute_loop(self):
+        """
+        On each PRECOMPUTE_INTERVALS candle close, pre-builds the popular coins' default chart
+        (and with PRECOMPUTE_AI, forecast) for every interval that closed. The jobs are spaced
+        over PRECOMPUTE_SPREAD of the shortest one so Bybit and Gemini see a trickle, not a burst.
+        """
+        while True:
+            now_ms = int(time.time() * 1000)
+            close_ms = min(candle_open_ts(now_ms, i) + INTERVAL_MS[i] for i in PRECOMPUTE_INTERVALS)
+            time.sleep((close_ms - now_ms) / 1000 + PRECOMPUTE_CLOSE_DELAY)
+            intervals = [i for i in PRECOMPUTE_INTERVALS if candle_open_ts(close_ms, i) == close_ms]
+            jobs = [(symbol, interval) for interval in intervals for symbol in self.popular_coins]
+            spacing = min(PRECOMPUTE_SPREAD * INTERVAL_MS[intervals[0]] / 1000, PRECOMPUTE_SPREAD_MAX) / len(jobs)
+            start = time.monotonic()
+            for n, (symbol, interval) in enumerate(jobs):
+                time.sleep(max(0, start + n * spacing - time.monotonic()))
                 try:
-                    requests.post(f"{self.telegram_api}/deleteMessage", data={'chat_id': chat_id, 'message_id': message_id_to_edit}, timeout=5)
+                    with METRICS.span('precompute', interval=interval): self.precompute(symbol, interval)
                 except Exception as e:
-                    print(f"Error deleting message: {e}")
-        else:
-            if message_id_to_edit: self.edit_message(chat_id, message_id_to_edit, caption)
-            else: self.send_message(chat_id, caption)
+                    log.error("Precompute failed for %s %s: %s", symbol, interval, e)
+
+    def precompute(self, symbol, interval):
+        """
+        Builds and caches `symbol`'s default `interval` chart (plus its forecast with PRECOMPUTE_AI)
+        for the current candle. With Gemini configured but PRECOMPUTE_AI off, charts would lack their
+        AI insights, so only the candles are fetched (which still saves the on-demand download).
+        """
+        days = CHART_DEFAULT_DAYS[interval]
+        if GEMINI_API_KEY and not PRECOMPUTE_AI:
+            self.get_kline_data(symbol, interval, days * INTERVAL_MS['1d'] // INTERVAL_MS[interval])
+            return
+        builds = [(('chart', symbol, interval, days), lambda: self.create_price_chart(symbol, interval, days))]
+        if GEMINI_API_KEY:
+            period = PRECOMPUTE_INTERVALS[interval]
+            def forecast():
+                reply = self.build_forecast_reply(symbol, period)
+                return reply if reply.get('photo') and not reply['partial'] else None # Don't pin a failed forecast for a whole candle
+            builds.append((('predict', symbol, period), forecast))
+        for key, build in builds:
+            cache_key, ttl = self.precompute_key(key)
+            with self.cache.lock(cache_key): # With a shared cache, one bot process builds it for all
+                if self.cache.get(cache_key) is not None: continue
+                value = build()
+                if value: self.cache.set(cache_key, value, ttl)
 
     def send_photo(self, chat_id, photo_data, caption="", reply_markup=None):
-        url = f"{self.telegram_api}/sendPhoto"
         files = {'photo': ('chart.png', base64.b64decode(photo_data), 'image/png')}
         data = {'chat_id': chat_id, 'caption': caption, 'parse_mode': 'Markdown'}
         if reply_markup: data['reply_markup'] = json.dumps(reply_markup)
-        try:
-            response = requests.post(url, files=files, data=data, timeout=30)
-            return response.json()
-        except Exception as e:
-            print(f"Error sending photo: {e}")
-        return None
+        return self.telegram_outbox.call('sendPhoto', data, files=files)
 
     def get_public_price(self, symbol):
-        url = f"{self.base_url}/v5/market/tickers"
-        params = {"category": "spot", "symbol": f"{symbol}USDT"}
+        """
+        (ticker, source) for symbol/USDT: from the live feed (Bybit's), else from the first
+        exchange that lists the pair, with source the label of whichever answered; (None, None) if none does.
+        """
+        if self.market_feed:
+            ticker = self.market_feed.get_ticker(symbol)
+            METRICS.cache('market_feed', bool(ticker))
+            if ticker:
+                self.market_feed.track([symbol])
+                return ticker, BybitAdapter.label
+        adapter, ticker = self.exchanges.first('ticker', lambda a: a.ticker(symbol))
+        if self.market_feed and adapter and adapter.name == 'bybit': self.market_feed.track([symbol]) # Only subscribe symbols Bybit knows
+        return ticker, adapter.label if ticker else None
+
+    def get_all_tickers(self, max_age=TICKER_SNAPSHOT_TTL):
+        """
+        Every USDT spot ticker from one bulk call to the first exchange that answers, keyed by base symbol.
+        The snapshot lives in the cache and is reused for `max_age` seconds; one caller (across
+        processes, with a shared cache) refreshes it while the rest wait. A failed refresh
+        serves the previous snapshot for up to TICKER_SNAPSHOT_KEEP seconds.
+        """
+        snapshot = self.cache.get('tickers:spot')
+        fresh = bool(snapshot) and time.time() - snapshot['at'] <= max_age
+        METRICS.cache('ticker_snapshot', fresh)
+        if fresh: return snapshot['tickers']
+        with self.cache.lock('tickers:spot'):
+            snapshot = self.cache.get('tickers:spot') or {'at': 0, 'tickers': {}}
+            if time.time() - snapshot['at'] <= max_age: return snapshot['tickers']
+            _, tickers = self.exchanges.first('tickers', lambda a: a.tickers() or None)
+            if tickers:
+                snapshot = {'at': time.time(), 'tickers': tickers}
+                self.cache.set('tickers:spot', snapshot, TICKER_SNAPSHOT_KEEP)
+        return snapshot['tickers']
+
+    def get_ticker_table(self):
+        """The bulk ticker snapshot as sorted columns (symbols, last prices, 24h change fractions), rebuilt only when the snapshot changes."""
+        tickers = self.get_all_tickers()
+        source, table = self.ticker_table
+        if source is tickers: return table
+        names = sorted(tickers)
+        table = (np.array(names, dtype=str), np.array([float(tickers[s].get('lastPrice') or 0) for s in names]),
+                 np.array([float(tickers[s].get('price24hPcnt') or 0) for s in names]))
+        self.ticker_table = (tickers, table)
+        return table
+
+    def on_price_update(self, symbol, price):
+        """Ticker hook (live feed and bulk sweeps): queues any alerts this price crosses."""
+        fired = self.alert_engine.evaluate(symbol, price)
+        if fired:
+            with self.alert_outbox_lock: self.alert_outbox.extend(fired)
+
+    def run_alert_loop(self):
+        """Sweeps alert symbols the live feed isn't streaming, and flushes triggered alerts in batches."""
+        last_sweep = 0
+        while True:
+            try:
+                time.sleep(ALERT_FLUSH_INTERVAL)
+                if time.monotonic() - last_sweep >= ALERT_POLL_INTERVAL:
+                    last_sweep = time.monotonic()
+                    self.update_symbols_cache() # Picks up new listings and tick sizes once the cached instruments expire
+                    symbols = [s for s in self.alert_engine.symbols() if not (self.market_feed and self.market_feed.get_ticker(s))]
+                    tickers = self.get_all_tickers() if symbols else {}
+                    for symbol in symbols:
+                        if symbol in tickers: self.on_price_update(symbol, float(tickers[symbol].get('lastPrice', 0)))
+                self.flush_alert_notifications()
+            except Exception as e:
+                log.error("Error in alert loop: %s", e)
+
+    def flush_alert_notifications(self):
+        """Sends every queued triggered alert, one message per chat."""
+        with self.alert_outbox_lock: fired, self.alert_outbox = self.alert_outbox, []
+        by_chat = {}
+        for alert in fired: by_chat.setdefault(alert['chat_id'], []).append(alert)
+        for chat_id, alerts in by_chat.items():
+            lines = []
+            for a in alerts:
+                verb = "rose above" if a['direction'] == 'above' else "fell below"
+                detail = f" _({a['note']})_" if a.get('note') else ""
+                fmt = self.price_precision(a['symbol'])
+                lines.append(f"• **{a['symbol']}** {verb} {fmt(a['price'])} — now {fmt(a['triggered_price'])}{detail}")
+            self.send_message(chat_id, f"🔔 **Price Alert{'s' if len(alerts) > 1 else ''}**\n\n" + "\n".join(lines))
+
+    def handle_alert_command(self, chat_id, text):
+        """/alert <symbol> above|below <price>, /alert <symbol> move <pct>, /alert list|remove <id>|clear"""
+        parts = text.split()
+        usage = ("🔔 **Price Alert Usage:**\n\n"
+                 "• `/alert BTC above 70000` - Notify when BTC rises above $70,000\n"
+                 "• `/alert ETH below 3000` - Notify when ETH falls below $3,000\n"
+                 "• `/alert SOL move 5` - Notify on a 5% move either way from now\n"
+                 "• `/alerts` - List your alerts\n"
+                 "• `/alert remove <id>` / `/alert clear` - Delete alerts")
+        if parts[0].lower() == '/alerts' or (len(parts) == 2 and parts[1].lower() == 'list'):
+            alerts = self.alert_engine.list_for_chat(chat_id)
+            if not alerts: self.send_message(chat_id, "🔔 You have no active alerts.\n\n" + usage); return
+            lines = [f"`#{a['id']}` **{a['symbol']}** {a['direction']} {self.price_precision(a['symbol'])(a['price'])}" + (f" _({a['note']})_" if a['note'] else "") for a in alerts]
+            self.send_message(chat_id, f"🔔 **Your Alerts ({len(alerts)}):**\n\n" + "\n".join(lines)); return
+        if len(parts) == 2 and parts[1].lower() == 'clear':
+            self.send_message(chat_id, f"🗑️ Removed {self.alert_engine.clear_chat(chat_id)} alert(s)."); return
+        if len(parts) == 3 and parts[1].lower() == 'remove':
+            alert_id = parts[2].lstrip('#')
+            removed = alert_id.isdigit() and self.alert_engine.remove(chat_id, int(alert_id))
+            self.send_message(chat_id, f"🗑️ Alert #{alert_id} removed." if removed else f"❌ No alert #{alert_id} found."); return
+        if len(parts) != 4 or parts[2].lower() not in ('above', 'below', 'move'):
+            self.send_message(chat_id, usage); return
         try:
-            response = requests.get(url, params=params, timeout=10)
-            return response.json() if response.status_code == 200 else {"error": f"HTTP {response.status_code}"}
-        except Exception as e:
-            return {"error": str(e)}
+            value = float(parts[3].replace(',', '').rstrip('%').lstrip('$'))
+        except ValueError:
+            self.send_message(chat_id, f"❌ Invalid number: `{parts[3]}`"); return
+        if value <= 0 or (parts[2].lower() == 'move' and value >= 100):
+            self.send_message(chat_id, "❌ Price must be positive and move percentages between 0 and 100."); return
+        if self.alert_engine.count_for_chat(chat_id) >= ALERT_MAX_PER_CHAT:
+            self.send_message(chat_id, f"❌ Alert limit reached ({ALERT_MAX_PER_CHAT}). Remove some with `/alert remove <id>`."); return
+
+        price_data = self.get_coin_price(parts[1])
+        if not price_data or 'price' not in price_data:
+            self.send_message(chat_id, f"❌ **'{parts[1]}' not found.** Check the symbol and try again."); return
+        symbol, current = price_data['base_symbol'], price_data['price']
+        fmt = self.price_precision(symbol)
+        direction = parts[2].lower()
+        if direction == 'move':
+            self.alert_engine.add_move(chat_id, symbol, value, current, update_id=self.journal.current())
+            self.send_message(chat_id, f"✅ Alert set: **{symbol}** moves ±{value:g}% from {fmt(current)} "
+                                       f"(above {fmt(current * (1 + value / 100))} or below {fmt(current * (1 - value / 100))})."); return
+        if (direction == 'above' and current >= value) or (direction == 'below' and current <= value):
+            self.send_message(chat_id, f"ℹ️ **{symbol}** is already {direction} {fmt(value)} (now {fmt(current)})."); return
+        alert_id = self.alert_engine.add(chat_id, symbol, direction, value, update_id=self.journal.current())
+        self.send_message(chat_id, f"✅ Alert `#{alert_id}` set: **{symbol}** {direction} {fmt(value)} (now {fmt(current)}).")
 
     def get_coin_price(self, symbol):
         original_symbol = symbol
         symbol = self.normalize_symbol(symbol)
-        result = self.get_public_price(symbol)
-        if result.get('retCode') == 0 and result.get('result', {}).get('list'):
-            ticker = result['result']['list'][0]
+        ticker, source = self.get_public_price(symbol)
+        if ticker:
             return {
-                'symbol': ticker.get('symbol', ''), 'base_symbol': symbol,
+                'symbol': ticker.get('symbol', ''), 'base_symbol': symbol, 'source': source,
                 'price': float(ticker.get('lastPrice', 0)),
                 'change24h': float(ticker.get('price24hPcnt', 0)) * 100,
                 'volume24h': float(ticker.get('volume24h', 0)),
+                'turnover24h': float(ticker.get('turnover24h', 0)),
                 'high24h': float(ticker.get('highPrice24h', 0)),
                 'low24h': float(ticker.get('lowPrice24h', 0)),
                 'bid': float(ticker.get('bid1Price', 0)),
@@ -825,14 +3280,26 @@ When referencing specific timestamps in your analysis, please format them as YYY
             matches = self.find_matching_symbols(original_symbol)
             return {'matches': matches, 'original_query': original_symbol}
 
+    def chart_link_signature(self, symbol, expires):
+        return hmac.new(self.chart_link_secret, f"{symbol}:{expires}".encode(), hashlib.sha256).hexdigest()[:24]
+
+    def chart_link(self, symbol, interval):
+        """Signed URL of the interactive chart, or None without CHART_WEB_URL. Expiry is rounded to the hour so replies stay cacheable."""
+        if not CHART_WEB_URL: return None
+        expires = (int(time.time()) // 3600 + 1) * 3600 + CHART_LINK_TTL
+        return f"{CHART_WEB_URL}/c/{symbol}/{interval}?exp={expires}&sig={self.chart_link_signature(symbol, expires)}"
+
     def send_chart(self, chat_id, symbol, interval='1h', days=7, message_id=None):
-        loading_msg = f"📊 Generating {symbol} chart..."
-        if message_id: self.edit_message(chat_id, message_id, loading_msg)
-        else:
-            result = self.send_message(chat_id, loading_msg)
-            if result and result.get('ok'): message_id = result['result']['message_id']
-        
-        chart_result = self.create_price_chart(symbol, interval, days)
+        key = ('chart', symbol, interval, days)
+        def precomputed(): # Only the image and insights are pre-built; the caption's price is current
+            chart_result = self.precomputed(key)
+            return chart_result and self.build_chart_reply(symbol, interval, days, chart_result)
+        self.respond_admitted(chat_id, key, lambda: self.build_chart_reply(symbol, interval, days),
+                              action='upload_photo', message_id=message_id, precomputed=precomputed)
+
+    def build_chart_reply(self, symbol, interval='1h', days=7, chart_result=None):
+        """Renders the chart (unless given create_price_chart()'s result) with caption and timeframe buttons. Returns a reply dict for respond()."""
+        chart_result = chart_result or self.create_price_chart(symbol, interval, days)
         
         if chart_result and chart_result.get('image'):
             image_base64 = chart_result['image']
@@ -845,11 +3312,11 @@ When referencing specific timestamps in your analysis, please format them as YYY
             if price_data and 'price' in price_data:
                 price = price_data['price']; change_24h = price_data['change24h']
                 emoji = "📈" if change_24h >= 0 else "📉"
-                caption += f"\n\n💰 **Price:** ${price:,.6f}\n{emoji} **24h:** {change_24h:+.2f}%"
+                caption += f"\n\n💰 **Price:** {self.price_precision(symbol)(price)}\n{emoji} **24h:** {change_24h:+.2f}%"
             
             caption += f"\n\n**Period:** {actual_days_used} days ({actual_interval_used} intervals)\n**Generated:** {datetime.now().strftime('%H:%M:%S UTC')}"
 
-            print(f"DEBUG send_chart: pattern_analysis content before check: '{pattern_analysis}'")
+            log.debug("send_chart: pattern_analysis content before check: '%s'", pattern_analysis)
 
             if pattern_analysis and pattern_analysis != "Pattern analysis not available.":
                 max_analysis_text_len = 700
@@ -860,51 +3327,160 @@ When referencing specific timestamps in your analysis, please format them as YYY
                 
                 caption += f"\n\n🧠 **AI Pattern Insights:**\n_{pattern_analysis}_"
             else:
-                print(f"DEBUG send_chart: Pattern analysis not appended. Value was: '{pattern_analysis}'")
+                log.debug("send_chart: Pattern analysis not appended. Value was: '%s'", pattern_analysis)
 
             keyboard = {"inline_keyboard": [
-                [{"text": "1H", "callback_data": f"chart_{symbol}_1h_3"},
-                 {"text": "4H", "callback_data": f"chart_{symbol}_4h_7"},
-                 {"text": "1D", "callback_data": f"chart_{symbol}_1d_30"}],
+                [{"text": i.upper(), "callback_data": f"chart_{symbol}_{i}_{CHART_DEFAULT_DAYS[i]}"} for i in CHART_INTERVALS[:3]],
+                [{"text": i.upper(), "callback_data": f"chart_{symbol}_{i}_{CHART_DEFAULT_DAYS[i]}"} for i in CHART_INTERVALS[3:]],
                 [{"text": "💰 Price", "callback_data": f"price_{symbol}"},
                  {"text": "🔄 Refresh", "callback_data": f"chart_{symbol}_{actual_interval_used}_{actual_days_used}"}]
             ]}
-            self.send_photo(chat_id, image_base64, caption, keyboard)
-            if message_id:
-                try: requests.post(f"{self.telegram_api}/deleteMessage", data={'chat_id': chat_id, 'message_id': message_id}, timeout=5)
-                except: pass
+            link = self.chart_link(symbol, actual_interval_used)
+            if link: keyboard["inline_keyboard"].append([{"text": "🔍 Interactive chart", "url": link}])
+            return {'photo': image_base64, 'caption': caption, 'reply_markup': keyboard}
         else:
             error_msg = f"❌ **Failed to generate chart for {symbol}**\n\nThis could be due to:\n• Insufficient/invalid data for selected period\n• Network issues or API rate limits\n• Invalid symbol\n\nTry a different period or symbol."
-            if message_id: self.edit_message(chat_id, message_id, error_msg)
-            else: self.send_message(chat_id, error_msg)
+            return {'text': error_msg}
 
     def send_message(self, chat_id, text, reply_markup=None, parse_mode='Markdown'):
-        url = f"{self.telegram_api}/sendMessage"
         data = {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode}
         if reply_markup: data['reply_markup'] = json.dumps(reply_markup)
-        try:
-            response = requests.post(url, data=data, timeout=10)
-            return response.json()
-        except Exception as e:
-            print(f"Error sending message: {e}")
-        return None
+        return self.telegram_outbox.call('sendMessage', data)
 
     def edit_message(self, chat_id, message_id, text, reply_markup=None, parse_mode='Markdown'):
-        url = f"{self.telegram_api}/editMessageText"
         data = {'chat_id': chat_id, 'message_id': message_id, 'text': text, 'parse_mode': parse_mode}
         if reply_markup: data['reply_markup'] = json.dumps(reply_markup)
+        return self.telegram_outbox.call('editMessageText', data)
+
+    def delete_message(self, chat_id, message_id):
+        self.telegram_outbox.call('deleteMessage', {'chat_id': chat_id, 'message_id': message_id}, wait=False)
+
+    def send_chat_action(self, chat_id, action='typing'):
+        self.telegram_outbox.call('sendChatAction', {'chat_id': chat_id, 'action': action}, wait=False)
+
+    def respond(self, chat_id, compute, action='typing', message_id=None):
+        """
+        Runs compute() (which returns a reply dict: {'text'} or {'photo', 'caption'}, plus an
+        optional 'reply_markup') and delivers the result in one Telegram call. Fast results
+        (within RESPONSE_FAST_DEADLINE) go straight out; slower ones show a chat action,
+        refreshed until done, instead of a loading message that is later edited or deleted.
+        With message_id, text replies edit that message in place. Returns the API response.
+        Inside a journaled update, slow replies are stored before delivery so a resumed
+        update re-sends (or skips, if already delivered) them rather than recomputing.
+        """
+        callback = getattr(self.update_context, 'callback', None)
+        key = self.journal.reply_key()
+        stored = self.journal.stored_reply(key) if key else None
+        if stored:
+            reply, delivered = stored
+            METRICS.inc('bot_journal_replays_total', delivered=str(delivered).lower())
+            if delivered: return {'ok': True}
+            response = self.deliver_reply(chat_id, reply, message_id, callback)
+            if response and response.get('ok'): self.journal.mark_delivered(key)
+            return response
+        future = self.response_executor.submit(self.profiler.wrap(lambda: self.compute_reply(compute)))
+        deadline, slow = RESPONSE_FAST_DEADLINE, False
+        while True:
+            try:
+                with self.profiler.waiting(): reply = future.result(deadline)
+                break
+            except FuturesTimeoutError:
+                self.send_chat_action(chat_id, action)
+                deadline, slow = CHAT_ACTION_REFRESH, True
+        if not (slow and key): return self.deliver_reply(chat_id, reply, message_id, callback)
+        self.journal.store_reply(key, reply)
+        response = self.deliver_reply(chat_id, reply, message_id, callback)
+        if response and response.get('ok'): self.journal.mark_delivered(key)
+        return response
+
+    def compute_reply(self, compute):
+        """compute()'s reply dict, or a short error reply if it raised."""
         try:
-            response = requests.post(url, data=data, timeout=10)
-            return response.json()
+            return compute()
+        except RenderBusy:
+            return {'text': "⏳ **Charts are paused for a moment** while the bot frees memory. Please try again shortly."}
         except Exception as e:
-            print(f"Error editing message: {e}")
-        return None
+            log.error("Error building reply: %s", e)
+            return {'text': "❌ Something went wrong while processing your request. Please try again."}
+
+    def respond_admitted(self, chat_id, key, compute, action='typing', message_id=None, precomputed=None, request_id=None):
+        """
+        respond() for expensive commands. The job goes through admission control (quotas, a
+        bounded cost-ordered queue, merging with identical jobs) and its reply is delivered from
+        the job's worker, so the update loop moves on at once. Over quota or over capacity, the
+        chat gets a short "try again" reply straight away. A reply from precomputed() (see
+        run_precompute_loop) is sent at once and costs the caller nothing. Replies are shared
+        between callers; request_id fills their REQUEST_ID_SLOT for this one.
+        """
+        context = self.update_context
+        callback = getattr(context, 'callback', None)
+        journal_key = self.journal.reply_key()
+        stored = self.journal.stored_reply(journal_key) if journal_key else None
+        if stored: # Resumed after a restart: the job already ran
+            reply, delivered = stored
+            METRICS.inc('bot_journal_replays_total', delivered=str(delivered).lower())
+            if not delivered and (self.deliver_reply(chat_id, reply, message_id, callback) or {}).get('ok'): self.journal.mark_delivered(journal_key)
+            return
+        reply = precomputed and precomputed()
+        if reply:
+            self.deliver_reply(chat_id, stamp_request_id(reply, request_id), message_id, callback)
+            return
+        waiter = {'chat_id': chat_id, 'user_id': getattr(context, 'user_id', None), 'update_id': getattr(context, 'update_id', None),
+                  'message_id': message_id, 'action': action, 'journal_key': journal_key, 'callback': callback, 'request_id': request_id}
+        if callback: callback['deferred'] = True # Answered by the job's worker, which may finish before submit() returns
+        status, wait = self.admission.submit(key, ADMISSION_COSTS[key[0]], self.profiler.wrap(compute), waiter)
+        if callback and status in ('quota', 'busy'): callback['deferred'] = False
+        if status == 'quota':
+            self.send_message(chat_id, f"⏳ **Easy there!** You've used your budget for charts and AI analysis for now. "
+                                       f"Please try again in {max(1, round(wait))}s.")
+        elif status == 'busy':
+            self.send_message(chat_id, "⏳ **The bot is busy right now.** Please try again in a minute.")
+        else:
+            self.send_chat_action(chat_id, action)
+            if journal_key: self.journal.defer() # Finished once the reply is delivered
+
+    def deliver_admitted(self, waiter, reply):
+        """Delivers an admitted job's reply to one waiter (None: the job expired in the queue)."""
+        if reply is None: reply = {'text': "⏳ **The bot is busy right now.** Please try again in a minute."}
+        reply = stamp_request_id(reply, waiter['request_id'])
+        journal_key = waiter['journal_key']
+        if journal_key: self.journal.store_reply(journal_key, reply)
+        response = self.deliver_reply(waiter['chat_id'], reply, waiter['message_id'], waiter['callback'])
+        if response and response.get('ok'):
+            if journal_key: self.journal.mark_delivered(journal_key)
+        else:
+            self.send_message(waiter['chat_id'], "❌ Sorry, there was an issue displaying the result. Please try again later.")
+        if journal_key: self.journal.finish(journal_key[0])
+
+    def deliver_reply(self, chat_id, reply, message_id=None, callback=None):
+        """
+        Sends the reply dict, or edits message_id with it. For a button tap (callback, see
+        handle_callback_query) a reply showing what this tap last delivered is not sent again:
+        the tap is answered "Up to date" instead, saving the edit or photo upload.
+        """
+        fingerprint = callback and reply_fingerprint(reply)
+        if fingerprint and fingerprint == self.callback_gate.fingerprint(callback['key']):
+            METRICS.inc('bot_callbacks_deduplicated_total', reason='unchanged')
+            self.settle_callback(callback, "✅ Up to date")
+            return {'ok': True}
+        if reply.get('photo'):
+            response = self.send_photo(chat_id, reply['photo'], reply.get('caption', ''), reply.get('reply_markup'))
+        else:
+            response = message_id and self.edit_message(chat_id, message_id, reply['text'], reply.get('reply_markup'))
+            if not (response and response.get('ok')): response = self.send_message(chat_id, reply['text'], reply.get('reply_markup'))
+        if callback: self.settle_callback(callback, fingerprint=fingerprint if response and response.get('ok') else None)
+        return response
+
+    def settle_callback(self, callback, text="", fingerprint=None):
+        """Answers a button tap once and closes it in the gate, which starts its debounce window."""
+        if callback['settled']: return
+        callback['settled'] = True
+        self.callback_gate.finish(callback['key'], fingerprint)
+        if time.monotonic() - callback['at'] < CALLBACK_ANSWER_DEADLINE: self.answer_callback_query(callback['query_id'], text)
 
     def answer_callback_query(self, callback_query_id, text=""):
-        url = f"{self.telegram_api}/answerCallbackQuery"
         data = {'callback_query_id': callback_query_id, 'text': text}
-        try: requests.post(url, data=data, timeout=5)
-        except Exception as e: print(f"Error answering callback: {e}")
+        self.telegram_outbox.call('answerCallbackQuery', data, wait=False)
 
     def create_popular_keyboard(self, start=0, per_page=9):
         keyboard, row = [], []
@@ -917,6 +3493,7 @@ When referencing specific timestamps in your analysis, please format them as YYY
         if start > 0: nav_row.append({"text": "⬅️ Previous", "callback_data": f"nav_{start-per_page}"})
         if start + per_page < len(self.popular_coins): nav_row.append({"text": "➡️ Next", "callback_data": f"nav_{start+per_page}"})
         if nav_row: keyboard.append(nav_row)
+        keyboard.append([{"text": "📋 Show All Prices", "callback_data": "showall_popular"}])
         keyboard.append([{"text": "🔍 Search Any Coin", "callback_data": "search_help"}])
         return {"inline_keyboard": keyboard}
 
@@ -939,7 +3516,9 @@ Hello {user_name}! I can help you check prices for ANY cryptocurrency on Bybit e
 • `/chart ETH` - Get Ethereum chart (now with AI pattern insights!)
 • `/analyze BTC 4h 7` - Get detailed AI chart pattern analysis for Bitcoin.
 • `/predict SOL 3d` - Get AI price forecast for Solana for the next 3 days.
+• `/alert BTC above 70000` - Get notified when Bitcoin crosses $70,000
 • `/popular` - Show popular coins
+• `/market` - Market overview heatmap
 • `/search doge` - Search for coins
 • `/help` - Show all commands
 
@@ -984,16 +3563,28 @@ I'll find it for you! 🔍📊📈
 • Provides: A chart showing historical data with an overlaid AI-generated predicted price path, plus textual analysis.
 • Periods: `24h`, `1d` (default), `3d`, `7d`.
 
+**🔔 Price Alerts (`/alert` command):**
+• `/alert BTC above 70000` / `/alert ETH below 3000`
+• `/alert SOL move 5` - Alert on a 5% move either way
+• `/alerts` - List alerts, `/alert remove <id>` - Delete one
+
 **📝 Other Commands:**
 • `/price <coin>` - Get specific price
+• `/price BTC ETH SOL` - Several prices in one table
+• `/watchlist` - Your saved coins (`/watchlist add|remove <coins>`)
+• `/portfolio` - Holdings value and PnL (`/portfolio add|remove <coin> <amount>`, `/portfolio history`)
+• `/market [N]` - Heatmap of the top N coins by volume (default 24)
 • `/search <query>` - Search for coins
 • `/popular` - Popular coins menu
 • `/list` - Info on available trading pairs
 
 **📊 Chart Intervals (for `/chart`, `/analyze`, and historical part of `/predict`):**
 • `1h` - Hourly
+• `2h` - 2-hour
 • `4h` - 4-hour 
+• `12h` - 12-hour
 • `1d` - Daily
+• `1w` - Weekly
 
 **🪙 Supported Formats:**
 • Symbol: `BTC`, `ETH`, `XRP`
@@ -1004,7 +3595,7 @@ I'll find it for you! 🔍📊📈
 • 🧠 **AI Pattern Insights in Caption:** Automated detection of common technical patterns.
 • 📱 Interactive timeframe buttons
 
-**Data Source:** Bybit Exchange API"""
+**Data Source:** """ + ", ".join(a.label for a in self.exchanges.adapters) + " exchange APIs (first to answer)"
         self.send_message(chat_id, help_text)
 
     def handle_analyze_command(self, chat_id, text):
@@ -1023,7 +3614,7 @@ I'll find it for you! 🔍📊📈
                                        "• `/analyze BTC` (default: 4h interval, 7 days context)\n"
                                        "• `/analyze ETH 1h` (1h interval, default: 7 days context)\n"
                                        "• `/analyze SOL 1d 30` (daily interval, 30 days context)\n\n"
-                                       "**Intervals:** `1h`, `4h`, `1d`.\n"
+                                       "**Intervals:** `1h`, `2h`, `4h`, `12h`, `1d`, `1w`.\n"
                                        "**Days (context):** Number of days of data (1-90). Analysis focuses on recent ~20 candles from this period.")
             return
 
@@ -1032,26 +3623,25 @@ I'll find it for you! 🔍📊📈
         days = 7          
 
         if len(parts) > 2:
-            if parts[2].lower() in ['1h', '4h', '1d']:
+            if parts[2].lower() in CHART_INTERVALS:
                 interval = parts[2].lower()
                 if len(parts) > 3 and parts[3].isdigit():
                     days = int(parts[3])
             elif parts[2].isdigit():
                 days = int(parts[2])
-                if len(parts) > 3 and parts[3].lower() in ['1h', '4h', '1d']:
+                if len(parts) > 3 and parts[3].lower() in CHART_INTERVALS:
                     interval = parts[3].lower()
         
-        if interval not in ['1h', '4h', '1d']:
-            self.send_message(chat_id, f"[{request_id}] ❌ Invalid interval: `{interval}`. Use: `1h`, `4h`, or `1d`."); return
+        if interval not in CHART_INTERVALS:
+            self.send_message(chat_id, f"[{request_id}] ❌ Invalid interval: `{interval}`. Use: `1h`, `2h`, `4h`, `12h`, `1d` or `1w`."); return
         if not (1 <= days <= 90): 
             self.send_message(chat_id, f"[{request_id}] ❌ Days (for context) must be between 1 and 90. You entered: {days}"); return
 
-        loading_msg_text = f"🧠 [{request_id}] Analyzing chart patterns for {symbol} ({interval}, {days}d context)... This may take a moment."
-        sent_message_info = self.send_message(chat_id, loading_msg_text)
-        message_id_to_edit = None
-        if sent_message_info and sent_message_info.get('ok'):
-            message_id_to_edit = sent_message_info['result']['message_id']
+        self.respond_admitted(chat_id, ('analyze', symbol, interval, days), lambda: self.build_analysis_reply(symbol, interval, days),
+                              request_id=request_id)
 
+    def build_analysis_reply(self, symbol, interval, days):
+        """Runs the /analyze pattern analysis. Returns a reply dict for respond(), with REQUEST_ID_SLOT for the caller's id."""
         analysis_result = self.get_dedicated_chart_pattern_analysis_for_analyze_command(symbol, interval, days)
         
         final_message_body = analysis_result
@@ -1066,19 +3656,133 @@ I'll find it for you! 🔍📊📈
         if len(final_message_body) > max_telegram_message_len:
             final_message_body = final_message_body[:max_telegram_message_len - len(ellipsis)] + ellipsis
         
-        final_message = f"🔍 [{request_id}] **{symbol} ({interval}, {days}d context) - AI Chart Pattern Analysis:**\n\n{final_message_body}"
+        final_message = f"🔍 {REQUEST_ID_SLOT} **{symbol} ({interval}, {days}d context) - AI Chart Pattern Analysis:**\n\n{final_message_body}"
+        return {'text': final_message}
 
-        edited_successfully = False
-        if message_id_to_edit:
-            edit_response = self.edit_message(chat_id, message_id_to_edit, final_message)
-            if edit_response and edit_response.get('ok'):
-                edited_successfully = True
-        
-        if not edited_successfully:
-            send_response = self.send_message(chat_id, final_message)
-            if not send_response or not send_response.get('ok'):
-                self.send_message(chat_id, f"[{request_id}] ❌ Sorry, there was an issue displaying the analysis for {symbol}. Please try again later.")
 
+    def handle_market_command(self, chat_id, text):
+        """/market [N]: one heatmap image of the top N coins by 24h volume."""
+        parts = text.split()
+        count = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else MARKET_OVERVIEW_DEFAULT
+        self.send_market_overview(chat_id, max(1, min(count, MARKET_OVERVIEW_MAX)))
+
+    def send_market_overview(self, chat_id, count=MARKET_OVERVIEW_DEFAULT):
+        self.respond(chat_id, lambda: self.build_market_reply(count), action='upload_photo')
+
+    def build_market_reply(self, count=MARKET_OVERVIEW_DEFAULT):
+        """Market heatmap reply, rendered at most once per MARKET_OVERVIEW_REFRESH window (shared via the cache)."""
+        window = int(time.time() // MARKET_OVERVIEW_REFRESH)
+        reply = self.cache.get_or_compute(f"market_overview:{count}:{window}", MARKET_OVERVIEW_REFRESH, lambda: self.render_market_reply(count))
+        return reply or {'text': "❌ **Market overview unavailable.** Please try again in a moment."}
+
+    def render_market_reply(self, count):
+        tickers = self.get_all_tickers()
+        if not tickers: return None
+        top = sorted(tickers.values(), key=lambda t: float(t.get('turnover24h') or 0), reverse=True)[:count]
+        symbols = [t['symbol'][:-4] for t in top]
+        prices = np.array([float(t.get('lastPrice') or 0) for t in top])
+        changes = np.array([float(t.get('price24hPcnt') or 0) * 100 for t in top])
+        sparklines = self.get_sparklines(symbols)
+        price_labels = [self.price_precision(s)(p) for s, p in zip(symbols, prices)]
+        image = self.render_guard.render(self.create_market_overview_chart, symbols, price_labels, changes, sparklines)
+        if not image: return None
+        up = int((changes >= 0).sum())
+        caption = (f"🌐 **Market Overview** — top {len(symbols)} by 24h volume\n\n"
+                   f"🟢 {up} up · 🔴 {len(symbols) - up} down · median {np.median(changes):+.2f}%\n"
+                   f"🕒 **Generated:** {datetime.now().strftime('%H:%M:%S UTC')}")
+        return {'photo': base64.b64encode(image).decode(), 'caption': caption,
+                'reply_markup': {"inline_keyboard": [[{"text": "🔄 Refresh", "callback_data": f"market_{count}"}]]}}
+
+    def get_sparklines(self, symbols, hours=24):
+        """Last `hours` hourly closes per symbol, from the candle store (fetching only what's missing, in parallel)."""
+        start_ms = candle_open_ts(int(time.time() * 1000), '1h') - (hours - 1) * INTERVAL_MS['1h']
+        candles = self.symbol_executor.map(lambda s: self.get_candles(s, '1h', start_ms), symbols)
+        return [c['close'][-hours:] for c in candles]
+
+    @staticmethod
+    def create_market_overview_chart(symbols, price_labels, changes, sparklines):
+        """
+        One image for the whole grid: a single imshow draws every cell's 24h-change colour
+        and a single LineCollection draws every sparkline. Runs in a render worker.
+        """
+        try:
+            stage_start = time.perf_counter()
+            cols = MARKET_OVERVIEW_COLUMNS
+            rows = -(-len(symbols) // cols)
+            grid = np.full(rows * cols, np.nan)
+            grid[:len(changes)] = changes
+            limit = max(1.0, min(10.0, float(np.abs(changes).max()) if len(changes) else 1.0))
+
+            with chart_figure(figsize=(2.2 * cols, 1.5 * rows + 0.6)) as fig:
+                ax = fig.subplots()
+                ax.set_facecolor('#0a0a0a')
+                ax.imshow(grid.reshape(rows, cols), cmap='RdYlGn', vmin=-limit, vmax=limit, aspect='auto',
+                          extent=(0, cols, rows, 0), alpha=0.85)
+
+                segments = []
+                for i, closes in enumerate(sparklines):
+                    if len(closes) < 2: continue
+                    col, row = i % cols, i // cols
+                    lo, hi = closes.min(), closes.max()
+                    y = (closes - lo) / (hi - lo) if hi > lo else np.full(len(closes), 0.5)
+                    x = col + 0.08 + np.linspace(0, 0.84, len(closes))
+                    segments.append(np.column_stack([x, row + 0.92 - y * 0.38]))
+                if segments: ax.add_collection(mcollections.LineCollection(segments, colors='#0a0a0a', linewidths=1.2, alpha=0.8))
+
+                for i, symbol in enumerate(symbols):
+                    col, row = i % cols, i // cols
+                    ax.text(col + 0.08, row + 0.22, symbol, color='#0a0a0a', fontsize=11, fontweight='bold', va='center')
+                    ax.text(col + 0.92, row + 0.22, f"{changes[i]:+.2f}%", color='#0a0a0a', fontsize=9, fontweight='bold', ha='right', va='center')
+                    ax.text(col + 0.08, row + 0.42, price_labels[i], color='#0a0a0a', fontsize=8, va='center')
+
+                ax.set_xticks(np.arange(cols + 1)); ax.set_yticks(np.arange(rows + 1))
+                ax.grid(True, color='#0a0a0a', linewidth=3); ax.tick_params(length=0, labelbottom=False, labelleft=False)
+                for spine in ax.spines.values(): spine.set_visible(False)
+                ax.set_title('Market Overview — 24h Change & Price (sparkline: last 24h)', color='#ffffff', fontsize=14, fontweight='bold', pad=12)
+
+                stage_start = METRICS.lap('render', stage_start, chart='market')
+                png = figure_png(fig, dpi=110)
+            METRICS.lap('savefig', stage_start, chart='market')
+            return png
+        except Exception as e:
+            log.error("Error rendering market overview: %s", e)
+            return None
+
+    def handle_profile_command(self, chat_id, text):
+        """/profile start [sample|cprofile] [seconds] [N] | stop | mem [stop] — admins only."""
+        parts = text.split()
+        action = parts[1].lower() if len(parts) > 1 else ''
+        if action == 'start':
+            mode = parts[2].lower() if len(parts) > 2 and parts[2].lower() in ('sample', 'cprofile') else PROFILE_MODE
+            numbers = [int(p) for p in parts[2:] if p.isdigit()]
+            seconds = numbers[0] if numbers else PROFILE_DEFAULT_SECONDS
+            every = numbers[1] if len(numbers) > 1 else 1
+            # Reports are plain text: function names and paths are full of underscores Markdown would reject
+            report = lambda summary: self.send_message(chat_id, f"📊 {summary}"[:4000], parse_mode=None)
+            if self.profiler.start(mode, seconds, every, on_stop=report):
+                self.send_message(chat_id, f"🔬 Profiling ({mode}) for {seconds}s" + (f", 1 in every {every} updates" if every > 1 else "") + ".")
+            else:
+                self.send_message(chat_id, "⚠️ A profiling session is already running. `/profile stop` ends it.")
+        elif action == 'stop':
+            if self.profiler.stop() is None: self.send_message(chat_id, "ℹ️ No profiling session is running.")
+        elif action == 'mem':
+            if len(parts) > 2 and parts[2].lower() == 'stop':
+                self.profiler.memory_stop(); self.send_message(chat_id, "🧠 tracemalloc stopped.")
+            else:
+                self.send_message(chat_id, self.profiler.memory_report()[:4000], parse_mode=None)
+        else:
+            self.send_message(chat_id, "🔬 **Profiling**\n\n"
+                "`/profile start [sample|cprofile] [seconds] [N]` - profile live traffic (every Nth update with cprofile)\n"
+                "`/profile stop` - stop now and report\n"
+                "`/profile mem` - tracemalloc baseline, then growth since it\n"
+                "`/profile mem stop` - stop tracemalloc\n\n"
+                f"Output goes to `{PROFILE_DIR}`. Status: {self.profiler.mode or 'idle'}.")
+
+    def toggle_profiling(self):
+        """SIGUSR1: starts a PROFILE_MODE session, or stops the running one; reports go to the log."""
+        if self.profiler.stop() is None:
+            self.profiler.start(PROFILE_MODE, PROFILE_DEFAULT_SECONDS, on_stop=lambda summary: log.info("%s", summary))
+            log.info("🔬 Profiling (%s) for %ss", PROFILE_MODE, PROFILE_DEFAULT_SECONDS)
 
     def handle_popular(self, chat_id):
         self.send_message(chat_id, "📈 **Popular Cryptocurrencies**\n\nClick on any coin to get its current price, or type any coin name to search:", self.create_popular_keyboard())
@@ -1091,30 +3795,23 @@ I'll find it for you! 🔍📊📈
                 "• `/chart ETH 4h` - Ethereum (4h intervals, 7 days default)\n"
                 "• `/chart DOGE 1d 30` - Dogecoin (daily, 30 days)\n\n"
                 "Charts now include **AI-powered pattern insights** in the caption!\n\n"
-                "**Intervals:** `1h`, `4h`, `1d`\n"
+                "**Intervals:** `1h`, `2h`, `4h`, `12h`, `1d`, `1w`\n"
                 "**Days:** Any number (1-365)")
             return
         symbol = parts[1].upper()
         interval = '1h' 
         days = 3 
         if len(parts) > 2:
-            if parts[2].lower() in ['1h', '4h', '1d']:
+            if parts[2].lower() in CHART_INTERVALS:
                 interval = parts[2].lower()
-                if interval == '1h': days = 3
-                elif interval == '4h': days = 7
-                elif interval == '1d': days = 30
-                
+                days = CHART_DEFAULT_DAYS[interval]
                 if len(parts) > 3 and parts[3].isdigit():
                     days = int(parts[3])
             elif parts[2].isdigit(): 
                  days = int(parts[2])
-        
-        if interval == '4h' and len(parts) <= 3 : days = 7 
-        if interval == '1d' and len(parts) <= 3 : days = 30 
-
 
-        if interval not in ['1h', '4h', '1d']:
-            self.send_message(chat_id, "❌ Invalid interval. Use: `1h`, `4h`, or `1d`."); return
+        if interval not in CHART_INTERVALS:
+            self.send_message(chat_id, "❌ Invalid interval. Use: `1h`, `2h`, `4h`, `12h`, `1d` or `1w`."); return
         if not (1 <= days <= 365):
             self.send_message(chat_id, "❌ Days must be between 1 and 365"); return
         self.send_chart(chat_id, symbol, interval, days)
@@ -1129,8 +3826,193 @@ I'll find it for you! 🔍📊📈
 
     def handle_price_command(self, chat_id, text):
         parts = text.split()
-        if len(parts) < 2: self.send_message(chat_id, "❌ Please specify a coin.\n\n**Examples:**\n• `/price BTC`\n• `/price ethereum`\n• `/price dogecoin`"); return
-        self.send_price_info(chat_id, " ".join(parts[1:]))
+        if len(parts) < 2: self.send_message(chat_id, "❌ Please specify a coin.\n\n**Examples:**\n• `/price BTC`\n• `/price ethereum`\n• `/price BTC ETH SOL`"); return
+        query = " ".join(parts[1:])
+        if len(parts) > 2 and query.upper() not in self.coin_aliases: # "/price bitcoin cash" is still one coin
+            self.send_price_table(chat_id, parts[1:], refresh_data="prices_" + ",".join(self.normalize_symbol(p) for p in parts[1:]))
+        else:
+            self.send_price_info(chat_id, query)
+
+    def send_price_table(self, chat_id, symbols, title="Prices", refresh_data=None, message_id=None):
+        self.respond(chat_id, lambda: self.build_price_table_reply(symbols, title, refresh_data), message_id=message_id)
+
+    def build_price_table_reply(self, symbols, title="Prices", refresh_data=None):
+        """One compact table for many symbols, served from a single bulk ticker snapshot."""
+        tickers = self.get_all_tickers()
+        if not tickers: return {'text': "❌ **Error getting prices.** Please try again in a moment."}
+        rows, missing, seen = [], [], set()
+        for raw in symbols:
+            symbol = self.normalize_symbol(raw)
+            if symbol in seen: continue
+            seen.add(symbol)
+            ticker = tickers.get(symbol)
+            if not ticker: missing.append(raw); continue
+            price = float(ticker.get('lastPrice', 0)); change = float(ticker.get('price24hPcnt', 0)) * 100
+            rows.append((symbol, self.price_precision(symbol)(price), f"{change:+.2f}%", "🟢" if change >= 0 else "🔴"))
+        if not rows: return {'text': f"❌ **None of these were found:** {', '.join(missing)}\n\nCheck the symbols or use `/search`."}
+        sym_w = max(len(r[0]) for r in rows); price_w = max(len(r[1]) for r in rows)
+        lines = [f"{dot} {sym.ljust(sym_w)} {price.rjust(price_w)} {chg.rjust(8)}" for sym, price, chg, dot in rows]
+        text = f"📋 **{title}** ({len(rows)} coins)\n\n```\n" + "\n".join(lines) + "\n```"
+        if missing: text += f"\n❓ Not found: {', '.join(missing)}"
+        text += f"\n🕒 **Updated:** {datetime.now().strftime('%H:%M:%S UTC')}"
+        keyboard = {"inline_keyboard": [[{"text": "🔄 Refresh", "callback_data": refresh_data}]]} if refresh_data and len(refresh_data) <= 64 else None
+        return {'text': text, 'reply_markup': keyboard}
+
+    def handle_watchlist_command(self, chat_id, text):
+        """/watchlist [add|remove <symbols...>]"""
+        parts = text.split()
+        action = parts[1].lower() if len(parts) > 1 else 'show'
+        symbols = [self.normalize_symbol(p) for p in parts[2:]]
+        if action in ('add', 'remove') and not symbols:
+            self.send_message(chat_id, "👀 **Watchlist Usage:**\n\n• `/watchlist` - Prices of your watched coins\n• `/watchlist add BTC ETH SOL`\n• `/watchlist remove ETH`"); return
+        if action == 'add':
+            tickers = self.get_all_tickers()
+            unknown = [s for s in symbols if tickers and s not in tickers]
+            symbols = [s for s in symbols if s not in unknown]
+            current = self.watchlists.get(chat_id)
+            room = WATCHLIST_MAX_SYMBOLS - len(current)
+            self.watchlists.add(chat_id, symbols[:max(room, 0)])
+            note = f"\n❓ Not found: {', '.join(unknown)}" if unknown else ""
+            if len(symbols) > room: note += f"\n⚠️ Watchlist is limited to {WATCHLIST_MAX_SYMBOLS} coins."
+            self.send_message(chat_id, f"✅ Watchlist updated.{note}\n\nUse `/watchlist` to see prices."); return
+        if action == 'remove':
+            self.watchlists.remove(chat_id, symbols)
+            self.send_message(chat_id, f"🗑️ Removed {', '.join(symbols)} from your watchlist."); return
+        self.send_watchlist(chat_id)
+
+    def send_watchlist(self, chat_id, message_id=None):
+        symbols = self.watchlists.get(chat_id)
+        if not symbols:
+            self.send_message(chat_id, "👀 Your watchlist is empty.\n\nAdd coins with `/watchlist add BTC ETH SOL`."); return
+        self.send_price_table(chat_id, symbols, "Your Watchlist", "prices_watchlist", message_id)
+
+    def handle_portfolio_command(self, chat_id, text):
+        """/portfolio [show|history] | add <coin> <amount> [price] | remove <coin> [amount]"""
+        parts = text.split()
+        action = parts[1].lower() if len(parts) > 1 else 'show'
+        usage = ("💼 **Portfolio Usage:**\n\n• `/portfolio` - Value and PnL of your holdings\n"
+                 "• `/portfolio add BTC 0.5` - Bought at the current price (or `/portfolio add BTC 0.5 60000`)\n"
+                 "• `/portfolio remove BTC 0.2` - Sold part (or `/portfolio remove BTC` for all)\n"
+                 f"• `/portfolio history` - Value over the last {PORTFOLIO_HISTORY_DAYS} days")
+        if action not in ('show', 'history', 'add', 'remove') or (action == 'add' and len(parts) not in (4, 5)) or (action == 'remove' and len(parts) not in (3, 4)):
+            self.send_message(chat_id, usage); return
+        if action == 'show': self.send_portfolio(chat_id); return
+        if action == 'history': self.send_portfolio_history(chat_id); return
+        try:
+            numbers = [float(p.replace(',', '').lstrip('$')) for p in parts[3:]]
+        except ValueError:
+            self.send_message(chat_id, "❌ Amounts and prices must be numbers, e.g. `/portfolio add BTC 0.5 60000`."); return
+        if any(n <= 0 for n in numbers):
+            self.send_message(chat_id, "❌ Amounts and prices must be positive."); return
+        symbol = self.normalize_symbol(parts[2])
+        if action == 'remove':
+            left = self.portfolios.remove(chat_id, symbol, numbers[0] if numbers else None, update_id=self.journal.current())
+            if left is None: self.send_message(chat_id, f"❌ No **{symbol}** in your portfolio."); return
+            self.send_message(chat_id, f"🗑️ **{symbol}** position {'now ' + f'{left:,.8g}' if left else 'closed'}.\n\nUse `/portfolio` to see your holdings."); return
+        amount = numbers[0]
+        tickers = self.get_all_tickers()
+        if symbol not in tickers:
+            self.send_message(chat_id, f"❌ **'{parts[2]}' not found.** Check the symbol and try again." if tickers else "❌ **Error getting prices.** Please try again in a moment."); return
+        if self.portfolios.count(chat_id) >= PORTFOLIO_MAX_POSITIONS and not self.portfolios.holds(chat_id, symbol):
+            self.send_message(chat_id, f"❌ Portfolio limit reached ({PORTFOLIO_MAX_POSITIONS} coins). Close a position with `/portfolio remove <coin>`."); return
+        price = numbers[1] if len(numbers) > 1 else float(tickers[symbol].get('lastPrice') or 0)
+        price = self.portfolios.add(chat_id, symbol, amount, price, update_id=self.journal.current()) # A resumed update keeps its first price
+        self.send_message(chat_id, f"✅ Added {amount:,.8g} **{symbol}** at {self.price_precision(symbol)(price)}.\n\nUse `/portfolio` to see your holdings.")
+
+    def send_portfolio(self, chat_id, message_id=None):
+        self.respond(chat_id, lambda: self.build_portfolio_reply(chat_id), message_id=message_id)
+
+    def build_portfolio_reply(self, chat_id):
+        """Value, PnL and 24h change of every position from one ticker snapshot, computed column-wise."""
+        symbols, amounts, costs = self.portfolios.get(chat_id)
+        if not symbols: return {'text': "💼 Your portfolio is empty.\n\nAdd holdings with `/portfolio add BTC 0.5`."}
+        table = self.get_ticker_table()
+        if not len(table[0]): return {'text': "❌ **Error getting prices.** Please try again in a moment."}
+        prices, changes = lookup_tickers(table, symbols)
+        priced = ~np.isnan(prices)
+        values = np.where(priced, amounts * np.nan_to_num(prices), 0)
+        pnl = np.where(priced, values - costs, 0)
+        day = np.where(priced, values - values / (1 + np.nan_to_num(changes)), 0)
+        total, cost, day_total = values.sum(), costs[priced].sum(), day.sum()
+        usd = lambda x: f"{'-' if x < 0 else '+'}${abs(x):,.2f}"
+        pct = lambda part, whole: f"{part / whole * 100:+.2f}%" if whole else "n/a"
+        order = np.argsort(-values, kind='stable')
+        shown = [i for i in order if priced[i]][:PORTFOLIO_SHOW_ROWS]
+        rows = [(symbols[i], format_compact(amounts[i]), f"${values[i]:,.2f}", pct(pnl[i], costs[i]), "🟢" if pnl[i] >= 0 else "🔴") for i in shown]
+        widths = [max(len(r[k]) for r in rows) for k in range(4)] if rows else [0] * 4
+        lines = [f"{dot} {sym.ljust(widths[0])} {amt.rjust(widths[1])} {val.rjust(widths[2])} {chg.rjust(widths[3])}" for sym, amt, val, chg, dot in rows]
+        text = (f"💼 **Your Portfolio** ({len(symbols)} coins)\n\n💰 **Value:** ${total:,.2f}\n"
+                f"{'📈' if total >= cost else '📉'} **PnL:** {usd(total - cost)} ({pct(total - cost, cost)})\n"
+                f"🕒 **24h:** {usd(day_total)} ({pct(day_total, total - day_total)})")
+        if lines: text += "\n\n```\n" + "\n".join(lines) + "\n```"
+        rest = int(priced.sum()) - len(shown)
+        if rest: text += f"\n…and {rest} more worth ${values.sum() - values[shown].sum():,.2f}"
+        if not priced.all(): text += f"\n❓ No price for: {', '.join(s for s, ok in zip(symbols, priced) if not ok)}"
+        text += f"\n🕒 **Updated:** {datetime.now().strftime('%H:%M:%S UTC')}"
+        keyboard = {"inline_keyboard": [[{"text": "🔄 Refresh", "callback_data": "portfolio_show"}, {"text": "📈 PnL History", "callback_data": "portfolio_history"}]]}
+        return {'text': text, 'reply_markup': keyboard}
+
+    def send_portfolio_history(self, chat_id, days=PORTFOLIO_HISTORY_DAYS):
+        if WORKER_PROFILE == 'price':
+            self.send_message(chat_id, "📵 **Charts are temporarily unavailable.** `/portfolio` still shows your current value and PnL."); return
+        symbols, amounts, costs = self.portfolios.get(chat_id)
+        if not symbols:
+            self.send_message(chat_id, "💼 Your portfolio is empty.\n\nAdd holdings with `/portfolio add BTC 0.5`."); return
+        holdings = hashlib.blake2b(json.dumps([symbols, amounts.tolist(), costs.tolist()]).encode(), digest_size=12).hexdigest()
+        self.respond_admitted(chat_id, ('portfolio', holdings, days), lambda: self.build_portfolio_history_reply(symbols, amounts, costs, days),
+                              action='upload_photo')
+
+    def build_portfolio_history_reply(self, symbols, amounts, costs, days=PORTFOLIO_HISTORY_DAYS):
+        """
+        Value of the current holdings over the last `days`: every holding's stored candles are
+        aligned onto one grid (align_closes) and valued with a single dot product, ending at the
+        ticker snapshot's prices like /portfolio.
+        """
+        interval = PORTFOLIO_HISTORY_INTERVAL
+        step = INTERVAL_MS[interval]
+        count = days * INTERVAL_MS['1d'] // step
+        start = candle_open_ts(int(time.time() * 1000), interval) - (count - 1) * step
+        series = list(self.symbol_executor.map(lambda s: self.get_closed_candles(s, interval, start), symbols))
+        closes = align_closes(series, start, step, count)
+        prices, _ = lookup_tickers(self.get_ticker_table(), symbols)
+        closes[:, -1] = np.where(np.isnan(prices), closes[:, -1], prices)
+        values = amounts @ closes
+        if not values.any(): return {'text': "❌ **No price history for your holdings.** Please try again in a moment."}
+        cost = float(costs.sum())
+        times = start + np.arange(count) * step
+        digest = hashlib.blake2b(values.tobytes() + np.float64(cost).tobytes(), digest_size=12).hexdigest() # Same series, same image
+        png = self.cache.get_or_compute(f"portfolio_history:{days}:{digest}", CHART_CACHE_TTL,
+                                        lambda: self.render_guard.render(self.draw_portfolio_history, times, values, cost, days))
+        first = values[np.argmax(values > 0)]
+        caption = (f"💼 **Portfolio Value** — last {days} days\n\n"
+                   f"💰 **Now:** ${values[-1]:,.2f} ({(values[-1] / first - 1) * 100:+.2f}% over the period)\n"
+                   f"{'📈' if values[-1] >= cost else '📉'} **PnL:** {'-' if values[-1] < cost else '+'}${abs(values[-1] - cost):,.2f}\n"
+                   f"_Current holdings at past prices ({interval} closes, then live)._")
+        keyboard = {"inline_keyboard": [[{"text": "💼 Holdings", "callback_data": "portfolio_show"}]]}
+        return {'photo': base64.b64encode(png).decode(), 'caption': caption, 'reply_markup': keyboard}
+
+    @staticmethod
+    def draw_portfolio_history(times, values, cost, days):
+        """Value line against the cost basis, shaded green above it and red below, as PNG bytes; runs in a render worker."""
+        stage_start = time.perf_counter()
+        with chart_figure(figsize=(12, 6)) as fig:
+            ax = fig.subplots()
+            x = mdates.date2num(times.astype('datetime64[ms]'))
+            ax.plot(x, values, color='#ffa502', linewidth=2)
+            ax.axhline(cost, color='#aaaaaa', linestyle='--', linewidth=1)
+            ax.fill_between(x, values, cost, where=values >= cost, interpolate=True, color='#00ff88', alpha=0.25)
+            ax.fill_between(x, values, cost, where=values < cost, interpolate=True, color='#ff4757', alpha=0.25)
+            ax.set_facecolor('#0a0a0a')
+            ax.grid(True, alpha=0.3, color='#333333')
+            ax.set_title(f'Portfolio Value ({days} days, dashed: cost basis)', color='#ffffff', fontsize=16, fontweight='bold', pad=20)
+            ax.tick_params(axis='both', colors='#ffffff')
+            ax.yaxis.set_major_formatter(price_format(2).axis)
+            ax.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d'))
+            for label in ax.xaxis.get_majorticklabels(): label.set(rotation=45, ha="right")
+            stage_start = METRICS.lap('render', stage_start, chart='portfolio')
+            png = figure_png(fig, dpi=120)
+        METRICS.lap('savefig', stage_start, chart='portfolio')
+        return png
 
     def handle_text_message(self, chat_id, text):
         text = text.strip()
@@ -1144,12 +4026,10 @@ I'll find it for you! 🔍📊📈
                 "• `/popular` - popular coins menu")
 
     def send_price_info(self, chat_id, symbol, message_id=None):
-        loading_msg = f"🔄 Searching for **{symbol}**..."
-        if message_id: self.edit_message(chat_id, message_id, loading_msg)
-        else:
-            result = self.send_message(chat_id, loading_msg)
-            if result and result.get('ok'): message_id = result['result']['message_id']
-        
+        self.respond(chat_id, lambda: self.build_price_reply(symbol), message_id=message_id)
+
+    def build_price_reply(self, symbol):
+        """Price card, suggestions or error for `symbol`. Returns a reply dict for respond()."""
         price_data = self.get_coin_price(symbol)
         if price_data and 'price' in price_data:
             price = price_data['price']; change_24h = price_data['change24h']
@@ -1157,32 +4037,47 @@ I'll find it for you! 🔍📊📈
             bid = price_data.get('bid',0); ask = price_data.get('ask',0); base_symbol = price_data['base_symbol']
             change_emoji = "🚀" if change_24h >=5 else "📈" if change_24h >=0 else "📉" if change_24h >= -5 else "💥"
             change_color = "🟢" if change_24h >=0 else "🔴"
-            price_str = f"${price:,.4f}" if price >=1 else f"${price:.8f}"
+            fmt = self.price_precision(base_symbol)
             spread = ((ask - bid) / price * 100) if price > 0 and bid > 0 and ask > 0 else 0
-            price_text = f"🪙 **{base_symbol}/USDT** Price\n\n💰 **Current Price:** {price_str}\n{change_emoji} **24h Change:** {change_color} {change_24h:+.2f}%\n\n📊 **24h Trading Data:**\n• **Volume:** ${volume_24h:,.0f}\n• **High:** ${high_24h:,.6f}\n• **Low:** ${low_24h:,.6f}\n\n💹 **Order Book:**\n• **Bid:** ${bid:.6f}\n• **Ask:** ${ask:.6f}\n• **Spread:** {spread:.3f}%\n\n🕒 **Updated:** {datetime.now().strftime('%H:%M:%S UTC')}\n📊 **Source:** Bybit Exchange"
+            price_text = f"🪙 **{base_symbol}/USDT** Price\n\n💰 **Current Price:** {fmt(price)}\n{change_emoji} **24h Change:** {change_color} {change_24h:+.2f}%\n\n📊 **24h Trading Data:**\n• **Volume:** {format_compact(volume_24h)} {base_symbol} (${format_compact(price_data['turnover24h'])})\n• **High:** {fmt(high_24h)}\n• **Low:** {fmt(low_24h)}\n\n💹 **Order Book:**\n• **Bid:** {fmt(bid)}\n• **Ask:** {fmt(ask)}\n• **Spread:** {spread:.3f}%\n\n🕒 **Updated:** {datetime.now().strftime('%H:%M:%S UTC')}\n📊 **Source:** {price_data['source']} Exchange"
             keyboard = {"inline_keyboard": [[{"text": "🔄 Refresh", "callback_data": f"price_{base_symbol}"}, {"text": "📈 Chart", "callback_data": f"chart_{base_symbol}"}],[{"text": "🔍 Search More", "callback_data": "search_help"}]]}
-            if message_id: self.edit_message(chat_id, message_id, price_text, keyboard)
-            else: self.send_message(chat_id, price_text, keyboard)
+            return {'text': price_text, 'reply_markup': keyboard}
         elif price_data and 'matches' in price_data:
             matches = price_data['matches']; original_query = price_data['original_query']
             if matches:
                 keyboard = self.create_suggestions_keyboard(matches, original_query)
                 suggestion_text = f"🔍 **'{original_query}' not found exactly.**\n\n**Did you mean one of these?**\nClick to get price:"
-                if message_id: self.edit_message(chat_id, message_id, suggestion_text, keyboard)
-                else: self.send_message(chat_id, suggestion_text, keyboard)
+                return {'text': suggestion_text, 'reply_markup': keyboard}
             else:
                 error_msg = f"❌ **Sorry, '{original_query}' not found.**\n\n🔍 **Try:**\n• Check spelling\n• Use symbol (BTC, ETH)\n• Use full name (bitcoin, ethereum)\n• `/popular` for popular coins"
-                if message_id: self.edit_message(chat_id, message_id, error_msg)
-                else: self.send_message(chat_id, error_msg)
+                return {'text': error_msg}
         else:
             error_msg = f"❌ **Error getting price for '{symbol}'**\n\n🔍 **Troubleshooting:**\n• Check your internet connection\n• Try again in a moment\n• Use `/popular` for verified coins"
-            if message_id: self.edit_message(chat_id, message_id, error_msg)
-            else: self.send_message(chat_id, error_msg)
+            return {'text': error_msg}
 
     def handle_callback_query(self, callback_query):
+        """
+        Dispatches a button tap. Repeats are collapsed (see CallbackGate): a tap whose twin
+        is still being handled, or was answered moments ago, gets a toast and no work. The
+        tap itself is answered once its reply goes out (by deliver_reply, possibly from an
+        admission worker), so an unchanged refresh can say "Up to date" instead of re-sending.
+        """
         query_id = callback_query['id']; data = callback_query['data']
         chat_id = callback_query['message']['chat']['id']; message_id = callback_query['message']['message_id']
-        self.answer_callback_query(query_id)
+        key = (chat_id, message_id, data)
+        status = self.callback_gate.begin(key)
+        if status != 'run':
+            METRICS.inc('bot_callbacks_deduplicated_total', reason=status)
+            self.answer_callback_query(query_id, "⏳ Working on it…" if status == 'joined' else "✅ Up to date")
+            return
+        callback = self.update_context.callback = {'query_id': query_id, 'key': key, 'at': time.monotonic(), 'settled': False, 'deferred': False}
+        try:
+            self.dispatch_callback(data, chat_id, message_id)
+        finally:
+            self.update_context.callback = None
+            if not callback['deferred']: self.settle_callback(callback) # Taps that sent nothing through deliver_reply
+
+    def dispatch_callback(self, data, chat_id, message_id):
         if data.startswith("price_"): self.send_price_info(chat_id, data.replace("price_", ""), message_id)
         elif data.startswith("nav_"): self.edit_message(chat_id, message_id, "📈 **Popular Cryptocurrencies**\n\nClick on any coin to get its current price, or type any coin name to search:", self.create_popular_keyboard(int(data.replace("nav_", ""))))
         elif data == "search_help": self.edit_message(chat_id, message_id, "🔍 **How to Search for Any Coin:**\n\n"
@@ -1195,6 +4090,13 @@ I'll find it for you! 🔍📊📈
                 "• `/search <coin name>`\n"
                 "• `/price <coin>`\n\n"
                 "I support 1000+ cryptocurrencies! 🚀")
+        elif data.startswith("market_"): self.send_market_overview(chat_id, int(data.replace("market_", "")) if data[7:].isdigit() else MARKET_OVERVIEW_DEFAULT)
+        elif data == "showall_popular": self.send_price_table(chat_id, self.popular_coins, "Popular Coins", "prices_popular")
+        elif data == "prices_popular": self.send_price_table(chat_id, self.popular_coins, "Popular Coins", "prices_popular", message_id)
+        elif data == "prices_watchlist": self.send_watchlist(chat_id, message_id)
+        elif data == "portfolio_show": self.send_portfolio(chat_id, message_id)
+        elif data == "portfolio_history": self.send_portfolio_history(chat_id)
+        elif data.startswith("prices_"): self.send_price_table(chat_id, data.replace("prices_", "").split(","), "Prices", data, message_id)
         elif data.startswith("chart_"):
             parts = data.replace("chart_", "").split("_")
             symbol = parts[0]; interval = parts[1] if len(parts) > 1 else '1h'
@@ -1202,6 +4104,40 @@ I'll find it for you! 🔍📊📈
             self.send_chart(chat_id, symbol, interval, days)
 
     def process_update(self, update):
+        """Dispatches one update, recording per-command count, latency and in-flight gauge."""
+        command = self.command_label(update)
+        sender = (update.get('message') or update.get('callback_query') or {}).get('from') or {}
+        self.update_context.update_id, self.update_context.user_id = update.get('update_id'), sender.get('id')
+        METRICS.gauge_add('bot_commands_in_flight', 1, command=command)
+        start = time.perf_counter()
+        try:
+            with self.profiler.track(command):
+                if WORKER_PROFILE == 'price' and command in PRICE_ONLY_UNAVAILABLE: self.reply_unavailable(update)
+                else: self.dispatch_update(update)
+        finally:
+            METRICS.gauge_add('bot_commands_in_flight', -1, command=command)
+            METRICS.observe('bot_command_seconds', time.perf_counter() - start, command=command)
+            METRICS.inc('bot_commands_total', command=command)
+
+    def command_label(self, update):
+        """Bounded metric label for an update: the /command, 'text', or the callback's prefix."""
+        if 'callback_query' in update:
+            prefix = str(update['callback_query'].get('data', '')).split('_')[0]
+            return f"callback_{prefix}" if prefix in METRIC_CALLBACK_PREFIXES else "callback_other"
+        text = update.get('message', {}).get('text', '')
+        if not text.startswith('/'): return 'text' if text else 'other'
+        command = text.split()[0][1:].split('@')[0].lower()
+        return command if command in METRIC_COMMANDS else 'other'
+
+    def reply_unavailable(self, update):
+        """Price-only workers answer chart and AI requests with a notice instead of loading those stacks."""
+        if 'callback_query' in update:
+            self.answer_callback_query(update['callback_query']['id'], "Charts and AI analysis are temporarily unavailable.")
+            return
+        self.send_message(update['message']['chat']['id'], "📵 **Charts and AI analysis are temporarily unavailable.**\n\n"
+                          "Prices, `/alert` and `/watchlist` work as usual. Please try again in a little while.")
+
+    def dispatch_update(self, update):
         try:
             if 'message' in update:
                 message = update['message']; chat_id = message['chat']['id']
@@ -1218,10 +4154,29 @@ I'll find it for you! 🔍📊📈
                         self.handle_predict_command(chat_id, corrected_text)
                     elif text.startswith('/analyze'): self.handle_analyze_command(chat_id, text)
                     elif text.startswith('/search'): self.handle_search(chat_id, text.replace('/search', '').strip())
+                    elif text.startswith('/alert'): self.handle_alert_command(chat_id, text)
+                    elif text.startswith('/watchlist'): self.handle_watchlist_command(chat_id, text)
+                    elif text.startswith('/portfolio'): self.handle_portfolio_command(chat_id, text)
+                    elif text.startswith('/market'): self.handle_market_command(chat_id, text)
+                    elif text.startswith('/profile') and chat_id in ADMIN_CHAT_IDS: self.handle_profile_command(chat_id, text)
                     elif text.startswith('/list'): self.send_message(chat_id, f"📊 **Available Coins:** {len(self.supported_symbols_cache)} trading pairs\n\nJust type any coin name to check its price! Popular ones include: BTC, ETH, XRP, ADA, DOT, LINK, LTC, BCH, UNI, SOL, MATIC, AVAX, ATOM, DOGE, SHIB, TRX, NEAR, FTM, etc.")
                     else: self.handle_text_message(chat_id, text)
             elif 'callback_query' in update: self.handle_callback_query(update['callback_query'])
-        except Exception as e: print(f"Error processing update: {e}")
+        except Exception as e:
+            METRICS.inc('bot_command_errors_total')
+            log.error("Error processing update: %s", e)
+
+    def handle_journaled(self, update):
+        with self.journal.handling(update['update_id']): self.process_update(update)
+
+    def resume_pending_updates(self):
+        """Finishes updates a previous run accepted but did not complete (replaying stored replies)."""
+        pending = self.journal.pending()
+        if not pending: return
+        log.info("Resuming %d unfinished update(s) from the journal", len(pending))
+        for update in pending:
+            METRICS.inc('bot_journal_resumed_total')
+            self.handle_journaled(update)
 
     def get_updates(self):
         url = f"{self.telegram_api}/getUpdates"
@@ -1230,7 +4185,7 @@ I'll find it for you! 🔍📊📈
             response = requests.get(url, params=params, timeout=15)
             return response.json() if response.status_code == 200 else None
         except Exception as e:
-            print(f"Error getting updates: {e}")
+            log.error("Error getting updates: %s", e)
         return None
 
     def run(self):
@@ -1238,20 +4193,188 @@ I'll find it for you! 🔍📊📈
         print(f"📱 Telegram Bot Token: {self.telegram_token[:10]}...")
         print(f"🔑 Bybit API Key: {self.api_key[:8]}...")
         self.update_symbols_cache()
+        if METRICS_PORT:
+            try:
+                start_metrics_server(METRICS_PORT)
+                print(f"📈 Metrics on http://0.0.0.0:{METRICS_PORT}/metrics")
+            except OSError as e: print(f"⚠️ Metrics endpoint disabled: {e}")
+        if hasattr(signal, 'SIGUSR1'): # Handlers hand off to a thread so they never run inside a held lock
+            signal.signal(signal.SIGUSR1, lambda *_: threading.Thread(target=self.toggle_profiling, daemon=True).start())
+            signal.signal(signal.SIGUSR2, lambda *_: threading.Thread(target=lambda: log.info("%s", self.profiler.memory_report()), daemon=True).start())
+        if self.market_feed:
+            self.market_feed.track(self.popular_coins)
+            self.market_feed.start()
+        threading.Thread(target=self.run_alert_loop, name="alerts", daemon=True).start()
+        threading.Thread(target=self.resume_pending_updates, name="journal-resume", daemon=True).start() # Don't hold up new updates
+        if CHART_WEB_PORT and WORKER_PROFILE != 'price':
+            try:
+                start_chart_server(self, CHART_WEB_PORT)
+                print(f"🔍 Interactive charts on http://0.0.0.0:{CHART_WEB_PORT}/c/<symbol>/<interval>")
+            except OSError as e: print(f"⚠️ Interactive charts disabled: {e}")
+        if PRECOMPUTE_ENABLED and WORKER_PROFILE != 'price':
+            threading.Thread(target=self.run_precompute_loop, name="precompute", daemon=True).start()
         print("✅ Bot is ready! Send /start to any chat to begin.")
         print("🌟 Enhanced features: Universal coin search, smart suggestions, fuzzy matching, chart fallback, /analyze command.")
         while True:
             try:
                 updates = self.get_updates()
                 if updates and updates.get('ok'):
-                    for update in updates.get('result', []):
-                        self.process_update(update)
-                        self.offset = update['update_id'] + 1
+                    batch = updates.get('result', [])
+                    fresh = self.journal.accept(batch) # Commits the offset before any work starts
+                    if batch: self.offset = max(u['update_id'] for u in batch) + 1
+                    for update in fresh: self.handle_journaled(update)
                 time.sleep(1)
             except KeyboardInterrupt: print("\n🛑 Bot stopped by user"); break
             except Exception as e: print(f"Error in main loop: {e}"); time.sleep(5)
 
+CHART_PAGE_HTML = """<!doctype html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
+<title>__SYMBOL__/USDT</title>
+<style>
+body{margin:0;background:#0a0a0a;color:#fff;font:13px system-ui,sans-serif}
+header{display:flex;gap:6px;align-items:center;padding:8px;flex-wrap:wrap}
+button{background:#1c1c1c;color:#fff;border:1px solid #333;border-radius:4px;padding:4px 10px}
+button.on{border-color:#ffa502;color:#ffa502}
+#info{margin-left:auto;color:#aaa}
+canvas{display:block;width:100vw;height:calc(100vh - 48px);touch-action:none}
+</style></head><body>
+<header><b>__SYMBOL__/USDT</b><span id="tf"></span><span id="info"></span></header>
+<canvas id="c"></canvas>
+<script>
+const QUERY = "__QUERY__", DECIMALS = __DECIMALS__, AXIS = 90;
+let interval = "__INTERVAL__", d = null, lo = 0, hi = 0, hover = -1, drag = null;
+const cv = document.getElementById("c"), ctx = cv.getContext("2d"), info = document.getElementById("info");
+const price = x => "$" + x.toLocaleString("en-US", {minimumFractionDigits: DECIMALS, maximumFractionDigits: DECIMALS});
+const compact = x => x >= 1e9 ? (x / 1e9).toFixed(1) + "B" : x >= 1e6 ? (x / 1e6).toFixed(1) + "M" : x >= 1e3 ? (x / 1e3).toFixed(1) + "K" : String(+x.toPrecision(4));
+const stamp = t => new Date(t * 1000).toISOString().slice(0, 16).replace("T", " ");
+
+async function load(iv) {
+  interval = iv;
+  for (const b of document.querySelectorAll("#tf button")) b.className = b.textContent === iv ? "on" : "";
+  const r = await fetch(`${iv}/data?${QUERY}`);
+  if (!r.ok) { info.textContent = `No data (${r.status})`; return; }
+  const buf = await r.arrayBuffer(), n = buf.byteLength / 24, col = i => new Float32Array(buf, n * 4 * i, n);
+  d = {t: new Uint32Array(buf, 0, n), o: col(1), h: col(2), l: col(3), c: col(4), v: col(5), n};
+  hi = n; lo = Math.max(0, n - 150); hover = -1;
+  history.replaceState(null, "", `${iv}?${QUERY}`);
+  draw();
+}
+
+function draw() {
+  const W = cv.clientWidth, H = cv.clientHeight, r = devicePixelRatio || 1;
+  cv.width = W * r; cv.height = H * r; ctx.setTransform(r, 0, 0, r, 0, 0);
+  ctx.fillStyle = "#0a0a0a"; ctx.fillRect(0, 0, W, H);
+  if (!d || !d.n) return;
+  const pw = W - AXIS, ph = H * 0.72, vt = H * 0.76, vh = H * 0.24 - 24, w = pw / (hi - lo);
+  let mn = Infinity, mx = -Infinity, vm = 0;
+  for (let i = lo; i < hi; i++) { mn = Math.min(mn, d.l[i]); mx = Math.max(mx, d.h[i]); vm = Math.max(vm, d.v[i]); }
+  const pad = (mx - mn) * 0.05 || mx * 0.01; mn -= pad; mx += pad;
+  const y = p => 10 + (mx - p) / (mx - mn) * ph;
+  ctx.font = "11px system-ui"; ctx.strokeStyle = "#222"; ctx.fillStyle = "#aaa";
+  for (let k = 0; k <= 5; k++) {
+    const p = mn + (mx - mn) * k / 5;
+    ctx.beginPath(); ctx.moveTo(0, y(p)); ctx.lineTo(pw, y(p)); ctx.stroke(); ctx.fillText(price(p), pw + 6, y(p) + 4);
+  }
+  for (let i = lo; i < hi; i++) {
+    const x = (i - lo) * w, bw = Math.max(1, w * 0.7), top = y(Math.max(d.o[i], d.c[i]));
+    ctx.strokeStyle = ctx.fillStyle = d.c[i] >= d.o[i] ? "#00ff88" : "#ff4757";
+    ctx.beginPath(); ctx.moveTo(x + w / 2, y(d.h[i])); ctx.lineTo(x + w / 2, y(d.l[i])); ctx.stroke();
+    ctx.fillRect(x + w * 0.15, top, bw, Math.max(1, y(Math.min(d.o[i], d.c[i])) - top));
+    if (vm) { const bar = d.v[i] / vm * vh; ctx.globalAlpha = 0.5; ctx.fillRect(x + w * 0.15, vt + vh - bar, bw, bar); ctx.globalAlpha = 1; }
+  }
+  ctx.fillStyle = "#aaa";
+  for (let i = lo; i < hi; i += Math.max(1, Math.ceil((hi - lo) / 8))) ctx.fillText(interval.endsWith("h") ? stamp(d.t[i]).slice(5) : stamp(d.t[i]).slice(0, 10), (i - lo) * w, H - 6);
+  const i = hover >= lo && hover < hi ? hover : hi - 1;
+  info.textContent = `${stamp(d.t[i])} UTC  O ${price(d.o[i])}  H ${price(d.h[i])}  L ${price(d.l[i])}  C ${price(d.c[i])}  V ${compact(d.v[i])}`;
+}
+
+const at = e => lo + Math.floor(e.offsetX / ((cv.clientWidth - AXIS) / (hi - lo)));
+cv.addEventListener("wheel", e => {
+  e.preventDefault(); if (!d) return;
+  const i = at(e), span = hi - lo, next = Math.min(d.n, Math.max(20, Math.round(span * (e.deltaY > 0 ? 1.2 : 1 / 1.2))));
+  lo = Math.max(0, Math.min(d.n - next, Math.round(i - (i - lo) / span * next))); hi = lo + next; draw();
+}, {passive: false});
+cv.addEventListener("pointerdown", e => { drag = {x: e.clientX, lo, hi}; cv.setPointerCapture(e.pointerId); });
+cv.addEventListener("pointerup", () => { drag = null; });
+cv.addEventListener("pointermove", e => {
+  if (!d) return;
+  if (drag) {
+    const span = drag.hi - drag.lo, shift = Math.round((drag.x - e.clientX) / ((cv.clientWidth - AXIS) / span));
+    lo = Math.min(Math.max(0, drag.lo + shift), d.n - span); hi = lo + span;
+  } else hover = at(e);
+  draw();
+});
+addEventListener("resize", draw);
+for (const iv of __INTERVALS__) {
+  const b = document.createElement("button"); b.textContent = iv; b.onclick = () => load(iv);
+  document.getElementById("tf").appendChild(b);
+}
+load(interval);
+</script></body></html>
+"""
+
+
+def create_chart_app(bot):
+    """
+    Flask app for interactive charts, drawn in the browser so zooming, panning and switching
+    timeframes cost no matplotlib renders or Telegram uploads. /c/<symbol>/<interval> is a
+    self-contained page; /c/<symbol>/<interval>/data its candles (see candle_payload), or JSON
+    columns with ?format=json, served from the candle store and cached for KLINE_TAIL_TTL.
+    Links are signed (see chart_link) so the endpoint can't pull arbitrary symbols through
+    our Bybit budget.
+    """
+    app = flask.Flask(__name__)
+
+    def checked(symbol, interval):
+        """Validates the path and signature; returns the query string to hand back to the page."""
+        if not re.fullmatch(r"[A-Z0-9]{1,20}", symbol) or interval not in CHART_INTERVALS: flask.abort(404)
+        args = flask.request.args
+        expires = int(args['exp']) if args.get('exp', '').isdigit() else 0
+        if expires < time.time() or not hmac.compare_digest(args.get('sig', ''), bot.chart_link_signature(symbol, expires)): flask.abort(403)
+        return f"exp={expires}&sig={args['sig']}"
+
+    @app.get("/c/<symbol>/<interval>")
+    def chart_page(symbol, interval):
+        query = checked(symbol, interval)
+        METRICS.inc('bot_chart_web_requests_total', kind='page')
+        decimals = bot.price_precision(symbol).decimals
+        html = (CHART_PAGE_HTML.replace("__SYMBOL__", symbol).replace("__INTERVAL__", interval).replace("__QUERY__", query)
+                .replace("__DECIMALS__", str(max(decimals, 2) if decimals is not None else 4)).replace("__INTERVALS__", json.dumps(CHART_INTERVALS)))
+        return flask.Response(html, mimetype="text/html", headers={'Cache-Control': "private, max-age=3600"})
+
+    @app.get("/c/<symbol>/<interval>/data")
+    def chart_data(symbol, interval):
+        checked(symbol, interval)
+        days = flask.request.args.get('days', '')
+        limit = -(-int(days) * INTERVAL_MS['1d'] // INTERVAL_MS[interval]) if days.isdigit() and int(days) else CHART_WEB_CANDLES
+        limit = min(limit, CHART_WEB_MAX_CANDLES)
+        def load():
+            candles = bot.get_candle_array(symbol, interval, limit)
+            return candles if candles is not None and len(candles) else None
+        candles = bot.cache.get_or_compute(f"web_candles:{symbol}:{interval}:{limit}", KLINE_TAIL_TTL, load)
+        if candles is None: flask.abort(404)
+        headers = {'Cache-Control': f"public, max-age={KLINE_TAIL_TTL}"}
+        if flask.request.args.get('format') == 'json':
+            METRICS.inc('bot_chart_web_requests_total', kind='json')
+            columns = {'t': (candles['ts'] // 1000).tolist(), **{f[0]: candles[f].tolist() for f in ('open', 'high', 'low', 'close', 'volume')}}
+            return flask.Response(json.dumps(columns, separators=(',', ':')), mimetype="application/json", headers=headers)
+        METRICS.inc('bot_chart_web_requests_total', kind='data')
+        return flask.Response(candle_payload(candles), mimetype="application/octet-stream", headers=headers)
+
+    return app
+
+
+def start_chart_server(bot, port=CHART_WEB_PORT):
+    """Serves create_chart_app(bot) on 0.0.0.0:<port> from a daemon thread."""
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING) # No access log line per candle fetch
+    server = make_server("0.0.0.0", port, create_chart_app(bot), threaded=True)
+    threading.Thread(target=server.serve_forever, name="chart-web", daemon=True).start()
+    return server
+
+
 def main():
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(threadName)s %(message)s", level=LOG_LEVEL)
     TELEGRAM_BOT_TOKEN = "replace TELEGRAM_BOT_TOKEN"
     BYBIT_API_KEY = "replace BYBIT_API_KEY"
     BYBIT_API_SECRET = "replace BYBIT_API_SECRET"
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+
+@pytest.fixture(scope="session")
+def env():
+    """A bot wired to the fake exchange and Telegram servers in fake_servers.py, shared by the session."""
+    env = benchmark.BenchmarkEnv()
+    yield env
+    env.close()
+
+
+@pytest.fixture
+def main(env):
+    return env.main
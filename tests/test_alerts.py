@@ -0,0 +1,36 @@
+"""AlertEngine.evaluate(): one price update crossing several alerts of a symbol fires each once and leaves nothing behind."""
+import os
+
+import pytest
+
+
+@pytest.fixture
+def engine(main, tmp_path):
+    return main.AlertEngine(os.path.join(tmp_path, "alerts.db"))
+
+
+def test_above_alerts_crossed_by_one_tick_all_fire(engine):
+    engine.add(1, 'BTC', 'above', 100); engine.add(1, 'BTC', 'above', 101); engine.add(2, 'BTC', 'above', 150)
+    assert sorted(a['price'] for a in engine.evaluate('BTC', 120)) == [100, 101]
+    assert [a['price'] for a in engine.list_for_chat(2)] == [150]
+
+
+def test_move_leg_and_plain_alerts_fire_together(engine):
+    up, down = engine.add_move(3, 'ETH', 10, 1000)
+    plain = [engine.add(3, 'ETH', 'above', 1050), engine.add(4, 'ETH', 'above', 1090)]
+    assert sorted(a['id'] for a in engine.evaluate('ETH', 2000)) == sorted([up] + plain)
+    assert not engine.list_for_chat(3) and 'ETH' not in engine.symbols() # The move alert's other leg went too
+
+
+def test_below_legs_crossed_together_all_fire(engine):
+    engine.add_move(5, 'SOL', 5, 100); engine.add(5, 'SOL', 'below', 96); engine.add(6, 'SOL', 'below', 90)
+    assert len(engine.evaluate('SOL', 80)) == 3
+    assert 'SOL' not in engine.symbols()
+    assert not engine.evaluate('SOL', 80)
+
+
+def test_fired_alerts_are_deleted_from_the_database(main, engine, tmp_path):
+    engine.add(1, 'BTC', 'above', 100); engine.add(2, 'BTC', 'above', 150); engine.add_move(3, 'BTC', 10, 100)
+    engine.evaluate('BTC', 120)
+    reloaded = main.AlertEngine(os.path.join(tmp_path, "alerts.db"))
+    assert [a['price'] for c in (1, 2, 3) for a in reloaded.list_for_chat(c)] == [150]
@@ -0,0 +1,21 @@
+"""A journaled update resumed after a crash replays its replies without repeating its writes."""
+
+
+def handle_twice(env, update_id, chat_id, text):
+    update = {'update_id': update_id, 'message': {'message_id': update_id, 'chat': {'id': chat_id}, 'from': {'first_name': 'Test'}, 'text': text}}
+    env.bot.journal.accept([update])
+    env.bot.handle_journaled(update)
+    env.bot.handle_journaled(update) # As resume_pending_updates() would after a crash before finish()
+
+
+def test_resumed_portfolio_changes_apply_once(env):
+    handle_twice(env, 5001, 501, '/portfolio add BTC 0.5 60000')
+    handle_twice(env, 5002, 501, '/portfolio remove BTC 0.1')
+    symbols, amounts, costs = env.bot.portfolios.get(501)
+    assert symbols == ['BTC'] and list(amounts) == [0.4] and list(costs) == [24000]
+
+
+def test_resumed_alerts_are_added_once(env):
+    handle_twice(env, 5003, 502, '/alert BTC move 5')
+    handle_twice(env, 5004, 502, '/alert BTC above 1000000')
+    assert sorted(a['direction'] for a in env.bot.alert_engine.list_for_chat(502)) == ['above', 'above', 'below']